@@ -1,6 +1,7 @@
 from flask import Flask
 
-from app.extensions import db, jwt
+from app.extensions import db, jwt, password_hasher
+from app.metrics import metrics
 from app.routes import auth_bp
 from config import Config
 from flask_cors import CORS
@@ -20,6 +21,8 @@ def create_app():
 
     db.init_app(app)
     jwt.init_app(app)
+    password_hasher.init_app(app)
+    metrics.init_app(app)
     # setup database migrations
     migrate.init_app(app, db)
 
@@ -0,0 +1,122 @@
+import hashlib
+import hmac
+import multiprocessing
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+SALT_LENGTH = 16
+SCRYPT_KEY_LENGTH = 32
+
+
+class HashingBusy(Exception):
+    """Raised when every hashing slot stayed taken for PASSWORD_HASH_TIMEOUT seconds."""
+
+
+def _scrypt(password, salt, n, r, p, key_length):
+    # OpenSSL refuses to use more than 32 MiB unless allowed to; scrypt needs 128 * n * r bytes
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('utf-8'), n=n, r=r, p=p,
+                          maxmem=132 * n * r, dklen=key_length)
+
+
+def make_hash(password, method, params):
+    """
+    Hash a password. `method` is 'pbkdf2:sha256' (params: iterations) or 'scrypt' (params: n, r, p).
+    Both produce werkzeug-style '<method>:<params>$<salt>$<hex>' strings.
+    """
+    if method == 'scrypt':
+        n, r, p = params
+        salt = secrets.token_hex(SALT_LENGTH // 2)
+        key = _scrypt(password, salt, n, r, p, SCRYPT_KEY_LENGTH)
+        return f"scrypt:{n}:{r}:{p}${salt}${key.hex()}"
+    iterations, = params
+    return generate_password_hash(password, method=f"{method}:{iterations}", salt_length=SALT_LENGTH)
+
+
+def check_hash(password, password_hash):
+    if password_hash.startswith('scrypt:'):
+        method, salt, expected = password_hash.split('$', 2)
+        n, r, p = (int(value) for value in method.split(':')[1:4])
+        key = _scrypt(password, salt, n, r, p, len(expected) // 2)
+        return hmac.compare_digest(key.hex(), expected)
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords with the configured algorithm and cost (PASSWORD_HASH_METHOD,
+    PASSWORD_HASH_ITERATIONS for pbkdf2, PASSWORD_HASH_SCRYPT_N/R/P for scrypt).
+    The work runs in a pool of PASSWORD_HASH_WORKERS processes, so a burst of logins neither holds
+    the GIL nor starves the request threads; at most PASSWORD_HASH_QUEUE_SIZE jobs wait for a worker,
+    and a caller that cannot get a slot within PASSWORD_HASH_TIMEOUT gets HashingBusy.
+    With 0 workers, hashing runs in the calling thread.
+    """
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256'
+        self.params = (260000,)
+        self.workers = 2
+        self.timeout = 10
+        self._slots = threading.BoundedSemaphore(8)
+        self._pool = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+        if self.method == 'scrypt':
+            self.params = (
+                app.config.get('PASSWORD_HASH_SCRYPT_N', 32768),
+                app.config.get('PASSWORD_HASH_SCRYPT_R', 8),
+                app.config.get('PASSWORD_HASH_SCRYPT_P', 1),
+            )
+        else:
+            self.params = (app.config.get('PASSWORD_HASH_ITERATIONS', 260000),)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 2)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', 10)
+        self._slots = threading.BoundedSemaphore(self.workers + app.config.get('PASSWORD_HASH_QUEUE_SIZE', 64))
+        self.close()
+        app.extensions['password_hasher'] = self
+
+    @property
+    def prefix(self):
+        """Method and parameters of a hash made with the current settings, e.g. 'pbkdf2:sha256:260000'."""
+        return ':'.join([self.method, *(str(param) for param in self.params)])
+
+    def hash(self, password):
+        return self._run(make_hash, password, self.method, self.params)
+
+    def verify(self, password, password_hash):
+        return self._run(check_hash, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        """Whether the hash was made with another algorithm or cost than the current settings."""
+        return password_hash.split('$', 1)[0] != self.prefix
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, function, *args):
+        if self.workers <= 0:
+            return function(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingBusy("Too many password checks in progress.")
+        try:
+            return self._get_pool().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # Fresh interpreters rather than forks of a process that is running request threads
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
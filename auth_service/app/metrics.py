@@ -0,0 +1,226 @@
+import bisect
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum of the observed values
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, ('le', _format_value(float(bound))))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}'
+
+
+class Collected(_Metric):
+    """A value read from elsewhere at scrape time; `callback` returns a number or {label values: number}."""
+
+    def __init__(self, name, documentation, callback, labels=(), kind='gauge'):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            yield f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+
+
+class Metrics:
+    """
+    Flask extension collecting runtime metrics and serving them on /metrics in Prometheus' text format.
+    Every request is timed and counted by route and status, and every SQL statement any engine of
+    the process runs is counted and timed, both in total and per request.
+    Services register their own values (cache sizes, Kafka counters, ...) with `collect`.
+    Values are per process.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._listening = False
+
+        self.http_requests = self.counter(
+            'http_requests_total', 'HTTP requests by method, route and status.', ('method', 'route', 'status'))
+        self.http_latency = self.histogram(
+            'http_request_duration_seconds', 'HTTP request latency by method and route.', ('method', 'route'))
+        self.request_queries = self.histogram(
+            'http_request_db_queries', 'SQL statements run per HTTP request.', ('route',), QUERY_COUNT_BUCKETS)
+        self.request_query_time = self.histogram(
+            'http_request_db_seconds', 'Time spent in SQL statements per HTTP request.', ('route',))
+        self.db_queries = self.counter('db_queries_total', 'SQL statements run.')
+        self.db_query_time = self.histogram('db_query_duration_seconds', 'SQL statement latency.')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._record_request)
+        app.add_url_rule('/metrics', 'metrics', self.render_response)
+        with self._lock:
+            if not self._listening:
+                # Engines are created lazily by Flask-SQLAlchemy, so listen on all of them
+                event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+                self._listening = True
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def collect(self, name, documentation, callback, labels=(), kind='gauge'):
+        """Expose the value(s) returned by `callback` when scraped. Registering a name again replaces it."""
+        metric = Collected(name, documentation, callback, labels, kind)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def render_response(self):
+        return Response(self.render(), content_type=CONTENT_TYPE)
+
+    @staticmethod
+    def _start_request():
+        g._metrics_started = time.perf_counter()
+        g._metrics_queries = 0
+        g._metrics_query_time = 0.0
+
+    def _record_request(self, response):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        self.http_latency.observe(time.perf_counter() - started, method=request.method, route=route)
+        self.http_requests.inc(method=request.method, route=route, status=response.status_code)
+        self.request_queries.observe(g.pop('_metrics_queries', 0), route=route)
+        self.request_query_time.observe(g.pop('_metrics_query_time', 0.0), route=route)
+        return response
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        self.db_queries.inc()
+        self.db_query_time.observe(elapsed)
+        if has_request_context() and '_metrics_started' in g:
+            g._metrics_queries += 1
+            g._metrics_query_time += elapsed
+
+
+# Registered on the app by create_app()
+metrics = Metrics()
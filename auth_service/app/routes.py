@@ -3,12 +3,19 @@ import re
 from flask import Blueprint, request, jsonify
 from app.models import User
 from app.extensions import db
-from app.services import create_jwt_token, hash_password, verify_password
+from app.services import create_jwt_token, hash_password, verify_password, upgrade_password_hash
+from app.hashing import HashingBusy
 
 from flask import current_app
 
 auth_bp = Blueprint('auth', __name__)
 
+
+@auth_bp.errorhandler(HashingBusy)
+def hashing_busy(error):
+    return jsonify({"msg": "Too many login attempts in progress, please try again later."}), 503
+
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -52,13 +59,16 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    current_app.logger.info("Data is %s", data)
-    current_app.logger.info("Username: %s, password: %s", username,  password)
+    current_app.logger.info("Login attempt for %s", username)
 
     user = User.query.filter_by(username=username).first()
 
     if not user or not verify_password(password, user.password_hash):
         return jsonify({"msg":"Invalid credentials"}), 401
 
+    # Stored hashes move to the current algorithm and cost as their users log in
+    if upgrade_password_hash(user, password):
+        db.session.commit()
+
     token = create_jwt_token(user)
     return jsonify({"msg":"Login successful", "access_token":token}), 200
\ No newline at end of file
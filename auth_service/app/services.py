@@ -1,14 +1,21 @@
 from flask_jwt_extended import create_access_token
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.extensions import password_hasher
 import datetime
 
 # Utility functions for Password and JWT tokens
 
 def hash_password(password):
-    return generate_password_hash(password)
+    return password_hasher.hash(password)
 
 def verify_password(password, password_hash):
-    return check_password_hash(password_hash, password)
+    return password_hasher.verify(password, password_hash)
+
+def upgrade_password_hash(user, password):
+    """After a successful login, re-hash the password if it was stored with older hashing settings."""
+    if not password_hasher.needs_rehash(user.password_hash):
+        return False
+    user.password_hash = hash_password(password)
+    return True
 
 def create_jwt_token(user):
     return create_access_token(
@@ -0,0 +1,88 @@
+"""
+Login throughput per password hashing setting.
+
+For every setting, stores a hash of the same password and then checks it the way /auth/login does:
+ - in the calling thread (one core), which gives logins/sec per core, and
+ - from --threads concurrent request threads through the PasswordHasher process pool
+   (--workers processes), which gives the throughput of one auth_service instance.
+
+    cd auth_service && python -m benchmarks.hashing --seconds 3 --workers 4 --threads 16
+    python -m benchmarks.hashing --setting pbkdf2:sha256:600000 --setting scrypt:16384:8:1
+"""
+import argparse
+import os
+import threading
+import time
+
+from flask import Flask
+
+from app.hashing import PasswordHasher, check_hash, make_hash
+
+DEFAULT_SETTINGS = ('pbkdf2:sha256:260000', 'pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1')
+PASSWORD = 'correct horse battery staple'
+
+
+def configure(setting, workers):
+    """A PasswordHasher for a setting such as 'pbkdf2:sha256:260000' or 'scrypt:32768:8:1'."""
+    parts = setting.split(':')
+    app = Flask('auth_service_benchmark')
+    if parts[0] == 'scrypt':
+        n, r, p = (int(part) for part in parts[1:])
+        app.config.update(PASSWORD_HASH_METHOD='scrypt', PASSWORD_HASH_SCRYPT_N=n,
+                          PASSWORD_HASH_SCRYPT_R=r, PASSWORD_HASH_SCRYPT_P=p)
+    else:
+        app.config.update(PASSWORD_HASH_METHOD=':'.join(parts[:2]), PASSWORD_HASH_ITERATIONS=int(parts[2]))
+    app.config.update(PASSWORD_HASH_WORKERS=workers)
+    return PasswordHasher(app)
+
+
+def single_core_rate(password_hash, seconds):
+    checks = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        assert check_hash(PASSWORD, password_hash)
+        checks += 1
+    return checks / (time.perf_counter() - started)
+
+
+def pooled_rate(hasher, password_hash, threads, seconds):
+    checks = [0] * threads
+    # Start the worker processes before timing
+    hasher.verify(PASSWORD, password_hash)
+    deadline = time.perf_counter() + seconds
+
+    def login(index):
+        while time.perf_counter() < deadline:
+            assert hasher.verify(PASSWORD, password_hash)
+            checks[index] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=login, args=(index,)) for index in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(checks) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--setting', action='append', help='hashing setting to measure (repeatable)')
+    parser.add_argument('--seconds', type=float, default=3, help='measuring time per setting and mode')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='hashing processes')
+    parser.add_argument('--threads', type=int, default=16, help='concurrent logins')
+    args = parser.parse_args()
+
+    print(f"cores={os.cpu_count()} workers={args.workers} threads={args.threads}")
+    for setting in args.setting or DEFAULT_SETTINGS:
+        hasher = configure(setting, args.workers)
+        password_hash = make_hash(PASSWORD, hasher.method, hasher.params)
+        single = single_core_rate(password_hash, args.seconds)
+        pooled = pooled_rate(hasher, password_hash, args.threads, args.seconds)
+        hasher.close()
+        print(f"{setting:>22}: {single:8.1f} logins/sec per core, {1000 / single:7.1f} ms each | "
+              f"pool: {pooled:8.1f} logins/sec")
+
+
+if __name__ == '__main__':
+    main()
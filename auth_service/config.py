@@ -12,3 +12,19 @@ class Config:
 
     # JWT configuration
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
+
+    # Password hashing: 'pbkdf2:sha256' (cost: PASSWORD_HASH_ITERATIONS) or 'scrypt' (cost: PASSWORD_HASH_SCRYPT_N/R/P).
+    # Hashes made with other settings are upgraded when their user next logs in.
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', 260000))
+    PASSWORD_HASH_SCRYPT_N = int(os.getenv('PASSWORD_HASH_SCRYPT_N', 32768))
+    PASSWORD_HASH_SCRYPT_R = int(os.getenv('PASSWORD_HASH_SCRYPT_R', 8))
+    PASSWORD_HASH_SCRYPT_P = int(os.getenv('PASSWORD_HASH_SCRYPT_P', 1))
+    # Processes doing the hashing (0 hashes in the request thread) and how many jobs may wait for one
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 64))
+    # Seconds a login waits for a hashing slot before it is answered with 503
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+
+    # Serve request and SQL metrics on /metrics (Prometheus text format)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
@@ -1,11 +1,17 @@
 from flask import Flask
 from flask_cors import CORS
 
-from app.extensions import db, jwt
+from app.extensions import db, jwt, rabbitmq, catalogue_cache, event_producer
+from app.search import search_engine
+from app.outbox import outbox_relay
+from app.idempotency import idempotency_store
+from app.metrics import metrics
+from app.supervisor import supervisor
+from app.utils import token_cache
 from app.routes import book_bp
 from app.broker import start_borrow_request_consumer, start_return_request_consumer
+from app.broker import start_catalogue_invalidation_consumer
 from config import Config
-import threading
 
 import logging
 
@@ -15,7 +21,46 @@ migrate = Migrate()
 logging.basicConfig(level=logging.DEBUG)
 
 
-def create_app():
+def start_consumer_pool(app, consumer, workers, name):
+    """
+    Start `workers` supervised background threads running the given RabbitMQ consumer.
+    Each thread opens its own connection and channel and gets its own database session,
+    so the broker spreads the queue across them. A thread whose consumer stops is restarted.
+    """
+    supervisor.start(app, f"{name} consumer", consumer, workers)
+
+
+def register_metrics():
+    """Expose the Book Service's own values on /metrics next to the request, SQL and RabbitMQ metrics."""
+    metrics.collect('kafka_events_sent_total', 'Kafka events handed to the producer.',
+                    lambda: event_producer.stats()['sent'], kind='counter')
+    metrics.collect('kafka_events_delivered_total', 'Kafka events acknowledged by the broker.',
+                    lambda: event_producer.stats()['delivered'], kind='counter')
+    metrics.collect('kafka_events_failed_total', 'Kafka events that could not be delivered.',
+                    lambda: event_producer.stats()['failed'], kind='counter')
+    metrics.collect('outbox_published_total', 'Outbox messages relayed to RabbitMQ or Kafka.',
+                    lambda: outbox_relay.published, kind='counter')
+    metrics.collect('jwt_cache_hits_total', 'Requests whose access token was already verified.',
+                    lambda: token_cache.hits, kind='counter')
+    metrics.collect('catalogue_cache_hits_total', 'Catalogue cache hits.',
+                    lambda: catalogue_cache.stats()['hits'], kind='counter')
+    metrics.collect('catalogue_cache_misses_total', 'Catalogue cache misses.',
+                    lambda: catalogue_cache.stats()['misses'], kind='counter')
+    metrics.collect('idempotent_replays_total', 'Borrow/return retries answered with their original reply.',
+                    lambda: idempotency_store.stats()['replayed'], kind='counter')
+
+
+def start_request_consumers(app):
+    """Start the borrow and return request consumer pools (worker.py, or the web process if CONSUMERS_ENABLED)."""
+    start_consumer_pool(app, start_borrow_request_consumer, app.config['BORROW_CONSUMER_WORKERS'], 'borrowing')
+    start_consumer_pool(app, start_return_request_consumer, app.config['RETURN_CONSUMER_WORKERS'], 'return')
+
+
+def create_app(consumers=None, web=True):
+    """
+    :param consumers: whether this process consumes the borrow/return request queues (default CONSUMERS_ENABLED).
+    :param web: whether this process serves the API, and so has a catalogue cache and search index to keep fresh.
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
 
@@ -23,38 +68,30 @@ def create_app():
 
     db.init_app(app)
     jwt.init_app(app)
+    token_cache.init_app(app)
+    rabbitmq.init_app(app)
+    event_producer.init_app(app)
+    catalogue_cache.init_app(app)
+    search_engine.init_app(app)
+    outbox_relay.init_app(app)
+    idempotency_store.init_app(app)
+    metrics.init_app(app)
+    register_metrics()
+    supervisor.init_app(app)
     # setup database migrations
     migrate.init_app(app, db)
 
     app.register_blueprint(book_bp, url_prefix='/book')
 
-    # Background thread for RabbitMQ consumer
-    def start_consumer_borrowing_thread():
-        def consume_in_thread():
-            # Ensure the app context is available in the thread
-            with app.app_context():
-                start_borrow_request_consumer()
-
-        consumer_thread = threading.Thread(target=consume_in_thread, daemon=True)
-        consumer_thread.start()
-        app.logger.info("RabbitMQ book service borrowing consumer thread started.")
-
-    def start_consumer_return_thread():
-        def consume_in_thread():
-            # Ensure the app context is available in the thread
-            with app.app_context():
-                start_return_request_consumer()
-
-        consumer_thread = threading.Thread(target=consume_in_thread, daemon=True)
-        consumer_thread.start()
-        app.logger.info("RabbitMQ book service return consumer thread started.")
-
-
-    def start_consumer_threads():
-        start_consumer_borrowing_thread()
-        start_consumer_return_thread()
-
-    # Start the consumer thread when the app starts
-    start_consumer_threads()
-
-    return app
\ No newline at end of file
+    # Start the consumer worker pools when the app starts
+    if consumers is None:
+        consumers = app.config['CONSUMERS_ENABLED']
+    if consumers:
+        start_request_consumers(app)
+    if web:
+        # Every process listens for catalogue changes made by the others to keep its cache and search index fresh
+        start_consumer_pool(app, start_catalogue_invalidation_consumer, 1, 'catalogue invalidation')
+    # Publishes the replies and events the consumers and routes queue in the outbox
+    start_consumer_pool(app, outbox_relay.run, 1, 'outbox relay')
+
+    return app
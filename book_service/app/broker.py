@@ -1,9 +1,18 @@
 import pika
 import json
+import time
 from flask import current_app
 from app.models import Book, Borrowing, db, WaitingList
+from app.extensions import rabbitmq, catalogue_cache
+from app import outbox
+from app.consumer import Consumer, Reject, decode
+from app.idempotency import idempotency_store
+from app.metrics import metrics
+from app.rabbitmq import deadline_of, is_expired, with_deadline
+from app.search import search_engine
+from app.supervisor import supervisor
 from datetime import datetime, timedelta
-from kafka import KafkaProducer
+from sqlalchemy.exc import IntegrityError
 import os
 
 import logging
@@ -11,119 +20,442 @@ import logging
 logging.getLogger("pika").setLevel(logging.INFO)
 
 ###########################
-# KAFKA PRODUCER SETUP
+# KAFKA EVENTS
 ###########################
 
-producer = KafkaProducer(
-    bootstrap_servers='kafka1:9092',
-    value_serializer=lambda v: json.dumps(v).encode('utf-8')
-)
-
 def publish_borrow_request(book_id, user_id):
-    """Publishes a borrow request to the Kafka topic when a book is unavailable."""
+    """Publishes a borrow request to the Kafka topic when a book is unavailable (through the outbox)."""
     event = {
         "book_id": book_id,
         "user_id": user_id,
         "timestamp": datetime.utcnow().isoformat()
     }
-    producer.send('borrow-requests', event)
-    current_app.logger.info(f"Published borrow request to Kafka: {event}")
+    outbox.send('borrow-requests', event)
+    current_app.logger.info(f"Queued borrow request for Kafka: {event}")
 
 
-def notify_user_book_available(user_id, book_id):
-    """Notify the user that the book is available."""
+def notify_users_book_available(user_ids, book_id):
+    """
+    Notify the given waiting users that the book is available, as a single Kafka event.
+    The event goes through the outbox, so it is sent if and only if the caller's transaction commits.
+    """
     event = {
-        "user_id": user_id,
         "book_id": book_id,
+        "user_ids": user_ids,
         "timestamp": datetime.utcnow().isoformat()
     }
-    producer.send('book-availability', event)  # Publish a Kafka message to notify the user
-    current_app.logger.info(f"Published book availability notification for User {user_id} and Book {book_id}")
+    outbox.send('book-availability', event)  # Publish a Kafka message to notify the users
+    current_app.logger.info(f"Queued book availability notification for {len(user_ids)} users and Book {book_id}")
+
+
+def claim_waiting_users(book_id, copies):
+    """
+    Remove the users to notify about `copies` returned copies of a book from its waiting list and
+    return their ids, oldest first. Runs inside the caller's transaction, so waiters are only claimed
+    if the return commits. With WAITLIST_NOTIFY_MODE=next only the first `copies` waiters are
+    claimed; otherwise the whole list is.
+    """
+    query = (
+        db.session.query(WaitingList.id, WaitingList.user_id)
+        .filter(WaitingList.book_id == book_id)
+        .order_by(WaitingList.id)
+    )
+    if current_app.config['WAITLIST_NOTIFY_MODE'] == 'next':
+        # Concurrent returns of the same book each claim different waiters
+        query = query.limit(copies).with_for_update(skip_locked=True)
+    entries = query.all()
+    if not entries:
+        return []
+
+    WaitingList.query.filter(WaitingList.id.in_([entry.id for entry in entries])).delete(synchronize_session=False)
+    # A user may have subscribed more than once; notify them once
+    return list(dict.fromkeys(entry.user_id for entry in entries))
+
+###########################
+# CATALOGUE CACHE INVALIDATION
+###########################
+
+CATALOGUE_EVENTS_EXCHANGE = 'book_catalogue_events'
+
+
+def publish_catalogue_change(book_ids, listings=False):
+    """
+    Announce a catalogue change to every Book Service process (including this one) through the outbox.
+    Call before committing the change: the broadcast is only sent if it commits, and this process drops
+    the books from its own cache right after the commit instead of waiting for the broadcast.
+    :param listings: also invalidate cached listings/search results and re-index the books in the
+    search engine (a book was added or its text changed).
+    """
+    book_ids = list(book_ids)
+    outbox.publish(
+        '',
+        json.dumps({'book_ids': book_ids, 'listings': listings}),
+        exchange=CATALOGUE_EVENTS_EXCHANGE,
+        exchange_options={'exchange_type': 'fanout'},
+    )
+
+    def invalidate_local_cache():
+        catalogue_cache.invalidate_books(book_ids)
+        if listings:
+            catalogue_cache.invalidate_listings()
+
+    outbox.after_commit(invalidate_local_cache)
+
+
+def handle_catalogue_event(properties, body):
+    event = decode(body)
+    catalogue_cache.invalidate_books(event.get('book_ids', []))
+    if event.get('listings'):
+        catalogue_cache.invalidate_listings()
+        search_engine.refresh(event.get('book_ids', []))
+
+
+# Every process has its own queue, so a failed event is not retried: a later change of the same books fixes it
+catalogue_event_consumer = Consumer(CATALOGUE_EVENTS_EXCHANGE, handle_catalogue_event, max_retries=0)
+
+
+def start_catalogue_invalidation_consumer():
+    """Listen for catalogue changes broadcast by any Book Service process (including this one)."""
+    try:
+        connection = rabbitmq.connect()
+        channel = connection.channel()
+
+        # Each process binds its own exclusive queue to the fanout exchange
+        channel.exchange_declare(exchange=CATALOGUE_EVENTS_EXCHANGE, exchange_type='fanout')
+        result = channel.queue_declare(queue='', exclusive=True)
+        channel.queue_bind(exchange=CATALOGUE_EVENTS_EXCHANGE, queue=result.method.queue)
+
+        channel.basic_consume(queue=result.method.queue, on_message_callback=catalogue_event_consumer)
+        current_app.logger.info("Started listening for catalogue changes...")
+        supervisor.consume(connection)
+    except Exception as e:
+        current_app.logger.error(f"Error in catalogue invalidation consumer: {str(e)}")
+        raise
 
 ###########################
 # BORROW BOOK
 ###########################
 
-def on_borrow_book_message(ch, method, properties, body):
-    with current_app.app_context():
-        # Parse the message
-        message = json.loads(body)
-        user_id = message.get('user_id')
-        book_id = message.get('book_id')
+def take_copies(book_id, count):
+    """
+    Atomically decrement a book's stock by `count` copies, only if that many are still available.
+    A conditional UPDATE cannot oversell no matter how many consumers race for the same book.
+    Returns False (changing nothing) if there were not enough copies left.
+    """
+    updated = Book.query.filter(Book.id == book_id, Book.available_copies >= count).update(
+        {Book.available_copies: Book.available_copies - count}, synchronize_session=False
+    )
+    return updated == 1
+
+
+def return_copies(book_id, count):
+    """Atomically put `count` copies of a book back in stock."""
+    Book.query.filter(Book.id == book_id).update(
+        {Book.available_copies: Book.available_copies + count}, synchronize_session=False
+    )
+
+
+def borrow_book(user_id, book_id, request_properties=None):
+    """
+    Apply a single borrow request and commit it together with its reply (queued in the outbox).
+    A retry of a request already applied (same idempotency key) gets the original reply instead.
+    Returns the response for the User Service. If the request fails, it is rolled back and the error raised,
+    so the consumer retries it.
+    """
+    response = {'user_id': user_id, 'book_id': book_id, 'status': 'failure', 'message': ''}
+    key = idempotency_store.key('borrow', user_id, book_id, request_properties)
 
-        current_app.logger.info(f"Received borrow request from user {user_id} and book {book_id}")
+    try:
+        replayed = idempotency_store.get(key) if key else None
+        if replayed is not None:
+            current_app.logger.info(f"Replaying borrow response for user {user_id} and book {book_id}")
+            db.session.rollback()
+            send_borrow_response(replayed, request_properties, direct=True)
+            return replayed
+
+        book = Book.query.get(book_id)
+        if not book:
+            response['message'] = f"Book with ID {book_id} not found."
+            current_app.logger.error(response['message'])
+        elif book.available_copies <= 0:
+            response['message'] = f"No copies available for book {book_id}. Subscribed."
+            current_app.logger.warning(response['message'])
 
-        response = {'user_id': user_id, 'book_id': book_id, 'status': 'failure', 'message': ''}
+            # Add user to the waiting list
+            waiting_list_entry = WaitingList(book_id=book.id, user_id=user_id)
+            db.session.add(waiting_list_entry)
 
-        try:
-            book = Book.query.get(book_id)
-            if not book:
-                response['message'] = f"Book with ID {book_id} not found."
-                current_app.logger.error(response['message'])
-            elif book.available_copies <= 0:
+            # Publish event to Kafka for borrow requests
+            # publish_borrow_request(book_id, user_id)
+        else:
+            # Check if the user has already borrowed this book
+            existing_borrow = Borrowing.query.filter_by(
+                user_id=user_id,
+                book_id=book_id,
+                returned_on=None  # Assuming you have a `returned` field to indicate the return status
+            ).first()
+
+            if existing_borrow:
+                response['message'] = f"User {user_id} has already borrowed book {book_id}."
+                current_app.logger.warning(response['message'])
+            elif not take_copies(book.id, 1):
+                # Another consumer took the last copy since we read the book
                 response['message'] = f"No copies available for book {book_id}. Subscribed."
                 current_app.logger.warning(response['message'])
+                db.session.add(WaitingList(book_id=book.id, user_id=user_id))
+            else:
+                return_by = datetime.utcnow() + timedelta(days=14)  # Set return date
+                borrowing = Borrowing(book_id=book.id, user_id=user_id, return_by=return_by)
 
-                # Add user to the waiting list
-                waiting_list_entry = WaitingList(book_id=book.id, user_id=user_id)
-                db.session.add(waiting_list_entry)
-                db.session.commit()
+                db.session.add(borrowing)
+                publish_catalogue_change([book.id])
 
-                # Publish event to Kafka for borrow requests
-                # publish_borrow_request(book_id, user_id)
-            else:
-                # Check if the user has already borrowed this book
-                existing_borrow = Borrowing.query.filter_by(
-                    user_id=user_id,
-                    book_id=book_id,
-                    returned_on=None  # Assuming you have a `returned` field to indicate the return status
-                ).first()
-
-                if existing_borrow:
-                    response['message'] = f"User {user_id} has already borrowed book {book_id}."
-                    current_app.logger.warning(response['message'])
-                else:
-                    return_by = datetime.utcnow() + timedelta(days=14)  # Set return date
-                    borrowing = Borrowing(book_id=book.id, user_id=user_id, return_by=return_by)
-
-                    book.available_copies -= 1
-                    db.session.add(borrowing)
-                    db.session.commit()
-
-                    response['status'] = 'success'
-                    response['message'] = f"Book borrowed successfully for user {user_id}."
-                    current_app.logger.info(response['message'])
+                response['status'] = 'success'
+                response['message'] = f"Book borrowed successfully for user {user_id}."
+                current_app.logger.info(response['message'])
 
-        except Exception as e:
-            response['message'] = f"Error processing borrow request: {str(e)}"
-            current_app.logger.error(response['message'])
+        # One commit for the change and its reply
+        send_borrow_response(response, request_properties)
+        if key:
+            idempotency_store.save(key, response)
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        replayed = idempotency_store.get(key) if key and isinstance(e, IntegrityError) else None
+        if replayed is not None:
+            # Another consumer applied a retry of this request first
+            send_borrow_response(replayed, request_properties, direct=True)
+            return replayed
+        current_app.logger.error(f"Error processing borrow request: {str(e)}")
+        raise
 
-        # Send response back to User Service
-        send_borrow_response(response)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+    return response
 
 
-def send_borrow_response(response):
+def request_ids(body):
+    """The (user_id, book_id) of a borrow/return request, or (None, None) if it cannot be read."""
     try:
-        # Set up RabbitMQ connection
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq'))
-        channel = connection.channel()
+        request_data = json.loads(body)
+        return request_data.get('user_id'), request_data.get('book_id')
+    except (ValueError, AttributeError):
+        return None, None
 
-        # Declare the response queue
-        channel.queue_declare(queue='borrow_response_queue', durable=True)
 
-        # Publish the response message
-        channel.basic_publish(
-            exchange='',
-            routing_key='borrow_response_queue',
-            body=json.dumps(response),
-            properties=pika.BasicProperties(
-                delivery_mode=2  # Persist the message
-            )
+def drop_expired(queue, properties):
+    """
+    Whether a request's deadline has passed, i.e. its caller stopped waiting for the reply.
+    Such requests are counted and dropped before they touch the database.
+    """
+    if not is_expired(properties, current_app.config['REQUEST_DEADLINE_GRACE_MS']):
+        return False
+    metrics.dropped(queue, 'expired')
+    current_app.logger.info(f"Dropping expired request {getattr(properties, 'correlation_id', None)} from {queue}")
+    return True
+
+
+def handle_borrow_request(properties, body):
+    if drop_expired('borrow_request_queue', properties):
+        return
+    # Parse the message
+    message = decode(body)
+    user_id = message.get('user_id')
+    book_id = message.get('book_id')
+
+    current_app.logger.info(f"Received borrow request from user {user_id} and book {book_id}")
+
+    # Apply the request; the reply goes back to the User Service process that asked
+    borrow_book(user_id, book_id, properties)
+
+
+def reply_borrow_failed(properties, body, error):
+    """Tell the caller of a dead-lettered borrow request that it failed."""
+    user_id, book_id = request_ids(body)
+    response = {'user_id': user_id, 'book_id': book_id, 'status': 'failure',
+                'message': f"Error processing borrow request: {str(error)}"}
+    send_borrow_response(response, properties, direct=True)
+
+
+borrow_request_consumer = Consumer('borrow_request_queue', handle_borrow_request, on_dead_letter=reply_borrow_failed)
+
+
+def on_borrow_book_message(ch, method, properties, body):
+    with current_app.app_context():
+        borrow_request_consumer(ch, method, properties, body)
+
+
+def _as_book_id(book_id):
+    try:
+        return int(book_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def borrow_books(requests, request_properties=None):
+    """
+    Apply a batch of (user_id, book_id) borrow requests in a single transaction, together with their
+    replies (queued in the outbox) when `request_properties` (one per request) is given.
+    All requested books are locked with one SELECT ... FOR UPDATE and the active borrowings of the
+    batch are loaded with one query; requests are then applied in order so duplicates inside the
+    batch see each other. Stock is taken with one conditional UPDATE per book, so databases without
+    row locks still cannot oversell: if another consumer got there first the whole batch is rolled back.
+    Requests with an idempotency key seen before (in the store or earlier in the batch) get the original reply.
+    Returns one response per request, in the same order.
+    """
+    if request_properties is not None:
+        keys = [
+            idempotency_store.key('borrow', user_id, book_id, properties)
+            for (user_id, book_id), properties in zip(requests, request_properties)
+        ]
+    else:
+        keys = [None] * len(requests)
+    replayed = idempotency_store.get_many([key for key in keys if key])
+
+    book_ids = {_as_book_id(book_id) for _, book_id in requests} - {None}
+    user_ids = {user_id for user_id, _ in requests}
+
+    books = {}
+    active = set()
+    if book_ids:
+        books = {
+            book.id: book
+            for book in Book.query.filter(Book.id.in_(book_ids)).order_by(Book.id).with_for_update().all()
+        }
+        active = set(
+            db.session.query(Borrowing.user_id, Borrowing.book_id).filter(
+                Borrowing.book_id.in_(book_ids),
+                Borrowing.user_id.in_(user_ids),
+                Borrowing.returned_on.is_(None),
+            ).all()
         )
 
+    remaining = {book_id: book.available_copies for book_id, book in books.items()}
+    taken = {}
+    return_by = datetime.utcnow() + timedelta(days=14)  # Set return date
+    responses = []
+    for (user_id, book_id), key in zip(requests, keys):
+        if key in replayed:
+            responses.append(replayed[key])
+            continue
+        response = {'user_id': user_id, 'book_id': book_id, 'status': 'failure', 'message': ''}
+        book = books.get(_as_book_id(book_id))
+
+        if not book:
+            response['message'] = f"Book with ID {book_id} not found."
+        elif remaining[book.id] <= 0:
+            response['message'] = f"No copies available for book {book_id}. Subscribed."
+            db.session.add(WaitingList(book_id=book.id, user_id=user_id))
+        elif (user_id, book.id) in active:
+            response['message'] = f"User {user_id} has already borrowed book {book_id}."
+        else:
+            remaining[book.id] -= 1
+            taken[book.id] = taken.get(book.id, 0) + 1
+            db.session.add(Borrowing(book_id=book.id, user_id=user_id, return_by=return_by))
+            active.add((user_id, book.id))
+            response['status'] = 'success'
+            response['message'] = f"Book borrowed successfully for user {user_id}."
+
+        responses.append(response)
+        if key:
+            idempotency_store.save(key, response)
+            replayed[key] = response
+
+    for book_id, count in taken.items():
+        if not take_copies(book_id, count):
+            raise RuntimeError(f"Stock of book {book_id} changed while the batch was being processed.")
+
+    if taken:
+        publish_catalogue_change(taken)
+    if request_properties is not None:
+        for response, properties in zip(responses, request_properties):
+            send_borrow_response(response, properties)
+    db.session.commit()
+    return responses
+
+
+def on_borrow_book_batch(ch, deliveries):
+    """
+    Process a batch of (method, properties, body) deliveries, reply to each and ack them all at once.
+    Expired requests are left out of the batch.
+    """
+    requests = []
+    batched = []
+    for _, properties, body in deliveries:
+        metrics.consumed('borrow_request_queue', properties)
+        if drop_expired('borrow_request_queue', properties):
+            continue
+        try:
+            message = decode(body)
+        except Reject as e:
+            borrow_request_consumer.fail(properties, body, e)
+            continue
+        requests.append((message.get('user_id'), message.get('book_id')))
+        batched.append((properties, body))
+
+    current_app.logger.info(f"Received batch of {len(requests)} borrow requests")
+
+    if requests:
+        try:
+            borrow_books(requests, [properties for properties, _ in batched])
+        except Exception as e:
+            # One bad request must not fail its neighbours: redo the batch one message at a time,
+            # so only the requests that fail on their own are retried
+            db.session.rollback()
+            current_app.logger.error(f"Batch borrow failed ({str(e)}), falling back to single requests.")
+            for properties, body in batched:
+                borrow_request_consumer.run(properties, body)
+
+    ch.basic_ack(delivery_tag=deliveries[-1][0].delivery_tag, multiple=True)
+
+
+def consume_borrow_batches(channel, batch_size, max_latency):
+    """
+    Pull up to `batch_size` borrow requests, waiting at most `max_latency` seconds after the first
+    one arrives, and hand them to on_borrow_book_batch.
+    """
+    batch = []
+    deadline = None
+    for method, properties, body in channel.consume('borrow_request_queue', inactivity_timeout=max_latency):
+        supervisor.heartbeat()
+        if method is not None:
+            if not batch:
+                deadline = time.monotonic() + max_latency
+            batch.append((method, properties, body))
+
+        if batch and (method is None or len(batch) >= batch_size or time.monotonic() >= deadline):
+            on_borrow_book_batch(channel, batch)
+            batch = []
+
+
+def send_borrow_response(response, request_properties=None, direct=False):
+    """
+    Reply to a borrow request. The reply is queued in the outbox and sent once the current transaction
+    commits, unless `direct` is set (nothing to commit, e.g. after a rollback).
+    """
+    try:
+        # Reply to the caller's private queue, falling back to the shared one for old clients
+        reply_to = getattr(request_properties, 'reply_to', None)
+        queue_options = None
+        if not reply_to:
+            reply_to = 'borrow_response_queue'
+            queue_options = {'durable': True}
+        correlation_id = getattr(request_properties, 'correlation_id', None)
+        # The reply expires with the request it answers
+        deadline = deadline_of(request_properties)
+
+        if direct:
+            properties = pika.BasicProperties(
+                delivery_mode=2,  # Persist the message
+                correlation_id=correlation_id,
+            )
+            if deadline is not None:
+                with_deadline(properties, deadline)
+            rabbitmq.publish(reply_to, json.dumps(response), properties=properties, queue_options=queue_options)
+        else:
+            outbox.publish(reply_to, json.dumps(response), correlation_id=correlation_id, queue_options=queue_options,
+                           deadline=deadline)
+
         current_app.logger.info(f"Sent borrow response: {response}")
-        connection.close()
     except Exception as e:
         current_app.logger.error(f"Error sending borrow response: {str(e)}")
 
@@ -132,34 +464,49 @@ def start_borrow_request_consumer():
     # Set up RabbitMQ connection and consumer
     try:
         # Get the Flask app object
-        connection = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))  # Change 'rabbitmq' to your host if needed
+        connection = rabbitmq.connect()
         channel = connection.channel()
 
         # Declare the queue to consume from
         channel.queue_declare(queue='borrow_request_queue', durable=True)
+        channel.basic_qos(prefetch_count=current_app.config['BORROW_CONSUMER_PREFETCH'])
+
+        batch_size = current_app.config['BORROW_BATCH_SIZE']
+        if batch_size > 1:
+            current_app.logger.info(f"Started listening for borrow requests in batches of {batch_size}...")
+            consume_borrow_batches(channel, batch_size, current_app.config['BORROW_BATCH_MAX_LATENCY_MS'] / 1000)
+            return
 
         # Set up the consumer callback
         channel.basic_consume(queue='borrow_request_queue', on_message_callback=on_borrow_book_message)
 
         current_app.logger.info("Started listening for borrow requests...")
         # Start consuming
-        channel.start_consuming()
+        supervisor.consume(connection)
 
     except Exception as e:
         current_app.logger.error(f"Error in consuming borrow messages: {str(e)}")
+        raise
 
 ###########################
 # RETURN BOOK
 ###########################
 
-def send_return_response(user_id, book_id, status, message):
-    """Send the return response back to User Service via RabbitMQ."""
+def send_return_response(user_id, book_id, status, message, request_properties=None, direct=False):
+    """
+    Send the return response back to the User Service process that asked, via RabbitMQ.
+    The reply is queued in the outbox and sent once the current transaction commits, unless `direct` is set.
+    """
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq'))
-        channel = connection.channel()
-
-        # Declare the response queue (if not already declared)
-        channel.queue_declare(queue='return_response_queue', durable=True)
+        # Reply to the caller's private queue, falling back to the shared one for old clients
+        reply_to = getattr(request_properties, 'reply_to', None)
+        queue_options = None
+        if not reply_to:
+            reply_to = 'return_response_queue'
+            queue_options = {'durable': True}
+        correlation_id = getattr(request_properties, 'correlation_id', None)
+        # The reply expires with the request it answers
+        deadline = deadline_of(request_properties)
 
         response_message = json.dumps({
             "user_id": user_id,
@@ -167,76 +514,112 @@ def send_return_response(user_id, book_id, status, message):
             "status": status,
             "message": message
         })
-        channel.basic_publish(
-            exchange='',
-            routing_key='return_response_queue',
-            body=response_message,
-            properties=pika.BasicProperties(
+        if direct:
+            properties = pika.BasicProperties(
                 delivery_mode=2,  # Make the message persistent
+                correlation_id=correlation_id,
             )
-        )
-        connection.close()
+            if deadline is not None:
+                with_deadline(properties, deadline)
+            rabbitmq.publish(reply_to, response_message, properties=properties, queue_options=queue_options)
+        else:
+            outbox.publish(reply_to, response_message, correlation_id=correlation_id, queue_options=queue_options,
+                           deadline=deadline)
     except Exception as e:
         print(f"Error sending response: {e}")
 
 
-def on_return_request(ch, method, properties, body):
-    """Callback function to handle return requests from User Service."""
+def handle_return_request(properties, body):
+    """Apply a return request from the User Service; errors are raised for the consumer to retry."""
+    if drop_expired('return_request_queue', properties):
+        return
+    request_data = decode(body)
     try:
-        request_data = json.loads(body)
         user_id = request_data['user_id']
         book_id = request_data['book_id']
+    except KeyError:
+        raise Reject("A return request needs a user_id and a book_id")
+    key = idempotency_store.key('return', user_id, book_id, properties)
+    try:
+        replayed = idempotency_store.get(key) if key else None
+        if replayed is not None:
+            # A retry of a return already applied: answer it as before
+            db.session.rollback()
+            send_return_response(user_id, book_id, replayed['status'], replayed['message'], properties, direct=True)
+            return
 
         # Find the borrowing record for the book and user
         borrowing = Borrowing.query.filter_by(user_id=user_id, book_id=book_id, returned_on=None).first()
 
-        if not borrowing:
-            # No active borrowing record found
-            send_return_response(user_id, book_id, 'failure', 'Book not found or not borrowed')
-        else:
-            # Mark the book as returned
-            borrowing.returned_on = datetime.utcnow()
-            db.session.commit()
+        returned = 0
+        if borrowing:
+            # Mark the book as returned, unless a concurrent consumer already did
+            returned = Borrowing.query.filter_by(id=borrowing.id, returned_on=None).update(
+                {Borrowing.returned_on: datetime.utcnow()}, synchronize_session=False
+            )
 
-            # Increase available copies of the book
+        if not returned:
+            # No active borrowing record found, or a concurrent duplicate return got to it first
+            db.session.rollback()
+            status, message = 'failure', 'Book not found or not borrowed'
+            send_return_response(user_id, book_id, status, message, properties)
+        else:
+            # Increase available copies of the book and claim its waiters in the same transaction
             book = Book.query.filter_by(id=book_id).first()
+            waiting_users = []
             if book:
-                book.available_copies += 1
-                db.session.commit()
-
-                # Check if there are users in the waiting list
-                waiting_list = WaitingList.query.filter_by(book_id=book_id).all()
-                if waiting_list:
-                    for entry in waiting_list:
-                        # Notify users in the waiting list that the book is now available
-                        notify_user_book_available(entry.user_id, book_id)
+                return_copies(book.id, 1)
+                waiting_users = claim_waiting_users(book.id, 1)
+                publish_catalogue_change([book.id])
 
-                    # Remove users from the waiting list after notifying
-                    WaitingList.query.filter_by(book_id=book_id).delete()
-                    db.session.commit()
+            # Queued before the notification, so the returning user's reply is published first
+            status = 'success'
+            message = f'Book "{book.title}" returned successfully' if book else 'Book returned successfully'
+            send_return_response(user_id, book_id, status, message, properties)
 
-            send_return_response(user_id, book_id, 'success', f'Book "{book.title}" returned successfully')
+            if waiting_users:
+                notify_users_book_available(waiting_users, book.id)
 
-        # Acknowledge the message
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        if key:
+            idempotency_store.save(key, {'status': status, 'message': message})
+        # One commit for the return, its reply and its events
+        db.session.commit()
 
     except Exception as e:
-        send_return_response(user_id, book_id, 'failure', f'Error processing return request: {str(e)}')
-        print(f"Error processing return request: {e}")
+        db.session.rollback()
+        replayed = idempotency_store.get(key) if key and isinstance(e, IntegrityError) else None
+        if replayed is not None:
+            # Another consumer applied a retry of this return first
+            send_return_response(user_id, book_id, replayed['status'], replayed['message'], properties, direct=True)
+            return
+        current_app.logger.error(f"Error processing return request: {str(e)}")
+        raise
+
+
+def reply_return_failed(properties, body, error):
+    """Tell the caller of a dead-lettered return request that it failed."""
+    user_id, book_id = request_ids(body)
+    send_return_response(user_id, book_id, 'failure', f'Error processing return request: {str(error)}', properties,
+                         direct=True)
+
+
+return_request_consumer = Consumer('return_request_queue', handle_return_request, on_dead_letter=reply_return_failed)
 
 
 def start_return_request_consumer():
     """Start consuming return requests from User Service."""
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq'))
+        connection = rabbitmq.connect()
         channel = connection.channel()
 
         # Declare the request queue
         channel.queue_declare(queue='return_request_queue', durable=True)
+        channel.basic_qos(prefetch_count=current_app.config['RETURN_CONSUMER_PREFETCH'])
 
         # Start consuming the queue
-        channel.basic_consume(queue='return_request_queue', on_message_callback=on_return_request)
+        channel.basic_consume(queue='return_request_queue', on_message_callback=return_request_consumer)
         current_app.logger.info("Started listening for return requests...")
-        channel.start_consuming()
+        supervisor.consume(connection)
     except Exception as e:
         current_app.logger.error(f"Error in return request consumer: {str(e)}")
+        raise
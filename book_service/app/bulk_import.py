@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+
+from sqlalchemy.exc import IntegrityError
+
+from app.broker import publish_catalogue_change
+from app.models import Book, db
+
+FIELDS = ('title', 'author', 'isbn', 'available_copies')
+FORMATS = {
+    'csv': 'csv',
+    'text/csv': 'csv',
+    'ndjson': 'ndjson',
+    'jsonl': 'ndjson',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+# Column sizes of the books table
+MAX_TEXT_LENGTH = 255
+MAX_ISBN_LENGTH = 13
+
+
+class RowError(ValueError):
+    """A row (or a CSV header) that cannot be imported."""
+
+
+def read_csv(stream):
+    """Yield (line number, row dict) from a CSV body with a title,author,isbn[,available_copies] header."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    missing = [field for field in FIELDS[:3] if field not in (reader.fieldnames or [])]
+    if missing:
+        raise RowError(f"CSV header is missing {', '.join(missing)}")
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_ndjson(stream):
+    """Yield (line number, row dict or RowError) from a newline-delimited JSON body; blank lines are skipped."""
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError(f"invalid JSON: {e}")
+            continue
+        yield line_number, row if isinstance(row, dict) else RowError("expected a JSON object")
+
+
+def validate(row):
+    """Return the books table values for a row, or raise RowError."""
+    if isinstance(row, RowError):
+        raise row
+    values = {}
+    for field, max_length in (('title', MAX_TEXT_LENGTH), ('author', MAX_TEXT_LENGTH), ('isbn', MAX_ISBN_LENGTH)):
+        value = row.get(field)
+        value = str(value).strip() if value is not None else ''
+        if not value:
+            raise RowError(f"{field} is required")
+        if len(value) > max_length:
+            raise RowError(f"{field} is longer than {max_length} characters")
+        values[field] = value
+
+    copies = row.get('available_copies')
+    if copies is None or copies == '':
+        copies = 1
+    try:
+        copies = int(copies)
+    except (TypeError, ValueError):
+        raise RowError("available_copies must be an integer")
+    if copies < 0:
+        raise RowError("available_copies cannot be negative")
+    values['available_copies'] = copies
+    return values
+
+
+class BulkImport:
+    """
+    Inserts a stream of rows in chunks of `chunk_size`, one transaction per chunk.
+    Each chunk's ISBNs are checked against the database with one IN query, and its new books are
+    written with a single executemany INSERT. The chunk's catalogue change (cache invalidation and
+    search re-indexing) is queued before its commit. Rows that fail validation or repeat an ISBN
+    are reported with their line number; only the first `max_errors` are kept.
+    """
+
+    def __init__(self, chunk_size=500, max_errors=1000):
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+        self._seen = set()
+
+    def run(self, rows):
+        chunk = []
+        for line_number, row in rows:
+            try:
+                values = validate(row)
+            except RowError as e:
+                self.reject(line_number, str(e))
+                continue
+            if values['isbn'] in self._seen:
+                self.reject(line_number, f"ISBN {values['isbn']} appears more than once in this import")
+                continue
+            self._seen.add(values['isbn'])
+            chunk.append((line_number, values))
+            if len(chunk) >= self.chunk_size:
+                self.insert(chunk)
+                chunk = []
+        if chunk:
+            self.insert(chunk)
+        return self
+
+    def reject(self, line_number, message):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line_number, "error": message})
+
+    def insert(self, chunk):
+        for attempt in range(2):
+            existing = {
+                isbn for (isbn,) in
+                db.session.query(Book.isbn).filter(Book.isbn.in_([values['isbn'] for _, values in chunk])).all()
+            }
+            new = [values for _, values in chunk if values['isbn'] not in existing]
+            try:
+                if new:
+                    db.session.execute(Book.__table__.insert(), new)
+                    book_ids = [
+                        book_id for (book_id,) in
+                        db.session.query(Book.id).filter(Book.isbn.in_([values['isbn'] for values in new])).all()
+                    ]
+                    publish_catalogue_change(book_ids, listings=True)
+                db.session.commit()
+                break
+            except IntegrityError:
+                # Another request added one of these ISBNs after the check; check again
+                db.session.rollback()
+                if attempt:
+                    raise
+
+        for line_number, values in chunk:
+            if values['isbn'] in existing:
+                self.reject(line_number, f"Book with ISBN {values['isbn']} already exists")
+        self.imported += len(new)
+
+    def summary(self):
+        return {
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "errors_truncated": self.rejected > len(self.errors),
+        }
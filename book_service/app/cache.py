@@ -0,0 +1,158 @@
+import importlib
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUStore:
+    """
+    Thread-safe in-process key/value store with LRU eviction and a per-entry TTL.
+    Any object with the same get_many/set_many/delete_many/clear/stats methods can replace it
+    (see CATALOGUE_CACHE_STORE), e.g. to share entries between the workers on one host.
+    """
+
+    def __init__(self, max_entries=50000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_many(self, keys):
+        """Return a dict with the fresh entries among `keys`."""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key, _MISSING)
+                if entry is _MISSING:
+                    self.misses += 1
+                    continue
+                expires_at, value = entry
+                if expires_at <= now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[key] = value
+        return found
+
+    def set_many(self, mapping):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class CatalogueCache:
+    """
+    Read-through cache for catalogue reads.
+    Book rows are cached one entry per book, and listings (all books, search results) only cache
+    the matching ids. A borrow or return therefore only invalidates the rows it touched, while
+    adding a book invalidates the listings, since it may belong to any of them.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.store = LRUStore()
+        self.invalidations = 0
+        # Bumped on every invalidation; a load that raced with one is returned but not cached
+        self._book_generation = 0
+        self._listing_generation = 0
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CATALOGUE_CACHE_ENABLED', True)
+        store_path = app.config.get('CATALOGUE_CACHE_STORE', 'app.cache.LRUStore')
+        module_name, class_name = store_path.rsplit('.', 1)
+        store_class = getattr(importlib.import_module(module_name), class_name)
+        self.store = store_class(
+            max_entries=app.config.get('CATALOGUE_CACHE_MAX_ENTRIES', 50000),
+            ttl=app.config.get('CATALOGUE_CACHE_TTL', 60),
+        )
+        app.extensions['catalogue_cache'] = self
+
+    def get_books(self, book_ids, loader):
+        """
+        Return the cached rows for `book_ids`, in order.
+        :param loader: called with the ids that missed, returns their rows as dicts (one query for all of them).
+        """
+        if not self.enabled:
+            return loader(book_ids)
+
+        keys = [f"book:{book_id}" for book_id in book_ids]
+        found = self.store.get_many(keys)
+        missing = [book_id for book_id, key in zip(book_ids, keys) if key not in found]
+        if missing:
+            generation = self._book_generation
+            loaded = {row["id"]: row for row in loader(missing)}
+            found.update({f"book:{book_id}": row for book_id, row in loaded.items()})
+            if generation == self._book_generation:
+                self.store.set_many({f"book:{book_id}": row for book_id, row in loaded.items()})
+        return [found[key] for key in keys if key in found]
+
+    def get_listing(self, name, loader):
+        """Return the cached list of book ids for a listing such as a search, calling `loader` on a miss."""
+        if not self.enabled:
+            return loader()
+
+        generation = self._listing_generation
+        key = f"listing:{generation}:{name}"
+        found = self.store.get_many([key])
+        if key in found:
+            return found[key]
+        book_ids = loader()
+        if generation == self._listing_generation:
+            self.store.set_many({key: book_ids})
+        return book_ids
+
+    def invalidate_books(self, book_ids):
+        with self._lock:
+            self._book_generation += 1
+            self.invalidations += 1
+        self.store.delete_many([f"book:{book_id}" for book_id in book_ids])
+
+    def invalidate_listings(self):
+        # Old listing keys become unreachable and age out of the LRU
+        with self._lock:
+            self._listing_generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        stats = self.store.stats()
+        stats.update({"enabled": self.enabled, "invalidations": self.invalidations})
+        return stats
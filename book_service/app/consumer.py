@@ -0,0 +1,134 @@
+import json
+
+import pika
+from flask import current_app
+
+from app.extensions import rabbitmq
+from app.metrics import metrics, queue_label
+from app.rabbitmq import deadline_of, with_deadline
+
+# Header counting how many times a message was retried
+RETRY_COUNT_HEADER = 'x-retry-count'
+# Header telling why a message was dead-lettered
+ERROR_HEADER = 'x-error'
+
+retried = metrics.counter('rabbitmq_retried_total', 'RabbitMQ messages scheduled for another attempt, by queue.',
+                          ('queue',))
+dead_lettered = metrics.counter('rabbitmq_dead_lettered_total', 'RabbitMQ messages moved to a dead-letter queue.',
+                                ('queue',))
+
+
+class Reject(Exception):
+    """Raised by a handler for a message that can never be processed; it is dead-lettered right away."""
+
+
+def decode(body):
+    """The JSON object in a message body; anything else is rejected."""
+    try:
+        message = json.loads(body)
+    except ValueError as e:
+        raise Reject(f"Invalid JSON: {e}")
+    if not isinstance(message, dict):
+        raise Reject("The message is not a JSON object")
+    return message
+
+
+def retry_count(properties):
+    return int((getattr(properties, 'headers', None) or {}).get(RETRY_COUNT_HEADER, 0))
+
+
+class Consumer:
+    """
+    Runs `handler(properties, body)` for each message of `queue` and settles the message afterwards, so a
+    failing message neither blocks the queue nor gets lost:
+    - if the handler returns, the message is acked;
+    - if it raises, the message is published to a delay queue '<queue>.retry.<ms>' and acked. The delay queue
+      has no consumers: the message expires there and the broker dead-letters it back to `queue`. The delay
+      starts at CONSUMER_RETRY_DELAY_MS and doubles with every retry, up to CONSUMER_RETRY_MAX_DELAY_MS;
+    - after `max_retries` retries (CONSUMER_MAX_RETRIES by default), or straight away if the handler raises
+      Reject, the message goes to `dead_letter_queue` ('<queue>.dead' by default) with the error in its
+      headers, and `on_dead_letter(properties, body, error)` is called (e.g. to reply with a failure).
+    The message is only acked once its retry or dead letter was published. Handlers run in an app context.
+    """
+
+    def __init__(self, queue, handler, max_retries=None, dead_letter_queue=None, on_dead_letter=None):
+        self.queue = queue
+        self.handler = handler
+        self.max_retries = max_retries
+        self.dead_letter_queue = dead_letter_queue or f'{queue}.dead'
+        self.on_dead_letter = on_dead_letter
+
+    def __call__(self, ch, method, properties, body):
+        """on_message_callback for basic_consume."""
+        self.process(properties, body)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def process(self, properties, body):
+        """Count a delivery and run it; the caller acks it."""
+        metrics.consumed(self.queue, properties)
+        self.run(properties, body)
+
+    def run(self, properties, body):
+        """Run the handler on a message, retrying or dead-lettering it if that fails."""
+        try:
+            self.handler(properties, body)
+        except Exception as e:
+            self.fail(properties, body, e)
+
+    def fail(self, properties, body, error):
+        """Retry a message the handler failed on, or dead-letter it once it is out of retries."""
+        max_retries = self.max_retries
+        if max_retries is None:
+            max_retries = current_app.config.get('CONSUMER_MAX_RETRIES', 3)
+        attempt = retry_count(properties)
+        if isinstance(error, Reject) or attempt >= max_retries:
+            self.dead_letter(properties, body, error)
+            return
+
+        config = current_app.config
+        delay = int(min(config.get('CONSUMER_RETRY_DELAY_MS', 1000) * 2 ** attempt,
+                        config.get('CONSUMER_RETRY_MAX_DELAY_MS', 30000)))
+        current_app.logger.warning(
+            f"Message from {self.queue} failed ({error!r}), retry {attempt + 1} of {max_retries} in {delay} ms."
+        )
+        rabbitmq.publish(
+            f'{self.queue}.retry.{delay}',
+            body,
+            properties=self._copy(properties, {RETRY_COUNT_HEADER: attempt + 1}),
+            queue_options={'durable': True, 'arguments': {
+                'x-message-ttl': delay,
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': self.queue,
+            }},
+        )
+        retried.inc(queue=queue_label(self.queue))
+
+    def dead_letter(self, properties, body, error):
+        current_app.logger.error(f"Moving a message from {self.queue} to {self.dead_letter_queue}: {error!r}")
+        rabbitmq.publish(
+            self.dead_letter_queue,
+            body,
+            properties=self._copy(properties, {ERROR_HEADER: repr(error)[:1000]}, keep_deadline=False),
+            queue_options={'durable': True},
+        )
+        dead_lettered.inc(queue=queue_label(self.queue))
+        if self.on_dead_letter is not None:
+            try:
+                self.on_dead_letter(properties, body, error)
+            except Exception as e:
+                current_app.logger.error(f"Error handling a dead letter from {self.queue}: {str(e)}")
+
+    @staticmethod
+    def _copy(properties, headers, keep_deadline=True):
+        copy = pika.BasicProperties(
+            content_type=getattr(properties, 'content_type', None),
+            delivery_mode=2,  # Persist the message
+            correlation_id=getattr(properties, 'correlation_id', None),
+            reply_to=getattr(properties, 'reply_to', None),
+            headers=dict(getattr(properties, 'headers', None) or {}, **headers),
+        )
+        deadline = deadline_of(properties)
+        if keep_deadline and deadline is not None:
+            # A retry still expires when its request does; dead letters are kept
+            with_deadline(copy, deadline)
+        return copy
@@ -1,5 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 
+from app.cache import CatalogueCache
+from app.producer import EventProducer
+from app.rabbitmq import RabbitMQ
+
 db = SQLAlchemy()
-jwt = JWTManager()
\ No newline at end of file
+jwt = JWTManager()
+rabbitmq = RabbitMQ()
+catalogue_cache = CatalogueCache()
+event_producer = EventProducer()
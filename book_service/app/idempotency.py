@@ -0,0 +1,92 @@
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+
+from app.models import IdempotencyKey, db
+from app.outbox import after_commit
+from app.rabbitmq import IDEMPOTENCY_KEY_HEADER
+from app.utils import LRUCache
+
+# Seconds between purges of expired keys
+PURGE_INTERVAL = 60
+
+
+class IdempotencyStore:
+    """
+    Replies to borrow/return requests that came with an idempotency key, so a client retrying a request
+    gets the original reply and the request is not applied twice. A reply is saved in the transaction
+    that applies its request and kept for IDEMPOTENCY_KEY_TTL seconds in the idempotency_keys table,
+    fronted by an in-memory LRU of IDEMPOTENCY_CACHE_SIZE entries; expired rows are purged while saving.
+    Keys are scoped to the operation, user and book, so the same client key on another request is a new key.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 86400
+        self.replayed = 0
+        self._cache = LRUCache(10000)
+        self._next_purge = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('IDEMPOTENCY_KEY_TTL', 86400)
+        self._cache.resize(app.config.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+        app.extensions['idempotency_store'] = self
+
+    @staticmethod
+    def key(operation, user_id, book_id, properties):
+        """The store key of a request, or None if it came without an idempotency key."""
+        client_key = (getattr(properties, 'headers', None) or {}).get(IDEMPOTENCY_KEY_HEADER)
+        if not client_key:
+            return None
+        return hashlib.sha256(json.dumps([operation, user_id, book_id, client_key]).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """The reply saved under `key`, or None."""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """The replies saved under any of `keys`, by key; the ones not in memory are read with one query."""
+        found = {}
+        missing = []
+        for key in set(keys):
+            response = self._cache.get(key)
+            if response is not None:
+                found[key] = response
+            else:
+                missing.append(key)
+        if missing:
+            rows = db.session.query(IdempotencyKey.key, IdempotencyKey.response, IdempotencyKey.expires_on).filter(
+                IdempotencyKey.key.in_(missing), IdempotencyKey.expires_on > datetime.utcnow()
+            ).all()
+            now = datetime.utcnow()
+            for row in rows:
+                found[row.key] = json.loads(row.response)
+                self._cache.set(row.key, found[row.key], time.time() + (row.expires_on - now).total_seconds())
+        self.replayed += len(found)
+        return found
+
+    def save(self, key, response):
+        """Save the reply to a request in the current transaction; it is cached once that commits."""
+        now = datetime.utcnow()
+        expired = IdempotencyKey.expires_on <= now
+        if time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + PURGE_INTERVAL
+            IdempotencyKey.query.filter(expired).delete(synchronize_session=False)
+        else:
+            # Only this key's row, in case it expired since the last purge
+            IdempotencyKey.query.filter(IdempotencyKey.key == key, expired).delete(synchronize_session=False)
+        # A plain INSERT: if a retry of the same request committed first, this transaction fails
+        # with an IntegrityError and the caller answers with the reply saved by that retry
+        db.session.add(
+            IdempotencyKey(key=key, response=json.dumps(response), expires_on=now + timedelta(seconds=self.ttl))
+        )
+        after_commit(lambda: self._cache.set(key, response, time.time() + self.ttl))
+
+    def stats(self):
+        return dict(self._cache.stats(), replayed=self.replayed)
+
+
+idempotency_store = IdempotencyStore()
@@ -5,6 +5,14 @@ from . import db
 
 class Book(db.Model):
     __tablename__ = 'books'
+    __table_args__ = (
+        # Trigram indexes serve ILIKE and similarity() on PostgreSQL (pg_trgm). The migrations create these three on
+        # PostgreSQL only; other databases search with the in-process index (app/search.py)
+        db.Index('ix_books_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+        db.Index('ix_books_author_trgm', 'author', postgresql_using='gin', postgresql_ops={'author': 'gin_trgm_ops'}),
+        # Serves ISBN prefix searches (isbn LIKE '978%')
+        db.Index('ix_books_isbn_pattern', 'isbn', postgresql_ops={'isbn': 'varchar_pattern_ops'}),
+    )
 
     id = Column(Integer, primary_key=True)
     title = Column(String(255), nullable=False)
@@ -28,6 +36,10 @@ class Book(db.Model):
 
 class Borrowing(db.Model):
     __tablename__ = 'borrowings'
+    __table_args__ = (
+        # A user's open borrowings (user_id = ? AND returned_on IS NULL)
+        db.Index('ix_borrowings_user_open', 'user_id', 'returned_on'),
+    )
 
     id = Column(Integer, primary_key=True)
     book_id = Column(Integer, ForeignKey('books.id'), nullable=False)
@@ -51,6 +63,10 @@ class Borrowing(db.Model):
 
 class WaitingList(db.Model):
     __tablename__ = 'waitinglist'
+    __table_args__ = (
+        # Who is waiting for a book, looked up on every return
+        db.Index('ix_waitinglist_book_id', 'book_id'),
+    )
 
     id = Column(db.Integer, primary_key=True)
     book_id = Column(Integer, ForeignKey('books.id'), nullable=False)
@@ -64,3 +80,47 @@ class WaitingList(db.Model):
 
     def __repr__(self):
         return f'<WaitingList for {self.book.title} by {self.user.username}>'
+
+
+class OutboxMessage(db.Model):
+    """
+    A RabbitMQ message or Kafka event waiting to be published. Written in the same transaction as the
+    change it announces and published afterwards by the outbox relay (app/outbox.py), so a committed
+    change is never left unannounced and a rolled back one is never announced.
+    """
+    __tablename__ = 'outbox'
+
+    id = Column(Integer, primary_key=True)
+    transport = Column(String(16), nullable=False)  # 'rabbitmq' or 'kafka'
+    # RabbitMQ: exchange ('' for the default one) and routing key; Kafka: topic in `destination`
+    exchange = Column(String(255), nullable=False, default='')
+    destination = Column(String(255), nullable=False)
+    body = Column(db.Text, nullable=False)
+    correlation_id = Column(String(255), nullable=True)
+    # JSON: queue/exchange declaration options for RabbitMQ
+    options = Column(db.Text, nullable=True)
+    created_on = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<OutboxMessage {self.id} to {self.transport}:{self.exchange}/{self.destination}>'
+
+
+class IdempotencyKey(db.Model):
+    """
+    The reply to a borrow/return request sent with an idempotency key, kept until `expires_on` so a
+    retry of the request gets the same reply instead of being applied again (app/idempotency.py).
+    """
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        # Expired keys are purged by range
+        db.Index('ix_idempotency_keys_expires_on', 'expires_on'),
+    )
+
+    # SHA-256 (hex) of the operation, user, book and the client's key
+    key = Column(String(64), primary_key=True)
+    # JSON reply
+    response = Column(db.Text, nullable=False)
+    expires_on = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key}>'
@@ -0,0 +1,243 @@
+import json
+import threading
+import time
+from datetime import datetime
+
+import pika
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.extensions import rabbitmq, event_producer
+from app.metrics import metrics
+from app.rabbitmq import with_deadline
+from app.supervisor import supervisor
+from app.models import OutboxMessage, db
+
+_AFTER_COMMIT = 'outbox_after_commit'
+_PENDING_MESSAGES = 'outbox_pending_messages'
+
+
+def after_commit(callback):
+    """Run `callback` once the current transaction of db.session commits; it is dropped on rollback."""
+    db.session.info.setdefault(_AFTER_COMMIT, []).append(callback)
+
+
+def _queue(message):
+    pending = db.session.info.setdefault(_PENDING_MESSAGES, [])
+    if not pending:
+        after_commit(outbox_relay.notify)
+    pending.append(message)
+
+
+@event.listens_for(Session, 'before_commit')
+def _write_pending_messages(session):
+    # All messages of a transaction are written with a single executemany INSERT
+    messages = session.info.pop(_PENDING_MESSAGES, None)
+    if messages:
+        session.execute(OutboxMessage.__table__.insert(), messages)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit(session):
+    for callback in session.info.pop(_AFTER_COMMIT, []):
+        try:
+            callback()
+        except Exception as e:
+            current_app.logger.error(f"Error in after-commit callback: {str(e)}")
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_after_commit(session, previous_transaction):
+    session.info.pop(_AFTER_COMMIT, None)
+    session.info.pop(_PENDING_MESSAGES, None)
+
+
+def publish(routing_key, body, correlation_id=None, exchange='', queue_options=None, exchange_options=None,
+            deadline=None):
+    """
+    Queue a RabbitMQ message in the current transaction; it is published once that commits.
+    A message with a `deadline` (epoch milliseconds) carries it on, and is dropped if still unsent by then.
+    """
+    options = {'queue_options': queue_options, 'exchange_options': exchange_options, 'deadline': deadline}
+    _queue({
+        'transport': 'rabbitmq',
+        'exchange': exchange,
+        'destination': routing_key,
+        'body': body,
+        'correlation_id': correlation_id,
+        'options': json.dumps(options) if queue_options or exchange_options or deadline else None,
+        'created_on': datetime.utcnow(),
+    })
+
+
+def send(topic, event):
+    """Queue a Kafka event in the current transaction; it is sent once that commits."""
+    _queue({
+        'transport': 'kafka',
+        'exchange': '',
+        'destination': topic,
+        'body': json.dumps(event, separators=(',', ':')),
+        'correlation_id': None,
+        'options': None,
+        'created_on': datetime.utcnow(),
+    })
+
+
+class OutboxRelay:
+    """
+    Publishes the outbox in id order, in batches of up to OUTBOX_BATCH_SIZE messages per transport.
+    RabbitMQ messages and Kafka events are claimed and sent as separate batches, so events held back by
+    a Kafka outage never delay the borrow/return replies queued behind them.
+    A commit that queued messages wakes the relay of its own process, which then waits
+    OUTBOX_LINGER_MS for more to arrive before claiming a batch; messages written by other
+    processes are picked up every OUTBOX_POLL_INTERVAL seconds. Rows are claimed with
+    FOR UPDATE SKIP LOCKED where the database supports it, so several relays can share one outbox.
+    A message that cannot be sent stays in the outbox for the next run while the rest of its batch goes out.
+    Delivery is at-least-once: a relay that dies between publishing and deleting a batch
+    publishes it again.
+    """
+
+    TRANSPORTS = ('rabbitmq', 'kafka')
+
+    def __init__(self, app=None):
+        self.batch_size = 100
+        self.linger = 0.005
+        self.poll_interval = 1.0
+        self.published = 0
+        self.batches = 0
+        self._wakeup = threading.Event()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.batch_size = app.config.get('OUTBOX_BATCH_SIZE', 100)
+        self.linger = app.config.get('OUTBOX_LINGER_MS', 5) / 1000
+        self.poll_interval = app.config.get('OUTBOX_POLL_INTERVAL', 1.0)
+        app.extensions['outbox_relay'] = self
+
+    def notify(self):
+        self._wakeup.set()
+
+    def run(self):
+        """Relay loop; runs in its own thread inside an app context."""
+        current_app.logger.info("Started relaying the outbox...")
+        while True:
+            supervisor.heartbeat()
+            if self._wakeup.wait(self.poll_interval) and self.linger:
+                time.sleep(self.linger)
+            self._wakeup.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Error relaying the outbox: {str(e)}")
+                time.sleep(self.poll_interval)
+            finally:
+                db.session.remove()
+
+    def drain(self):
+        """
+        Publish batches until the outbox is empty, or until a batch had messages that could not be sent;
+        those wait for the next run. Returns the number of messages published.
+        """
+        total = 0
+        while True:
+            published = [self.relay_batch(transport) for transport in self.TRANSPORTS]
+            total += sum(published)
+            if max(published) < self.batch_size:
+                return total
+
+    def relay_batch(self, transport):
+        """Claim, publish and delete one batch of `transport` messages. Returns the number of messages published."""
+        messages = (
+            db.session.query(
+                OutboxMessage.id, OutboxMessage.transport, OutboxMessage.exchange, OutboxMessage.destination,
+                OutboxMessage.body, OutboxMessage.correlation_id, OutboxMessage.options,
+            )
+            .filter(OutboxMessage.transport == transport)
+            .order_by(OutboxMessage.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not messages:
+            db.session.commit()
+            return 0
+
+        published = []
+        try:
+            if transport == 'kafka':
+                self._send_kafka(messages, published)
+            else:
+                self._publish_rabbitmq_batch(messages, published)
+        finally:
+            # Whatever was published is deleted even if the batch failed half way, so it is not sent twice
+            if published:
+                OutboxMessage.query.filter(OutboxMessage.id.in_(published)).delete(synchronize_session=False)
+            db.session.commit()
+
+        if len(published) < len(messages):
+            current_app.logger.warning(
+                f"{len(messages) - len(published)} {transport} outbox messages were not sent, retrying on the next run."
+            )
+        self.published += len(published)
+        self.batches += 1
+        return len(published)
+
+    def _publish_rabbitmq_batch(self, messages, published):
+        for message in messages:
+            try:
+                self._publish_rabbitmq(message)
+            except Exception as e:
+                # Kept for the next run; the other messages do not wait for it
+                current_app.logger.error(f"Error publishing outbox message {message.id}: {str(e)}")
+                continue
+            published.append(message.id)
+
+    @staticmethod
+    def _send_kafka(messages, published):
+        sent = []
+        for message in messages:
+            try:
+                # The body is already JSON, the producer sends it as is
+                sent.append((message.id, event_producer.send(message.destination, message.body.encode('utf-8'))))
+            except Exception as e:
+                # Kafka is unreachable (e.g. no metadata within KAFKA_MAX_BLOCK_MS): the later events of the
+                # batch would fail the same way after the same wait, so they are kept for the next run too
+                current_app.logger.error(f"Error sending outbox event {message.id} to Kafka: {str(e)}")
+                break
+        if not sent:
+            return
+        try:
+            # One flush per batch: Kafka events only count as published once Kafka acknowledged them
+            event_producer.flush()
+        except Exception as e:
+            current_app.logger.error(f"Error flushing outbox events to Kafka: {str(e)}")
+        published.extend(message_id for message_id, future in sent if future.succeeded())
+
+    @staticmethod
+    def _publish_rabbitmq(message):
+        options = json.loads(message.options) if message.options else {}
+        properties = pika.BasicProperties(
+            delivery_mode=2,  # Persist the message
+            correlation_id=message.correlation_id,
+        )
+        if options.get('deadline') is not None:
+            if options['deadline'] <= time.time() * 1000:
+                # Nobody is waiting for this reply anymore
+                metrics.dropped(message.destination, 'expired')
+                return
+            with_deadline(properties, options['deadline'])
+        rabbitmq.publish(
+            message.destination,
+            message.body,
+            properties=properties,
+            exchange=message.exchange,
+            queue_options=options.get('queue_options'),
+            exchange_options=options.get('exchange_options'),
+        )
+
+
+outbox_relay = OutboxRelay()
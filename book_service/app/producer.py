@@ -0,0 +1,102 @@
+import atexit
+import json
+import logging
+import threading
+
+from kafka import KafkaProducer
+
+logger = logging.getLogger(__name__)
+
+
+def serialize(value):
+    """Compact JSON (no spaces after separators); already encoded payloads (e.g. from the outbox) pass through."""
+    if isinstance(value, bytes):
+        return value
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+class EventProducer:
+    """
+    The Book Service's Kafka producer.
+    The KafkaProducer is only created on the first send, so starting the app never waits on Kafka;
+    with KAFKA_API_VERSION set it does not even probe the broker then. Sends are batched by the
+    client (KAFKA_LINGER_MS, KAFKA_BATCH_SIZE, KAFKA_COMPRESSION_TYPE), every delivery report is
+    counted, and buffered events are flushed when the process exits.
+    """
+
+    def __init__(self, app=None, producer_factory=None):
+        self.settings = {}
+        # Optional callable taking the KafkaProducer settings (used for local stand-in brokers)
+        self.producer_factory = producer_factory
+        self.flush_timeout = 10
+        self.sent = 0
+        self.delivered = 0
+        self.failed = 0
+        self._producer = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        api_version = app.config.get('KAFKA_API_VERSION')
+        acks = str(app.config.get('KAFKA_ACKS', '1'))
+        self.settings = {
+            'bootstrap_servers': app.config.get('KAFKA_BOOTSTRAP_SERVERS', 'kafka1:9092'),
+            'acks': acks if acks == 'all' else int(acks),
+            'linger_ms': app.config.get('KAFKA_LINGER_MS', 10),
+            'batch_size': app.config.get('KAFKA_BATCH_SIZE', 32768),
+            'compression_type': app.config.get('KAFKA_COMPRESSION_TYPE') or None,
+            'max_block_ms': app.config.get('KAFKA_MAX_BLOCK_MS', 10000),
+            'api_version': tuple(int(part) for part in api_version.split('.')) if api_version else None,
+            'value_serializer': serialize,
+        }
+        self.flush_timeout = app.config.get('KAFKA_FLUSH_TIMEOUT', 10)
+        app.extensions['event_producer'] = self
+
+    @property
+    def producer(self):
+        if self._producer is None:
+            with self._lock:
+                if self._producer is None:
+                    self._producer = (self.producer_factory or KafkaProducer)(**self.settings)
+                    atexit.register(self.close)
+        return self._producer
+
+    def send(self, topic, value):
+        """Queue an event for `topic` and return its future; its outcome is counted when Kafka answers."""
+        future = self.producer.send(topic, value)
+        with self._lock:
+            self.sent += 1
+        future.add_callback(self._on_delivered)
+        future.add_errback(self._on_failed, topic)
+        return future
+
+    def flush(self, timeout=None):
+        """Send everything buffered now and wait for Kafka's answers."""
+        if self._producer is not None:
+            self._producer.flush(timeout if timeout is not None else self.flush_timeout)
+
+    def close(self):
+        with self._lock:
+            producer, self._producer = self._producer, None
+        if producer is not None:
+            producer.close(self.flush_timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sent": self.sent,
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "in_flight": self.sent - self.delivered - self.failed,
+            }
+
+    def _on_delivered(self, metadata):
+        with self._lock:
+            self.delivered += 1
+
+    def _on_failed(self, topic, error):
+        with self._lock:
+            self.failed += 1
+        logger.error(f"Kafka delivery to {topic} failed: {error}")
@@ -1,16 +1,68 @@
 from datetime import datetime, timedelta
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from app.models import Book, db, Borrowing
 from app.utils import role_required
+from app.extensions import catalogue_cache
+from app.broker import publish_catalogue_change
+from app.search import search_engine
+from app.bulk_import import FORMATS, BulkImport, RowError, read_csv, read_ndjson
 
-import pika, json, os
+import csv, pika, json, os
 
 book_bp = Blueprint('book', __name__)
 
 HOST_NAME = os.environ.get('HOST_NAME')
 RABBITMQ_HOST = 'rabbitmq'
 
+# Keeps IN (...) lists well below the bind parameter limits of every supported database
+LOAD_CHUNK_SIZE = 500
+
+
+def book_to_dict(book):
+    return {
+        "id": book.id,
+        "title": book.title,
+        "author": book.author,
+        "isbn": book.isbn,
+        "available_copies": book.available_copies
+    }
+
+
+def load_books(book_ids):
+    """Fetch the given books from the database as dicts (catalogue cache loader)."""
+    rows = []
+    for start in range(0, len(book_ids), LOAD_CHUNK_SIZE):
+        chunk = book_ids[start:start + LOAD_CHUNK_SIZE]
+        rows.extend(book_to_dict(book) for book in Book.query.filter(Book.id.in_(chunk)).all())
+    return rows
+
+
+def cached_books(listing, load_ids):
+    """Resolve a listing's book ids through the catalogue cache (`load_ids` on a miss) and return the rows."""
+    book_ids = catalogue_cache.get_listing(listing, load_ids)
+    return catalogue_cache.get_books(book_ids, load_books)
+
+
+def query_ids(query):
+    return lambda: [book_id for (book_id,) in query.all()]
+
+
+def stream_books_ndjson(after):
+    """
+    Yield the catalogue as newline-delimited JSON, one book per line, in id order.
+    Rows come from a server-side cursor in batches, so memory stays flat however large the catalogue is.
+    """
+    query = (
+        db.session.query(Book.id, Book.title, Book.author, Book.isbn, Book.available_copies)
+        .filter(Book.id > after)
+        .order_by(Book.id)
+        .execution_options(stream_results=True)
+        .yield_per(current_app.config['CATALOGUE_STREAM_BATCH_SIZE'])
+    )
+    for book in query:
+        yield json.dumps(book_to_dict(book)) + "\n"
+
 @book_bp.route('/add', methods=['POST'])
 @role_required('librarian')
 def add_book():
@@ -30,28 +82,84 @@ def add_book():
 
     new_book = Book(title=title, author=author, isbn=isbn, available_copies=available_copies)
     db.session.add(new_book)
+    # Assign the id, so the catalogue change can be queued in the same transaction
+    db.session.flush()
+    publish_catalogue_change([new_book.id], listings=True)
     db.session.commit()
     return jsonify({"msg": "Book added successfully", "hostname": HOST_NAME}), 201
 
+@book_bp.route('/bulk_import', methods=['POST'])
+@role_required('librarian')
+def bulk_import():
+    """
+    Add many books from a streamed request body: CSV with a title,author,isbn[,available_copies] header
+    (Content-Type: text/csv) or one JSON object per line (Content-Type: application/x-ndjson).
+    `?format=csv|ndjson` overrides the content type. Books whose ISBN already exists, or appears twice,
+    are rejected with their line number, as are invalid rows; the others are imported. Chunks are
+    committed as they are read, so a failed import keeps the chunks committed before the failure.
+    """
+    kind = FORMATS.get(request.args.get('format') or request.mimetype)
+    if kind is None:
+        return jsonify({"msg": "Send text/csv or application/x-ndjson", "hostname": HOST_NAME}), 400
+
+    rows = read_csv(request.stream) if kind == 'csv' else read_ndjson(request.stream)
+    job = BulkImport(current_app.config['BULK_IMPORT_CHUNK_SIZE'], current_app.config['BULK_IMPORT_MAX_ERRORS'])
+    try:
+        job.run(rows)
+    except (RowError, UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({"msg": f"Invalid import: {str(e)}", **job.summary(), "hostname": HOST_NAME}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": f"Error importing books: {str(e)}", **job.summary(), "hostname": HOST_NAME}), 500
+
+    return jsonify({"msg": "Import finished", **job.summary(), "hostname": HOST_NAME}), 200
+
 @book_bp.route('/all_books', methods=['GET'])
 @role_required('librarian', 'user')
 def get_all_books():
+    """
+    List the catalogue.
+    Query parameters (all optional):
+    - limit: page size for keyset pagination; the response carries `next_after` for the next page
+    - after: only return books with an id greater than this (the previous page's `next_after`)
+    - format=ndjson: stream every book after `after` as newline-delimited JSON instead
+    """
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({"msg": "limit and after must be integers", "hostname": HOST_NAME}), 400
+
+    if request.args.get('format') == 'ndjson':
+        return Response(
+            stream_with_context(stream_books_ndjson(after)),
+            mimetype='application/x-ndjson',
+            headers={"X-Accel-Buffering": "no"},
+        )
+
     try:
-        books = Book.query.all()
+        if limit is None and not after:
+            book_list = cached_books('all_books', query_ids(db.session.query(Book.id).order_by(Book.id)))
+
+            if not book_list:
+                return jsonify({"msg": "No books found", "hostname": HOST_NAME}), 404
 
-        if not books:
-            return jsonify({"msg": "No books found", "hostname": HOST_NAME}), 404
+            return jsonify({"books": book_list, "hostname": HOST_NAME}), 200
 
-        book_list = [
-            {
-                "id": book.id,
-                "title": book.title,
-                "author": book.author,
-                "isbn": book.isbn,
-                "available_copies": book.available_copies
-            } for book in books]
+        if limit is None:
+            limit = current_app.config['CATALOGUE_PAGE_MAX_LIMIT']
+        if limit <= 0:
+            return jsonify({"msg": "limit must be positive", "hostname": HOST_NAME}), 400
+        limit = min(limit, current_app.config['CATALOGUE_PAGE_MAX_LIMIT'])
 
-        return jsonify({"books": book_list, "hostname": HOST_NAME}), 200
+        book_list = cached_books(
+            f"all_books:{after}:{limit}",
+            query_ids(db.session.query(Book.id).filter(Book.id > after).order_by(Book.id).limit(limit)),
+        )
+        next_after = book_list[-1]["id"] if len(book_list) == limit else None
+
+        return jsonify({"books": book_list, "next_after": next_after, "hostname": HOST_NAME}), 200
 
     except Exception as e:
         return jsonify({"msg": f"Error retrieving books: {str(e)}", "hostname": HOST_NAME}), 500
@@ -102,23 +210,28 @@ def get_all_books():
 def get_borrowed_books():
     user_id = request.args.get('user_id')
 
-    # Query the Borrowing table for books borrowed by this user
-    borrowings = Borrowing.query.filter_by(user_id=user_id, returned_on=None).all()
+    # One joined query for the user's open borrowings and their books, served by ix_borrowings_user_open
+    rows = (
+        db.session.query(Book.id, Book.title, Book.author, Book.isbn, Borrowing.return_by)
+        .join(Borrowing, Borrowing.book_id == Book.id)
+        .filter(Borrowing.user_id == user_id, Borrowing.returned_on.is_(None))
+        .order_by(Borrowing.id)
+        .all()
+    )
 
-    if not borrowings:
+    if not rows:
         return jsonify({"msg": "No books borrowed"}), 404
 
-    borrowed_books = []
-    for borrowing in borrowings:
-        book = Book.query.get(borrowing.book_id)
-        if book:
-            borrowed_books.append({
-                "book_id": book.id,
-                "title": book.title,
-                "author": book.author,
-                "isbn": book.isbn,
-                "return_by": borrowing.return_by
-            })
+    borrowed_books = [
+        {
+            "book_id": row.id,
+            "title": row.title,
+            "author": row.author,
+            "isbn": row.isbn,
+            "return_by": row.return_by
+        }
+        for row in rows
+    ]
 
     return jsonify({
         "borrowed_books": borrowed_books,
@@ -126,30 +239,52 @@ def get_borrowed_books():
     }), 200
 
 
+def search_limit():
+    """The `limit` query parameter capped by SEARCH_MAX_RESULTS; raises ValueError if it is not a positive integer."""
+    max_results = current_app.config['SEARCH_MAX_RESULTS']
+    limit = int(request.args.get('limit', max_results))
+    if limit <= 0:
+        raise ValueError(limit)
+    return min(limit, max_results)
+
+
+def search_books(limit, q=None, title=None, author=None, isbn=None):
+    """Ranked search through the search engine, with the result ids cached like any other listing."""
+    listing = "search:" + json.dumps([q, title, author, isbn, limit]).lower()
+    return cached_books(
+        listing,
+        lambda: search_engine.search(q=q, title=title, author=author, isbn=isbn, limit=limit),
+    )
+
+
 @book_bp.route('/search', methods=['GET'])
 @role_required('librarian', 'user')
 def search_book_by_title():
+    """
+    Search the catalogue, best match first.
+    Query parameters (at least one is required, all given ones must match):
+    - q: words matched as whole words or prefixes against title, author and ISBN
+    - title / author: words matched against that field only
+    - isbn: ISBN prefix
+    - limit: maximum number of results (capped by SEARCH_MAX_RESULTS)
+    """
+    q = request.args.get('q')
     title_query = request.args.get('title')
+    author_query = request.args.get('author')
+    isbn_query = request.args.get('isbn')
 
-    if not title_query:
-        return jsonify({"msg": "Title query parameter is required", "hostname": HOST_NAME}), 400
+    if not (q or title_query or author_query or isbn_query):
+        return jsonify({"msg": "A q, title, author or isbn query parameter is required", "hostname": HOST_NAME}), 400
 
-    # Perform a case-insensitive search for books with titles that contain the query
-    books = Book.query.filter(Book.title.ilike(f"%{title_query}%")).all()
+    try:
+        limit = search_limit()
+    except ValueError:
+        return jsonify({"msg": "limit must be a positive integer", "hostname": HOST_NAME}), 400
 
-    if not books:
-        return jsonify({"msg": "No books found matching the title", "hostname": HOST_NAME}), 404
+    book_list = search_books(limit, q=q, title=title_query, author=author_query, isbn=isbn_query)
 
-    # Format the result
-    book_list = [
-        {
-            "id": book.id,
-            "title": book.title,
-            "author": book.author,
-            "isbn": book.isbn,
-            "available_copies": book.available_copies
-        } for book in books
-    ]
+    if not book_list:
+        return jsonify({"msg": "No books found matching the search", "hostname": HOST_NAME}), 404
 
     return jsonify({"books": book_list, "hostname": HOST_NAME}), 200
 
@@ -162,21 +297,21 @@ def search_book_by_author():
     if not author_query:
         return jsonify({"msg": "Author query parameter is required", "hostname": HOST_NAME}), 400
 
-    # Perform a case-insensitive search for books with authors that contain the query
-    books = Book.query.filter(Book.author.ilike(f"%{author_query}%")).all()
+    try:
+        limit = search_limit()
+    except ValueError:
+        return jsonify({"msg": "limit must be a positive integer", "hostname": HOST_NAME}), 400
 
-    if not books:
-        return jsonify({"msg": "No books found matching the author", "hostname": HOST_NAME}), 404
+    book_list = search_books(limit, author=author_query)
 
-    # Format the result
-    book_list = [
-        {
-            "id": book.id,
-            "title": book.title,
-            "author": book.author,
-            "isbn": book.isbn,
-            "available_copies": book.available_copies
-        } for book in books
-    ]
+    if not book_list:
+        return jsonify({"msg": "No books found matching the author", "hostname": HOST_NAME}), 404
 
     return jsonify({"books": book_list, "hostname": HOST_NAME}), 200
+
+
+@book_bp.route('/cache/stats', methods=['GET'])
+@role_required('librarian')
+def get_cache_stats():
+    """Hit/miss/eviction counters of this process' catalogue cache."""
+    return jsonify({"catalogue_cache": catalogue_cache.stats(), "hostname": HOST_NAME}), 200
@@ -0,0 +1,302 @@
+import bisect
+import heapq
+import re
+import threading
+
+from sqlalchemy import text
+
+from app.models import Book, db
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Score a query token earns per kind of match; a book's rank is the sum over all query tokens
+ISBN_WEIGHT = 5
+TITLE_EXACT_WEIGHT = 3
+TITLE_PREFIX_WEIGHT = 2
+AUTHOR_EXACT_WEIGHT = 2
+AUTHOR_PREFIX_WEIGHT = 1
+
+# Index tokens a single prefix may expand to, so one-letter prefixes stay cheap
+MAX_PREFIX_EXPANSIONS = 64
+
+
+def tokenize(value):
+    return _TOKEN_RE.findall((value or '').lower())
+
+
+def like_escape(value):
+    """Escape user input for a LIKE pattern with ESCAPE '\\', so `%` and `_` match themselves."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class _FieldIndex:
+    """Inverted index of one text field: token -> ids, plus the sorted vocabulary for prefix lookups."""
+
+    def __init__(self):
+        self.postings = {}
+        self.vocabulary = []
+
+    def add(self, book_id, tokens, keep_sorted=True):
+        for token in set(tokens):
+            ids = self.postings.get(token)
+            if ids is None:
+                self.postings[token] = ids = set()
+                if keep_sorted:
+                    bisect.insort(self.vocabulary, token)
+            ids.add(book_id)
+
+    def sort_vocabulary(self):
+        self.vocabulary = sorted(self.postings)
+
+    def remove(self, book_id, tokens):
+        for token in set(tokens):
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            ids.discard(book_id)
+            if not ids:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def score(self, token, exact_weight, prefix_weight, scores):
+        """Add the weight `token` earns in this field to `scores` (book id -> weight), keeping the best match."""
+        start = bisect.bisect_left(self.vocabulary, token)
+        for candidate in self.vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not candidate.startswith(token):
+                break
+            weight = exact_weight if candidate == token else prefix_weight
+            for book_id in self.postings[candidate]:
+                if scores.get(book_id, 0) < weight:
+                    scores[book_id] = weight
+
+
+class InvertedIndex:
+    """
+    In-process search index over book titles, authors and ISBNs, used when the database has no
+    trigram/full-text support (SQLite). Built once from the books table and then kept up to date
+    one book at a time from catalogue change events.
+    """
+
+    def __init__(self):
+        self.title = _FieldIndex()
+        self.author = _FieldIndex()
+        self.isbns = []
+        self.documents = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def build(self, books):
+        """Index many (id, title, author, isbn) rows at once, sorting the lookup structures only at the end."""
+        for book_id, title, author, isbn in books:
+            document = (tokenize(title), tokenize(author), (isbn or '').lower())
+            self.documents[book_id] = document
+            self.title.add(book_id, document[0], keep_sorted=False)
+            self.author.add(book_id, document[1], keep_sorted=False)
+            self.isbns.append((document[2], book_id))
+        self.title.sort_vocabulary()
+        self.author.sort_vocabulary()
+        self.isbns.sort()
+
+    def add(self, book_id, title, author, isbn):
+        if book_id in self.documents:
+            self.remove(book_id)
+        document = (tokenize(title), tokenize(author), (isbn or '').lower())
+        self.documents[book_id] = document
+        self.title.add(book_id, document[0])
+        self.author.add(book_id, document[1])
+        bisect.insort(self.isbns, (document[2], book_id))
+
+    def remove(self, book_id):
+        document = self.documents.pop(book_id, None)
+        if document is None:
+            return
+        self.title.remove(book_id, document[0])
+        self.author.remove(book_id, document[1])
+        position = bisect.bisect_left(self.isbns, (document[2], book_id))
+        if position < len(self.isbns) and self.isbns[position] == (document[2], book_id):
+            del self.isbns[position]
+
+    def _isbn_prefix(self, prefix, scores):
+        start = bisect.bisect_left(self.isbns, (prefix,))
+        for isbn, book_id in self.isbns[start:]:
+            if not isbn.startswith(prefix):
+                break
+            scores[book_id] = ISBN_WEIGHT
+
+    def search(self, q=None, title=None, author=None, isbn=None, limit=50):
+        """
+        Return up to `limit` book ids, best match first.
+        Every query token must match (as a whole word or a word prefix) somewhere: in the title,
+        author or ISBN for `q`, or in the named field for `title`/`author`/`isbn`.
+        """
+        per_token = []
+        for token in tokenize(q):
+            scores = {}
+            self.title.score(token, TITLE_EXACT_WEIGHT, TITLE_PREFIX_WEIGHT, scores)
+            self.author.score(token, AUTHOR_EXACT_WEIGHT, AUTHOR_PREFIX_WEIGHT, scores)
+            self._isbn_prefix(token, scores)
+            per_token.append(scores)
+        for token in tokenize(title):
+            scores = {}
+            self.title.score(token, TITLE_EXACT_WEIGHT, TITLE_PREFIX_WEIGHT, scores)
+            per_token.append(scores)
+        for token in tokenize(author):
+            scores = {}
+            self.author.score(token, AUTHOR_EXACT_WEIGHT, AUTHOR_PREFIX_WEIGHT, scores)
+            per_token.append(scores)
+        if isbn:
+            scores = {}
+            self._isbn_prefix(isbn.lower(), scores)
+            per_token.append(scores)
+
+        if not per_token:
+            return []
+
+        # Intersect starting from the most selective token
+        per_token.sort(key=len)
+        ranked = per_token[0]
+        for scores in per_token[1:]:
+            ranked = {book_id: score + scores[book_id] for book_id, score in ranked.items() if book_id in scores}
+            if not ranked:
+                return []
+
+        best = heapq.nsmallest(limit, ranked.items(), key=lambda item: (-item[1], item[0]))
+        return [book_id for book_id, _ in best]
+
+
+class SearchEngine:
+    """
+    Book search behind /book/search.
+    Backends (SEARCH_BACKEND):
+    - postgres: tsvector prefix matching ranked with ts_rank and trigram similarity, served by the
+      GIN indexes created in the migrations
+    - memory: the in-process InvertedIndex, for databases without those features
+    - ilike: the original ILIKE '%q%' scans, kept for comparison
+    - auto (default): postgres on PostgreSQL, memory otherwise
+    """
+
+    def __init__(self, app=None):
+        self.backend = 'auto'
+        self.index = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = app.config.get('SEARCH_BACKEND', 'auto')
+        self.index = None
+        app.extensions['search_engine'] = self
+
+    def resolved_backend(self):
+        if self.backend != 'auto':
+            return self.backend
+        return 'postgres' if db.engine.dialect.name == 'postgresql' else 'memory'
+
+    def search(self, q=None, title=None, author=None, isbn=None, limit=50):
+        backend = self.resolved_backend()
+        if backend == 'postgres':
+            return self._search_postgres(q, title, author, isbn, limit)
+        if backend == 'ilike':
+            return self._search_ilike(q, title, author, isbn, limit)
+        index = self._memory_index()
+        # The catalogue consumer updates the index in place; searching it meanwhile could see a half-updated token
+        with self._lock:
+            return index.search(q=q, title=title, author=author, isbn=isbn, limit=limit)
+
+    def refresh(self, book_ids):
+        """
+        Re-index the given books from the database (after they were added or their text changed).
+        The rows are read before taking the lock, so searches only wait for the index update itself.
+        """
+        if self.index is None:
+            # Not built yet: the build will read the current rows
+            return
+        book_ids = list(book_ids)
+        rows = {
+            book.id: book
+            for book in db.session.query(Book.id, Book.title, Book.author, Book.isbn)
+            .filter(Book.id.in_(book_ids)).all()
+        }
+        with self._lock:
+            if self.index is None:
+                return
+            for book_id in book_ids:
+                book = rows.get(book_id)
+                if book is None:
+                    self.index.remove(book_id)
+                else:
+                    self.index.add(book.id, book.title, book.author, book.isbn)
+
+    def _memory_index(self):
+        with self._lock:
+            if self.index is None:
+                index = InvertedIndex()
+                index.build(
+                    db.session.query(Book.id, Book.title, Book.author, Book.isbn)
+                    .execution_options(stream_results=True)
+                    .yield_per(5000)
+                )
+                self.index = index
+            return self.index
+
+    def _search_postgres(self, q, title, author, isbn, limit):
+        clauses = []
+        rank = ["0"]
+        params = {"limit": limit}
+
+        tokens = tokenize(q)
+        if tokens:
+            # Tokens are [a-z0-9]+ only, so they are safe to splice into the tsquery syntax
+            params["tsquery"] = " & ".join(f"{token}:*" for token in tokens)
+            params["q"] = q
+            params["isbn_prefix"] = f"{like_escape(q.strip())}%"
+            clauses.append(
+                "(to_tsvector('simple', title || ' ' || author) @@ to_tsquery('simple', :tsquery)"
+                " OR isbn LIKE :isbn_prefix ESCAPE '\\')"
+            )
+            rank.append("ts_rank(to_tsvector('simple', title || ' ' || author), to_tsquery('simple', :tsquery))")
+            rank.append("similarity(title, :q)")
+        if title:
+            params["title"] = f"%{like_escape(title)}%"
+            params["title_raw"] = title
+            clauses.append("title ILIKE :title ESCAPE '\\'")
+            rank.append("similarity(title, :title_raw)")
+        if author:
+            params["author"] = f"%{like_escape(author)}%"
+            params["author_raw"] = author
+            clauses.append("author ILIKE :author ESCAPE '\\'")
+            rank.append("similarity(author, :author_raw)")
+        if isbn:
+            params["isbn"] = f"{like_escape(isbn)}%"
+            clauses.append("isbn LIKE :isbn ESCAPE '\\'")
+
+        if not clauses:
+            return []
+
+        statement = text(
+            f"SELECT id FROM books WHERE {' AND '.join(clauses)} "
+            f"ORDER BY {' + '.join(rank)} DESC, id LIMIT :limit"
+        )
+        return [book_id for (book_id,) in db.session.execute(statement, params)]
+
+    def _search_ilike(self, q, title, author, isbn, limit):
+        def contains(column, value):
+            return column.ilike(f"%{like_escape(value)}%", escape='\\')
+
+        query = db.session.query(Book.id)
+        if q:
+            query = query.filter(contains(Book.title, q) | contains(Book.author, q) | contains(Book.isbn, q))
+        if title:
+            query = query.filter(contains(Book.title, title))
+        if author:
+            query = query.filter(contains(Book.author, author))
+        if isbn:
+            query = query.filter(contains(Book.isbn, isbn))
+        if not (q or title or author or isbn):
+            return []
+        return [book_id for (book_id,) in query.order_by(Book.id).limit(limit).all()]
+
+
+search_engine = SearchEngine()
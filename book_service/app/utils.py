@@ -1,22 +1,127 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
-from flask import jsonify, current_app
-from flask_jwt_extended import get_jwt, jwt_required
+from flask import jsonify, current_app, g, request
+from flask_jwt_extended import get_jwt, get_jwt_header, verify_jwt_in_request
 
 import logging
 
+_BEARER = 'Bearer '
+
+
+class LRUCache:
+    """Thread-safe LRU mapping whose entries also expire at their own time (epoch seconds)."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, expires_at):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def resize(self, max_entries):
+        with self._lock:
+            self.max_entries = max_entries
+            while len(self._entries) > max(max_entries, 0):
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class TokenCache(LRUCache):
+    """
+    Access tokens this process has already verified, keyed by the SHA-256 of the token and kept until
+    the token's `exp`. A token seen again skips signature verification and claim decoding; any other
+    token (or a JWT_CACHE_SIZE of 0) goes through flask_jwt_extended as usual.
+    """
+
+    def init_app(self, app):
+        self.resize(app.config.get('JWT_CACHE_SIZE', 10000))
+        app.extensions['token_cache'] = self
+
+
+token_cache = TokenCache()
+
+
+def verify_jwt():
+    """verify_jwt_in_request(), answered from the token cache for bearer tokens verified before."""
+    header = request.headers.get('Authorization', '')
+    key = hashlib.sha256(header[len(_BEARER):].encode()).digest() if header.startswith(_BEARER) else None
+
+    if key is not None and token_cache.max_entries > 0:
+        cached = token_cache.get(key)
+        if cached is not None:
+            # The same request context state verify_jwt_in_request() leaves behind
+            g._jwt_extended_jwt_header, g._jwt_extended_jwt = cached
+            g._jwt_extended_jwt_user = None
+            g._jwt_extended_jwt_location = 'headers'
+            return
+
+    if verify_jwt_in_request() is None:
+        # Methods exempt from JWT checks (OPTIONS)
+        return
+    claims = get_jwt()
+    # Tokens that did not come from the header, or that loaded a user, are not cached
+    if key is not None and claims.get('exp') and g.get('_jwt_extended_jwt_location') == 'headers' \
+            and g.get('_jwt_extended_jwt_user') is None:
+        token_cache.set(key, (get_jwt_header(), claims), claims['exp'])
+
+
+def jwt_verified(func):
+    """Like flask_jwt_extended's @jwt_required(), with verified tokens served from the token cache."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        verify_jwt()
+        return func(*args, **kwargs)
+    return wrapper
+
+
 def role_required(*roles):
     """
     Decorator to check if the user has one of the required roles.
     :param roles: One or more roles ('librarian', 'user') that are allowed to access the route.
     """
+    allowed = frozenset(roles)
+    denied = {"msg": f"Access denied: One of the following roles is required: {', '.join(roles)}"}
+
     def decorator(func):
         @wraps(func)
-        @jwt_required()
+        @jwt_verified
         def wrapper(*args, **kwargs):
             claims = get_jwt()
             # current_app.logger.debug(f"JWT Claims: {claims}")
-            if claims.get('role') not in roles:
-                return jsonify({"msg": f"Access denied: One of the following roles is required: {', '.join(roles)}"}), 403
+            if claims.get('role') not in allowed:
+                return jsonify(denied), 403
                 # return jsonify({"msg": f"Access denied: {required_role} role required"}), 403
             return func(*args, **kwargs)
         return wrapper
@@ -0,0 +1,76 @@
+"""
+Borrow consumer throughput for different batch sizes.
+
+Feeds the same stream of borrow requests through the per-message handler (batch size 1)
+and the batch handler, against a SQLite database and a stand-in broker, and reports
+messages per second so BORROW_BATCH_SIZE can be picked.
+
+    cd book_service && python -m benchmarks.borrow_batch --messages 5000 --batch-sizes 1 10 50 100
+"""
+import argparse
+import json
+import logging
+import random
+import time
+from types import SimpleNamespace
+
+import pika
+
+from app.broker import on_borrow_book_batch, on_borrow_book_message
+from app.outbox import outbox_relay
+from benchmarks.stand_in import StandInBroker, create_benchmark_app
+
+
+def make_deliveries(count, books, users, seed=0):
+    rng = random.Random(seed)
+    deliveries = []
+    for tag in range(1, count + 1):
+        body = json.dumps({'user_id': rng.randrange(users), 'book_id': rng.randrange(1, books + 1)})
+        properties = pika.BasicProperties(correlation_id=str(tag), reply_to='benchmark_reply_queue')
+        deliveries.append((SimpleNamespace(delivery_tag=tag), properties, body))
+    return deliveries
+
+
+def run(batch_size, args):
+    broker = StandInBroker()
+    app = create_benchmark_app(broker, books=args.books)
+    channel = broker.connect().channel()
+    deliveries = make_deliveries(args.messages, args.books, args.users)
+
+    with app.app_context():
+        started = time.perf_counter()
+        if batch_size == 1:
+            for method, properties, body in deliveries:
+                on_borrow_book_message(channel, method, properties, body)
+        else:
+            for start in range(0, len(deliveries), batch_size):
+                on_borrow_book_batch(channel, deliveries[start:start + batch_size])
+        # Replies are published by the outbox relay
+        outbox_relay.drain()
+        elapsed = time.perf_counter() - started
+
+    replies = len(broker.published['benchmark_reply_queue'])
+    assert replies == args.messages and broker.acked == args.messages, (replies, broker.acked)
+    return args.messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 50, 100, 250])
+    args = parser.parse_args()
+
+    # Per-message logging would dominate the measurement
+    logging.disable(logging.INFO)
+
+    baseline = None
+    for batch_size in args.batch_sizes:
+        rate = run(batch_size, args)
+        baseline = baseline or rate
+        print(f"batch size {batch_size:4d}: {rate:10.0f} msgs/sec ({rate / baseline:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
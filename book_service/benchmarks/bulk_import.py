@@ -0,0 +1,85 @@
+"""
+Catalogue load time: one /book/add request per book against a single streamed /book/bulk_import.
+
+Generates a synthetic catalogue, adds a sample of it through /book/add (the old path, one
+ISBN lookup and one commit per book; its rate is extrapolated) and then streams the whole
+catalogue to /book/bulk_import as CSV or NDJSON. A few duplicate and invalid rows are mixed
+in to exercise the per-row error reporting.
+
+    cd book_service && python -m benchmarks.bulk_import --books 500000 --format csv
+    python -m benchmarks.bulk_import --books 500000 --database-url postgresql://.../scratch_db
+"""
+import argparse
+import json
+import logging
+import time
+
+from flask_jwt_extended import create_access_token
+
+from app.extensions import catalogue_cache, jwt
+from app.routes import book_bp
+from benchmarks.stand_in import StandInBroker, create_benchmark_app
+
+
+def generate(count, offset=0):
+    for i in range(offset, offset + count):
+        yield {'title': f'Title {i}', 'author': f'Author {i % 5000}', 'isbn': f'{i:013d}', 'available_copies': 1 + i % 5}
+
+
+def encode(rows, kind):
+    if kind == 'csv':
+        yield b'title,author,isbn,available_copies\n'
+        for row in rows:
+            yield f"{row['title']},{row['author']},{row['isbn']},{row.get('available_copies', '')}\n".encode()
+    else:
+        for row in rows:
+            yield (json.dumps(row) + '\n').encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--baseline-books', type=int, default=500, help='books added one request at a time')
+    parser.add_argument('--format', choices=('csv', 'ndjson'), default='csv')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--database-url', help='scratch database to use instead of SQLite (its tables are recreated)')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    app = create_benchmark_app(StandInBroker(), books=0, database_url=args.database_url,
+                               JWT_SECRET_KEY='benchmark-secret-key-long-enough', BULK_IMPORT_CHUNK_SIZE=args.chunk_size)
+    jwt.init_app(app)
+    catalogue_cache.init_app(app)
+    app.register_blueprint(book_bp, url_prefix='/book')
+    client = app.test_client()
+    with app.app_context():
+        headers = {'Authorization': 'Bearer ' + create_access_token(identity='1', additional_claims={'role': 'librarian'})}
+
+    started = time.perf_counter()
+    for row in generate(args.baseline_books, offset=args.books):
+        assert client.post('/book/add', json=row, headers=headers).status_code == 201
+    baseline = args.baseline_books / (time.perf_counter() - started)
+
+    # The last rows repeat an earlier ISBN, lack a title and carry a bad copy count
+    rows = list(generate(args.books)) + [
+        {'title': 'Again', 'author': 'Someone', 'isbn': f'{0:013d}'},
+        {'title': '', 'author': 'Someone', 'isbn': 'X1'},
+        {'title': 'Copies', 'author': 'Someone', 'isbn': 'X2', 'available_copies': 'many'},
+    ]
+    content_type = 'text/csv' if args.format == 'csv' else 'application/x-ndjson'
+    body = b''.join(encode(rows, args.format))
+    started = time.perf_counter()
+    response = client.post('/book/bulk_import', data=body, content_type=content_type, headers=headers)
+    elapsed = time.perf_counter() - started
+    result = response.get_json()
+
+    print(f"books={args.books} format={args.format} chunk_size={args.chunk_size}")
+    print(f"/book/add:         {baseline:9.0f} books/sec ({args.books / baseline:8.1f}s for the catalogue)")
+    print(f"/book/bulk_import: {result['imported'] / elapsed:9.0f} books/sec ({elapsed:8.1f}s, "
+          f"{result['imported']} imported, {result['rejected']} rejected)")
+    for error in result['errors']:
+        print(f"  line {error['line']}: {error['error']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Stress test for concurrent borrow consumers: proves stock is never oversold.
+
+Starts a pool of borrow consumer threads (the same pool create_app() starts), floods the
+stand-in broker with borrow requests for a handful of scarce books and then checks, per book,
+that available copies never went negative and that copies + active borrowings still equal
+the initial stock. Exits with status 1 if any invariant is violated.
+
+    cd book_service && python -m benchmarks.oversell_stress --workers 16 --requests 5000
+    python -m benchmarks.oversell_stress --batch-size 50 --database-url postgresql://.../scratch_db
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+
+import pika
+from sqlalchemy import func
+
+from app import start_consumer_pool
+from app.broker import start_borrow_request_consumer
+from app.extensions import db, rabbitmq
+from app.models import Book, Borrowing
+from app.outbox import outbox_relay
+from benchmarks.stand_in import StandInBroker, create_benchmark_app
+
+REPLY_QUEUE = 'stress_reply_queue'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--books', type=int, default=20)
+    parser.add_argument('--copies', type=int, default=50)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--database-url', help='scratch database to use instead of SQLite (its tables are recreated)')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    broker = StandInBroker()
+    app = create_benchmark_app(
+        broker,
+        books=args.books,
+        copies=args.copies,
+        database_url=args.database_url,
+        BORROW_BATCH_SIZE=args.batch_size,
+        SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 60}} if not args.database_url else {},
+    )
+
+    rng = random.Random(0)
+    with app.app_context():
+        started = time.perf_counter()
+        start_consumer_pool(app, start_borrow_request_consumer, args.workers, 'borrowing')
+        start_consumer_pool(app, outbox_relay.run, 1, 'outbox relay')
+        for tag in range(args.requests):
+            rabbitmq.publish(
+                'borrow_request_queue',
+                json.dumps({'user_id': rng.randrange(args.users), 'book_id': rng.randrange(1, args.books + 1)}),
+                properties=pika.BasicProperties(correlation_id=str(tag), reply_to=REPLY_QUEUE),
+            )
+
+        replies = broker.published[REPLY_QUEUE]
+        while len(replies) < args.requests and time.perf_counter() - started < args.timeout:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        responses = [json.loads(body) for _, body in replies]
+        succeeded = sum(response['status'] == 'success' for response in responses)
+        errors = [response['message'] for response in responses if response['message'].startswith('Error')]
+
+        active = dict(
+            db.session.query(Borrowing.book_id, func.count(Borrowing.id))
+            .filter(Borrowing.returned_on.is_(None))
+            .group_by(Borrowing.book_id)
+            .all()
+        )
+        violations = []
+        for book in Book.query.order_by(Book.id).all():
+            borrowed = active.get(book.id, 0)
+            if book.available_copies < 0 or book.available_copies + borrowed != args.copies:
+                violations.append(f"book {book.id}: {book.available_copies} available, {borrowed} borrowed")
+        if succeeded != sum(active.values()):
+            violations.append(f"{succeeded} successful replies but {sum(active.values())} borrowings recorded")
+        if len(responses) < args.requests:
+            violations.append(f"only {len(responses)} of {args.requests} requests were answered")
+
+    print(f"workers={args.workers} batch_size={args.batch_size} requests={args.requests} "
+          f"stock={args.books}x{args.copies}")
+    print(f"{len(responses)} replies in {elapsed:.2f}s ({len(responses) / elapsed:.0f} msgs/sec), "
+          f"{succeeded} borrowed, {len(errors)} errors")
+    if violations:
+        print("OVERSOLD:\n  " + "\n  ".join(violations))
+        sys.exit(1)
+    print("OK: no book was oversold")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Book search latency: ILIKE scans against the in-process inverted index.
+
+Loads a synthetic catalogue into a SQLite database, builds the index once (reporting how long
+that takes) and runs the same mix of title, author, ISBN and free-text queries through both
+backends, reporting average and p95 latency per query.
+
+    cd book_service && python -m benchmarks.search --books 1000000 --queries 200
+"""
+import argparse
+import random
+import statistics
+import time
+
+from app.extensions import db
+from app.models import Book
+from app.search import SearchEngine
+from benchmarks.stand_in import StandInBroker, create_benchmark_app
+
+WORDS = [
+    'river', 'shadow', 'garden', 'winter', 'empire', 'silent', 'golden', 'night', 'ocean', 'forest',
+    'stone', 'glass', 'city', 'dream', 'storm', 'iron', 'secret', 'letter', 'light', 'house',
+]
+SURNAMES = ['Smith', 'Novak', 'Garcia', 'Popescu', 'Muller', 'Rossi', 'Tanaka', 'Kowalski', 'Dubois', 'Olsen']
+
+INSERT_CHUNK_SIZE = 10000
+
+
+def fill_catalogue(count, seed=0):
+    rng = random.Random(seed)
+    insert = Book.__table__.insert()
+    for start in range(0, count, INSERT_CHUNK_SIZE):
+        rows = [
+            {
+                'title': ' '.join(rng.choice(WORDS) for _ in range(3)).title() + f' {i}',
+                'author': f'{rng.choice(SURNAMES)} {i % 5000}',
+                'isbn': f'978{i:010d}',
+                'available_copies': 1,
+            }
+            for i in range(start, min(start + INSERT_CHUNK_SIZE, count))
+        ]
+        db.session.execute(insert, rows)
+    db.session.commit()
+
+
+def make_queries(count, books, seed=1):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        kind = rng.randrange(4)
+        if kind == 0:
+            queries.append({'title': f'{rng.choice(WORDS)} {rng.choice(WORDS)}'})
+        elif kind == 1:
+            queries.append({'author': f'{rng.choice(SURNAMES)} {rng.randrange(5000)}'})
+        elif kind == 2:
+            queries.append({'isbn': f'978{rng.randrange(books):010d}'[:9]})
+        else:
+            queries.append({'q': f'{rng.choice(WORDS)} {rng.choice(SURNAMES)[:3]}'})
+    return queries
+
+
+def measure(engine, queries, limit):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        engine.search(limit=limit, **query)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_benchmark_app(StandInBroker(), books=0)
+    with app.app_context():
+        started = time.perf_counter()
+        fill_catalogue(args.books)
+        print(f"loaded {args.books} books in {time.perf_counter() - started:.1f}s")
+
+        queries = make_queries(args.queries, args.books)
+
+        ilike = SearchEngine()
+        ilike.backend = 'ilike'
+        memory = SearchEngine()
+        memory.backend = 'memory'
+
+        started = time.perf_counter()
+        memory.search(q='warmup')
+        print(f"built the memory index in {time.perf_counter() - started:.1f}s")
+
+        for name, engine in (('ilike', ilike), ('memory', memory)):
+            average, p95 = measure(engine, queries, args.limit)
+            print(f"{name:>6}: avg {average:9.2f} ms   p95 {p95:9.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+In-process stand-ins for the pieces of the book service the benchmarks need:
+a pika-compatible broker with in-memory queues that records publishes and acks,
+and an app factory running on a throwaway SQLite database.
+"""
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+from flask import Flask
+
+from app.extensions import db, rabbitmq
+from app.models import Book
+from app.outbox import outbox_relay
+from config import Config
+
+
+class StandInChannel:
+    def __init__(self, broker):
+        self._broker = broker
+        self._consumer = None
+        self._delivery_tag = 0
+        self._acked_up_to = 0
+        self.is_open = True
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        pass
+
+    def queue_declare(self, queue, **kwargs):
+        return SimpleNamespace(method=SimpleNamespace(queue=queue or self._broker.generate_queue_name()))
+
+    def exchange_declare(self, exchange, **kwargs):
+        pass
+
+    def queue_bind(self, queue, exchange, routing_key=None, **kwargs):
+        self._broker.bind(exchange, queue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, **kwargs):
+        if exchange:
+            self._broker.fanout(exchange, body, properties)
+        else:
+            self._broker.publish(routing_key, body, properties)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._broker.ack(delivery_tag - self._acked_up_to if multiple else 1)
+        self._acked_up_to = max(self._acked_up_to, delivery_tag)
+
+    def basic_consume(self, queue, on_message_callback, **kwargs):
+        self._consumer = (queue, on_message_callback)
+
+    def start_consuming(self):
+        while True:
+            self.deliver(timeout=None)
+
+    def deliver(self, timeout):
+        """Hand queued messages to the consumer callback, waiting up to `timeout` seconds for the first one."""
+        name, callback = self._consumer
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            try:
+                if remaining is not None and remaining <= 0:
+                    properties, body = self._broker.queue(name).get_nowait()
+                else:
+                    properties, body = self._broker.queue(name).get(timeout=remaining)
+            except queue.Empty:
+                return
+            callback(self, self._next_delivery(name), properties, body)
+
+    def consume(self, queue_name, inactivity_timeout=None, **kwargs):
+        while True:
+            try:
+                properties, body = self._broker.queue(queue_name).get(timeout=inactivity_timeout)
+            except queue.Empty:
+                yield None, None, None
+                continue
+            yield self._next_delivery(queue_name), properties, body
+
+    def _next_delivery(self, routing_key):
+        self._delivery_tag += 1
+        return SimpleNamespace(delivery_tag=self._delivery_tag, routing_key=routing_key, redelivered=False)
+
+
+class StandInConnection:
+    def __init__(self, broker):
+        self._broker = broker
+        self._channels = []
+        self.is_open = True
+
+    def channel(self):
+        channel = StandInChannel(self._broker)
+        self._channels.append(channel)
+        return channel
+
+    def process_data_events(self, time_limit=0):
+        # Deliveries to consumers happen here, as with pika's BlockingConnection
+        for channel in self._channels:
+            if channel._consumer is not None:
+                channel.deliver(timeout=time_limit)
+
+    def close(self):
+        self.is_open = False
+
+
+class StandInBroker:
+    """Routes published messages to in-memory queues, keeps a copy of each and counts acknowledged deliveries."""
+
+    def __init__(self):
+        self.published = defaultdict(list)
+        self.acked = 0
+        self._queues = defaultdict(queue.Queue)
+        self._bindings = defaultdict(set)
+        self._generated_queues = 0
+        self._lock = threading.Lock()
+
+    def connect(self):
+        return StandInConnection(self)
+
+    def queue(self, name):
+        with self._lock:
+            return self._queues[name]
+
+    def publish(self, routing_key, body, properties):
+        with self._lock:
+            self.published[routing_key].append((properties, body))
+            self._queues[routing_key].put((properties, body))
+
+    def generate_queue_name(self):
+        with self._lock:
+            self._generated_queues += 1
+            return f'amq.gen-{self._generated_queues}'
+
+    def bind(self, exchange, queue_name):
+        with self._lock:
+            self._bindings[exchange].add(queue_name)
+
+    def fanout(self, exchange, body, properties):
+        with self._lock:
+            bound = list(self._bindings[exchange])
+        for queue_name in bound:
+            self.publish(queue_name, body, properties)
+
+    def ack(self, count):
+        with self._lock:
+            self.acked += count
+
+
+def create_benchmark_app(broker, books=1000, copies=1_000_000, database_url=None, **config):
+    """
+    Flask app bound to a fresh SQLite file and the given stand-in broker.
+    `database_url` points it at another database instead; its tables are dropped and recreated.
+    """
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='book_bench_'), 'books.db')
+        database_url = f'sqlite:///{path}'
+
+    app = Flask('book_service_benchmark')
+    app.config.from_object(Config)
+    app.config.update(SQLALCHEMY_DATABASE_URI=database_url, **config)
+    db.init_app(app)
+    rabbitmq.init_app(app)
+    rabbitmq.connection_factory = broker.connect
+    outbox_relay.init_app(app)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.bulk_save_objects([
+            Book(title=f'Book {i}', author=f'Author {i % 100}', isbn=f'{i:013d}', available_copies=copies)
+            for i in range(books)
+        ])
+        db.session.commit()
+    return app
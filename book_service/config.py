@@ -12,3 +12,97 @@ class Config:
 
     # JWT configuration
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
+    # Verified access tokens remembered (until they expire) so repeat requests skip verification; 0 turns it off
+    JWT_CACHE_SIZE = int(os.getenv('JWT_CACHE_SIZE', 10000))
+
+    # RabbitMQ configuration
+    RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'rabbitmq')
+    # Long-lived publisher channels shared by request and consumer threads
+    RABBITMQ_PUBLISHER_POOL_SIZE = int(os.getenv('RABBITMQ_PUBLISHER_POOL_SIZE', 8))
+    # Wait for a broker ack on every publish (slower, but a returned publish is guaranteed to be stored)
+    RABBITMQ_PUBLISHER_CONFIRMS = os.getenv('RABBITMQ_PUBLISHER_CONFIRMS', 'false').lower() == 'true'
+
+    # Catalogue read cache (book rows and search results), invalidated on every book change
+    CATALOGUE_CACHE_ENABLED = os.getenv('CATALOGUE_CACHE_ENABLED', 'true').lower() == 'true'
+    CATALOGUE_CACHE_MAX_ENTRIES = int(os.getenv('CATALOGUE_CACHE_MAX_ENTRIES', 50000))
+    # Upper bound on staleness should an invalidation event be lost
+    CATALOGUE_CACHE_TTL = float(os.getenv('CATALOGUE_CACHE_TTL', 60))
+    # Store implementation, importable as module.Class
+    CATALOGUE_CACHE_STORE = os.getenv('CATALOGUE_CACHE_STORE', 'app.cache.LRUStore')
+
+    # Largest page /book/all_books returns with keyset pagination
+    CATALOGUE_PAGE_MAX_LIMIT = int(os.getenv('CATALOGUE_PAGE_MAX_LIMIT', 1000))
+    # Rows fetched per round trip when streaming the catalogue as NDJSON
+    CATALOGUE_STREAM_BATCH_SIZE = int(os.getenv('CATALOGUE_STREAM_BATCH_SIZE', 1000))
+    # /book/bulk_import: books inserted (and committed) per chunk, and how many rejected rows are listed
+    BULK_IMPORT_CHUNK_SIZE = int(os.getenv('BULK_IMPORT_CHUNK_SIZE', 500))
+    BULK_IMPORT_MAX_ERRORS = int(os.getenv('BULK_IMPORT_MAX_ERRORS', 1000))
+
+    # Search backend for /book/search: auto, postgres, memory or ilike (see app/search.py)
+    SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')
+    # Most results a search returns
+    SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', 50))
+
+    # Whether the web process also consumes the request queues; the production WSGI entry point (wsgi.py)
+    # turns this off and leaves them to worker.py
+    CONSUMERS_ENABLED = os.getenv('CONSUMERS_ENABLED', 'true').lower() == 'true'
+    # Consumer threads per process for each request queue
+    BORROW_CONSUMER_WORKERS = int(os.getenv('BORROW_CONSUMER_WORKERS', 1))
+    RETURN_CONSUMER_WORKERS = int(os.getenv('RETURN_CONSUMER_WORKERS', 1))
+    # Borrow request consumer: unacknowledged messages the broker may push at once
+    BORROW_CONSUMER_PREFETCH = int(os.getenv('BORROW_CONSUMER_PREFETCH', 100))
+    # Requests handled per transaction; 1 processes messages one by one
+    BORROW_BATCH_SIZE = int(os.getenv('BORROW_BATCH_SIZE', 1))
+    # Longest a request waits for its batch to fill up
+    BORROW_BATCH_MAX_LATENCY_MS = float(os.getenv('BORROW_BATCH_MAX_LATENCY_MS', 20))
+    # Return request consumer: unacknowledged messages the broker may push at once
+    RETURN_CONSUMER_PREFETCH = int(os.getenv('RETURN_CONSUMER_PREFETCH', 10))
+    # Milliseconds a borrow/return request is still processed after its deadline (clock skew between hosts)
+    REQUEST_DEADLINE_GRACE_MS = int(os.getenv('REQUEST_DEADLINE_GRACE_MS', 0))
+    # Times a failed borrow/return request is retried before it goes to its dead-letter queue (app/consumer.py)
+    CONSUMER_MAX_RETRIES = int(os.getenv('CONSUMER_MAX_RETRIES', 3))
+    # Milliseconds before the first retry; the delay doubles with every retry, up to the maximum
+    CONSUMER_RETRY_DELAY_MS = int(os.getenv('CONSUMER_RETRY_DELAY_MS', 1000))
+    CONSUMER_RETRY_MAX_DELAY_MS = int(os.getenv('CONSUMER_RETRY_MAX_DELAY_MS', 30000))
+    # Background consumer threads are restarted after this many seconds, doubling after every failure
+    SUPERVISOR_RESTART_DELAY = float(os.getenv('SUPERVISOR_RESTART_DELAY', 1))
+    SUPERVISOR_MAX_RESTART_DELAY = float(os.getenv('SUPERVISOR_MAX_RESTART_DELAY', 60))
+    # Seconds between consumer heartbeats, and without one before /health reports the service unhealthy
+    SUPERVISOR_HEARTBEAT_INTERVAL = float(os.getenv('SUPERVISOR_HEARTBEAT_INTERVAL', 5))
+    SUPERVISOR_HEARTBEAT_TIMEOUT = float(os.getenv('SUPERVISOR_HEARTBEAT_TIMEOUT', 120))
+    # worker.py: consumer processes to run, and the first port they serve /health and /metrics on (0: none)
+    WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 1))
+    WORKER_HEALTH_PORT = int(os.getenv('WORKER_HEALTH_PORT', 0))
+    # Seconds the reply to a request with an Idempotency-Key is kept for retries of that request
+    IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))
+    # Replies kept in memory in front of the idempotency_keys table (0 reads every retry from the database)
+    IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+
+    # Kafka producer (created on first use, see app/producer.py)
+    KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'kafka1:9092')
+    # Broker version, e.g. 2.8.0; when set the producer skips probing the broker on creation
+    KAFKA_API_VERSION = os.getenv('KAFKA_API_VERSION')
+    # Acknowledgements a send waits for: 0, 1 or all
+    KAFKA_ACKS = os.getenv('KAFKA_ACKS', '1')
+    # How long a send may wait for more events to share its batch, and the batch size in bytes
+    KAFKA_LINGER_MS = int(os.getenv('KAFKA_LINGER_MS', 10))
+    KAFKA_BATCH_SIZE = int(os.getenv('KAFKA_BATCH_SIZE', 32768))
+    # gzip, snappy, lz4, zstd or empty for none (all but gzip need their client library installed)
+    KAFKA_COMPRESSION_TYPE = os.getenv('KAFKA_COMPRESSION_TYPE', 'gzip')
+    # Longest a send blocks when Kafka is unreachable or the buffer is full, in milliseconds
+    KAFKA_MAX_BLOCK_MS = int(os.getenv('KAFKA_MAX_BLOCK_MS', 10000))
+    # Seconds to wait for buffered events on flush and at shutdown
+    KAFKA_FLUSH_TIMEOUT = float(os.getenv('KAFKA_FLUSH_TIMEOUT', 10))
+
+    # Outbox relay: most messages published per batch
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+    # How long the relay waits for more messages after being woken up by a commit
+    OUTBOX_LINGER_MS = float(os.getenv('OUTBOX_LINGER_MS', 5))
+    # How often the relay checks for messages queued by other processes, in seconds
+    OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1))
+
+    # Who hears about a returned copy: 'all' waiting users, or only the 'next' one in line (FIFO)
+    WAITLIST_NOTIFY_MODE = os.getenv('WAITLIST_NOTIFY_MODE', 'all')
+
+    # Serve request, SQL and broker metrics on /metrics (Prometheus text format)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
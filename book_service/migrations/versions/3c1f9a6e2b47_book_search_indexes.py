@@ -0,0 +1,45 @@
+"""book search indexes
+
+PostgreSQL only: other databases search with the in-process index of app/search.py, which these
+indexes would not serve.
+
+Revision ID: 3c1f9a6e2b47
+Revises: 75d8dbafc5a3
+Create Date: 2026-10-18 14:02:11.318220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f9a6e2b47'
+down_revision = '75d8dbafc5a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # Trigram GIN indexes serve ILIKE '%...%' and similarity(); the tsvector index serves
+    # the word/prefix matching of /book/search (see app/search.py)
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_books_title_trgm', 'books', ['title'], postgresql_using='gin',
+                    postgresql_ops={'title': 'gin_trgm_ops'})
+    op.create_index('ix_books_author_trgm', 'books', ['author'], postgresql_using='gin',
+                    postgresql_ops={'author': 'gin_trgm_ops'})
+    op.create_index('ix_books_isbn_pattern', 'books', ['isbn'], postgresql_ops={'isbn': 'varchar_pattern_ops'})
+    op.execute(
+        "CREATE INDEX ix_books_search_tsv ON books "
+        "USING gin (to_tsvector('simple', title || ' ' || author))"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_books_search_tsv")
+    op.drop_index('ix_books_isbn_pattern', table_name='books')
+    op.drop_index('ix_books_author_trgm', table_name='books')
+    op.drop_index('ix_books_title_trgm', table_name='books')
@@ -0,0 +1,96 @@
+"""
+/book/borrowed_books must not issue one query per borrowing. Run from book_service/:
+
+    python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from flask import Flask
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app.extensions import db, jwt
+from app.models import Book, Borrowing
+from app.routes import book_bp
+from config import Config
+
+USER_ID = 1
+
+
+class BorrowedBooksQueryCountTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory(prefix='book_tests_')
+        self.app = Flask(__name__)
+        self.app.config.from_object(Config)
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(self.directory.name, 'books.db')}",
+            JWT_SECRET_KEY='test-secret-key-that-is-long-enough',
+        )
+        db.init_app(self.app)
+        jwt.init_app(self.app)
+        self.app.register_blueprint(book_bp, url_prefix='/book')
+
+        with self.app.app_context():
+            db.create_all()
+            self.token = create_access_token(identity=str(USER_ID), additional_claims={'role': 'user'})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.directory.cleanup()
+
+    def seed(self, borrowings):
+        """Give USER_ID `borrowings` open borrowings, next to a returned one and another user's."""
+        with self.app.app_context():
+            start = db.session.query(Book).count()
+            books = [
+                Book(title=f'Book {i}', author=f'Author {i}', isbn=f'{i:013d}', available_copies=1)
+                for i in range(start, start + borrowings + 2)
+            ]
+            db.session.add_all(books)
+            db.session.flush()
+            return_by = datetime.utcnow() + timedelta(days=14)
+            db.session.add_all([Borrowing(book.id, USER_ID, return_by) for book in books[:borrowings]])
+            returned = Borrowing(books[-2].id, USER_ID, return_by)
+            returned.returned_on = datetime.utcnow()
+            db.session.add_all([returned, Borrowing(books[-1].id, USER_ID + 1, return_by)])
+            db.session.commit()
+
+    def get_borrowed_books(self):
+        """The route's response and the SQL statements it ran."""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                response = self.client.get(
+                    f'/book/borrowed_books?user_id={USER_ID}',
+                    headers={'Authorization': f'Bearer {self.token}'},
+                )
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+        return response, statements
+
+    def test_one_query_for_any_number_of_borrowings(self):
+        total = 0
+        for borrowings in (1, 10, 100):
+            self.seed(borrowings - total)
+            total = borrowings
+            with self.subTest(borrowings=borrowings):
+                response, statements = self.get_borrowed_books()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.get_json()['borrowed_books']), borrowings)
+                self.assertEqual(len(statements), 1, statements[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
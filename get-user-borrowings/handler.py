@@ -1,12 +1,151 @@
 import json
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import os
+import threading
+import time
 from datetime import datetime
 import jwt
 
 SECRET_KEY = os.getenv('JWT_SECRET_KEY')
 VALID_ROLES = ["librarian", "user"]
 
+# Database connection details, read once per container rather than once per invocation
+DB_SETTINGS = {
+    "host": os.getenv("DB_HOST"),
+    "database": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "port": os.getenv("DB_PORT", 5434),
+}
+# 0 keeps one connection per container (one invocation at a time, as on Lambda);
+# N > 0 shares a psycopg2 pool of up to N connections between threads (e.g. serverless-offline)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 0))
+# A connection left idle for longer than this is checked with SELECT 1 before it is reused
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", 30))
+
+BORROWINGS_STATEMENT = "user_borrowings"
+BORROWINGS_QUERY = """
+                  SELECT b.id AS book_id, b.title, b.author, b.isbn, br.borrowed_on, br.return_by
+                  FROM borrowings br
+                  JOIN books b ON br.book_id = b.id
+                  WHERE br.user_id = $1 AND br.returned_on IS NULL
+              """
+
+
+class BorrowingsConnection(psycopg2.extensions.connection):
+    """Connection that remembers whether the borrowings statement is prepared on it and when it was last used."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statement_prepared = False
+        self.last_used = time.monotonic()
+
+
+_connection = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _connect():
+    connection = psycopg2.connect(connection_factory=BorrowingsConnection, **DB_SETTINGS)
+    # Reads only: no transaction is left open between warm invocations
+    connection.autocommit = True
+    return connection
+
+
+def _is_healthy(connection):
+    if connection.closed:
+        return False
+    if time.monotonic() - connection.last_used < DB_HEALTH_CHECK_INTERVAL:
+        return True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def acquire_connection():
+    """Return a healthy connection, reusing the one kept from earlier invocations when possible."""
+    global _connection, _pool
+    if DB_POOL_SIZE > 0:
+        with _pool_lock:
+            if _pool is None:
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    1, DB_POOL_SIZE, connection_factory=BorrowingsConnection, **DB_SETTINGS
+                )
+        connection = _pool.getconn()
+        if not _is_healthy(connection):
+            _pool.putconn(connection, close=True)
+            connection = _pool.getconn()
+        connection.autocommit = True
+        return connection
+
+    if _connection is None or not _is_healthy(_connection):
+        discard_connection(_connection)
+        _connection = _connect()
+    return _connection
+
+
+def release_connection(connection):
+    connection.last_used = time.monotonic()
+    if DB_POOL_SIZE > 0:
+        _pool.putconn(connection)
+
+
+def discard_connection(connection):
+    """Drop a broken connection so the next acquire_connection() opens a new one."""
+    global _connection
+    if connection is None:
+        return
+    if DB_POOL_SIZE > 0:
+        _pool.putconn(connection, close=True)
+    else:
+        if connection is _connection:
+            _connection = None
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+def close_connections():
+    """Close every kept connection (used by the local harness between simulated cold starts)."""
+    global _pool
+    discard_connection(_connection)
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+
+def fetch_borrowings(user_id):
+    """
+    Run the borrowings JOIN as a prepared statement, so warm invocations skip parsing and planning.
+    A connection that turns out to be broken is replaced and the query retried once.
+    """
+    for attempt in range(2):
+        connection = acquire_connection()
+        try:
+            with connection.cursor() as cursor:
+                if not connection.statement_prepared:
+                    cursor.execute(f"PREPARE {BORROWINGS_STATEMENT} (integer) AS {BORROWINGS_QUERY}")
+                    connection.statement_prepared = True
+                cursor.execute(f"EXECUTE {BORROWINGS_STATEMENT} (%s)", (user_id,))
+                rows = cursor.fetchall()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard_connection(connection)
+            if attempt:
+                raise
+            continue
+        except Exception:
+            release_connection(connection)
+            raise
+        release_connection(connection)
+        return rows
+
 
 def get_user_borrowings(event, context):
     # Extract JWT token from the Authorization header
@@ -46,7 +185,7 @@ def get_user_borrowings(event, context):
             "body": json.dumps({"error": "Invalid token"})
         }
 
-    user_id = event.get("queryStringParameters", {}).get("user_id")
+    user_id = (event.get("queryStringParameters") or {}).get("user_id")
 
     if not user_id:
         return {
@@ -54,32 +193,8 @@ def get_user_borrowings(event, context):
             "body": json.dumps({"error": "user_id is required"})
         }
 
-    # Database connection details from environment variables
-    db_host = os.getenv("DB_HOST")
-    db_name = os.getenv("DB_NAME")
-    db_user = os.getenv("DB_USER")
-    db_password = os.getenv("DB_PASSWORD")
-    db_port = os.getenv("DB_PORT", 5434)
-
     try:
-        # Connect to the database
-        connection = psycopg2.connect(
-            host=db_host,
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            port=db_port
-        )
-        cursor = connection.cursor()
-
-        query = """
-                  SELECT b.id AS book_id, b.title, b.author, b.isbn, br.borrowed_on, br.return_by
-                  FROM borrowings br
-                  JOIN books b ON br.book_id = b.id
-                  WHERE br.user_id = %s AND br.returned_on IS NULL;
-              """
-        cursor.execute(query, (user_id,))
-        rows = cursor.fetchall()
+        rows = fetch_borrowings(user_id)
 
         # Format the response to include book ID, author, and ISBN
         borrowings = [
@@ -94,10 +209,6 @@ def get_user_borrowings(event, context):
             for row in rows
         ]
 
-        # Close connections
-        cursor.close()
-        connection.close()
-
         return {
             "statusCode": 200,
             "body": json.dumps(borrowings)
@@ -0,0 +1,115 @@
+"""
+Local latency harness for the get-user-borrowings function.
+
+Replays event.json against handler.get_user_borrowings and reports latency percentiles for
+cold starts (fresh import of the handler module, so the first invocation also connects and
+prepares the statement) and warm invocations (the same module, reusing its connection).
+
+The DB_* environment variables must point at a book database, as in serverless.yml.
+If the event carries no Authorization header, one is signed with JWT_SECRET_KEY, and a
+user_id found in pathParameters is also passed as the user_id query string parameter.
+
+    cd get-user-borrowings && python harness.py --invocations 500 --cold-starts 10
+"""
+import argparse
+import copy
+import importlib
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+import jwt
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_event(path, role):
+    with open(path) as event_file:
+        event = json.load(event_file)
+
+    path_parameters = event.get("pathParameters") or {}
+    query = event.setdefault("queryStringParameters", {}) or {}
+    if "user_id" not in query and "user_id" in path_parameters:
+        query["user_id"] = path_parameters["user_id"]
+    event["queryStringParameters"] = query
+
+    headers = event.setdefault("headers", {}) or {}
+    if "Authorization" not in headers:
+        token = jwt.encode(
+            {"sub": str(query.get("user_id", "1")), "role": role, "exp": int(time.time()) + 3600},
+            os.environ["JWT_SECRET_KEY"],
+            algorithm="HS256",
+        )
+        headers["Authorization"] = f"Bearer {token}"
+    event["headers"] = headers
+    return event
+
+
+def load_handler():
+    """Import handler.py from scratch, as a new container would."""
+    sys.modules.pop("handler", None)
+    return importlib.import_module("handler")
+
+
+def invoke(module, event, statuses):
+    started = time.perf_counter()
+    response = module.get_user_borrowings(copy.deepcopy(event), None)
+    elapsed = (time.perf_counter() - started) * 1000
+    statuses[response["statusCode"]] += 1
+    return elapsed, response
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(name, latencies):
+    print(
+        f"{name:>5}: n={len(latencies):5d}  "
+        f"p50 {percentile(latencies, 0.50):8.2f} ms  "
+        f"p95 {percentile(latencies, 0.95):8.2f} ms  "
+        f"p99 {percentile(latencies, 0.99):8.2f} ms  "
+        f"mean {statistics.mean(latencies):8.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--event", default=os.path.join(HERE, "event.json"))
+    parser.add_argument("--invocations", type=int, default=200, help="warm invocations to replay")
+    parser.add_argument("--cold-starts", type=int, default=10, help="fresh imports, one invocation each")
+    parser.add_argument("--role", default="user")
+    args = parser.parse_args()
+
+    os.environ.setdefault("JWT_SECRET_KEY", "supersecretkey")
+    sys.path.insert(0, HERE)
+    event = build_event(args.event, args.role)
+    statuses = Counter()
+
+    cold = []
+    for _ in range(args.cold_starts):
+        started = time.perf_counter()
+        module = load_handler()
+        invoke(module, event, statuses)
+        cold.append((time.perf_counter() - started) * 1000)
+        module.close_connections()
+
+    module = load_handler()
+    _, response = invoke(module, event, statuses)
+    warm = [invoke(module, event, statuses)[0] for _ in range(args.invocations)]
+    module.close_connections()
+
+    if cold:
+        report("cold", cold)
+    report("warm", warm)
+    print("status codes:", dict(statuses))
+    if response["statusCode"] != 200:
+        print("last error:", response["body"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+"""
+End-to-end load test of the borrow/return saga:
+user_service -> RabbitMQ -> book_service -> RabbitMQ -> user_service.
+
+Runs the User and Book Services in one process, each on its own SQLite database, wired through
+the book service's in-memory stand-in for RabbitMQ and an in-memory stand-in for Kafka (the
+book-availability events reach the User Service's notification consumer, with email sending
+suppressed). A pool of virtual users then sends a seeded mix of borrow, return and search
+requests through the services' HTTP routes, and the harness reports throughput and
+p50/p95/p99 latency per operation.
+
+Afterwards it checks that:
+ - no book was oversold (copies never negative, copies + open borrowings = initial stock),
+ - every reply reached the request that sent it (no timeouts, each reply names its caller's
+   user and book, and the borrowings the users were told about are the ones recorded),
+ - every availability event was consumed.
+It exits with status 1 if an invariant is violated, or if --compare finds a regression.
+
+The services' settings come from the environment as usual (e.g. BORROW_CONSUMER_WORKERS,
+BORROW_BATCH_SIZE, OUTBOX_BATCH_SIZE).
+
+    python loadtest/saga.py --concurrency 16 --requests 2000 --save baseline.json
+    python loadtest/saga.py --concurrency 16 --requests 2000 --compare baseline.json
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from flask import Flask
+from flask_jwt_extended import create_access_token
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOOK_SERVICE = os.path.join(ROOT, 'book_service')
+USER_SERVICE = os.path.join(ROOT, 'user_service')
+
+# Top-level packages every service defines under the same names
+SERVICE_PACKAGES = ('app', 'config', 'benchmarks')
+
+JWT_SECRET_KEY = 'loadtest-secret-key-that-is-long-enough'
+OPERATIONS = ('borrow', 'return', 'search')
+EXPECTED_STATUS = {'borrow': {200, 409}, 'return': {200}, 'search': {200, 404}}
+
+Record = namedtuple('Record', 'topic partition offset value')
+
+
+@contextmanager
+def service(directory):
+    """
+    Make one service importable, yielding importlib.import_module. On exit its packages are
+    taken out of sys.modules so the next service can import its own `app` and `config`;
+    the objects imported meanwhile keep working.
+    """
+    sys.path.insert(0, directory)
+    try:
+        yield importlib.import_module
+    finally:
+        sys.path.remove(directory)
+        for name in list(sys.modules):
+            if name.partition('.')[0] in SERVICE_PACKAGES:
+                del sys.modules[name]
+
+
+class _Delivered:
+    """Future of a stand-in Kafka send: delivered as soon as it is made."""
+
+    def add_callback(self, callback, *args):
+        callback(*args, None)
+        return self
+
+    def add_errback(self, errback, *args):
+        return self
+
+    def succeeded(self):
+        return True
+
+
+class StandInKafka:
+    """A single-partition, in-memory event log shared by the book service producer and the notification consumer."""
+
+    def __init__(self):
+        self.records = []
+        self._condition = threading.Condition()
+
+    def producer(self, value_serializer=None, **settings):
+        return StandInProducer(self, value_serializer)
+
+    def append(self, topic, value):
+        with self._condition:
+            self.records.append(Record(topic, 0, len(self.records), value))
+            self._condition.notify_all()
+
+    def read(self, position, max_records, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.records) > position, timeout)
+            return self.records[position:position + max_records]
+
+
+class StandInProducer:
+    def __init__(self, kafka, value_serializer):
+        self._kafka = kafka
+        self._serialize = value_serializer or (lambda value: value)
+
+    def send(self, topic, value):
+        # Stored deserialized, as the consumer's value_deserializer would hand it over
+        self._kafka.append(topic, json.loads(self._serialize(value)))
+        return _Delivered()
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self, timeout=None):
+        pass
+
+
+class StandInConsumer:
+    def __init__(self, kafka):
+        self._kafka = kafka
+        self.position = 0
+        self.committed = 0
+
+    def poll(self, timeout_ms=0, max_records=500):
+        batch = self._kafka.read(self.position, max_records, timeout_ms / 1000)
+        self.position += len(batch)
+        return {('book-availability', 0): batch} if batch else {}
+
+    def seek(self, partition, offset):
+        self.position = offset
+
+    def commit(self):
+        self.committed = self.position
+
+
+def start_thread(app, target, *args, name=None):
+    def run():
+        with app.app_context():
+            target(*args)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def create_book_service(args, broker, kafka):
+    with service(BOOK_SERVICE) as load:
+        stand_in = load('benchmarks.stand_in')
+        book_app = load('app')
+        extensions = load('app.extensions')
+        broker_module = load('app.broker')
+        outbox = load('app.outbox')
+        search = load('app.search')
+        models = load('app.models')
+        routes = load('app.routes')
+
+        app = stand_in.create_benchmark_app(
+            broker,
+            books=args.books,
+            copies=args.copies,
+            database_url=args.database_url,
+            JWT_SECRET_KEY=JWT_SECRET_KEY,
+            SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 60}} if not args.database_url else {},
+        )
+        extensions.jwt.init_app(app)
+        extensions.catalogue_cache.init_app(app)
+        extensions.event_producer.init_app(app)
+        extensions.event_producer.producer_factory = kafka.producer
+        search.search_engine.init_app(app)
+        app.register_blueprint(routes.book_bp, url_prefix='/book')
+
+        start_pool = book_app.start_consumer_pool
+        book_app.start_request_consumers(app)
+        start_pool(app, broker_module.start_catalogue_invalidation_consumer, 1, 'catalogue invalidation')
+        start_pool(app, outbox.outbox_relay.run, 1, 'outbox relay')
+
+    return app, extensions.db, models
+
+
+def create_user_service(args, broker, kafka):
+    with service(USER_SERVICE) as load:
+        user_app = load('app')
+        extensions = load('app.extensions')
+        broker_module = load('app.broker')
+        cache = load('app.cache')
+        routes = load('app.routes')
+        config = load('config')
+
+        app = Flask('user_service_loadtest')
+        app.config.from_object(config.Config)
+        app.config.update(
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='user_load_'), 'users.db')}",
+            JWT_SECRET_KEY=JWT_SECRET_KEY,
+            RPC_REPLY_TIMEOUT=args.timeout,
+            MAIL_SUPPRESS_SEND=True,
+            NOTIFICATION_DIGEST_WINDOW_MS=args.digest_window_ms,
+        )
+        user_app.mail.init_app(app)
+        extensions.notification_dispatcher.init_app(app)
+        extensions.db.init_app(app)
+        extensions.jwt.init_app(app)
+        extensions.rabbitmq.init_app(app)
+        extensions.rabbitmq.connection_factory = broker.connect
+        app.register_blueprint(routes.user_bp, url_prefix='/user')
+        with app.app_context():
+            extensions.db.create_all()
+
+        start_thread(app, broker_module.start_borrow_response_consumer, name='borrow-response-consumer')
+        start_thread(app, broker_module.start_return_response_consumer, name='return-response-consumer')
+        extensions.notification_dispatcher.start(app)
+        consumer = StandInConsumer(kafka)
+        start_thread(app, consume_notifications, broker_module, consumer, name='notification-consumer')
+
+        # The response consumers declare their reply queues before anything is sent
+        broker_module.borrow_reply_queue_ready.wait(5)
+        broker_module.return_reply_queue_ready.wait(5)
+
+    return app, cache.pending_replies, consumer
+
+
+def consume_notifications(broker_module, consumer):
+    delivered = set()
+    while True:
+        records = broker_module.collect_notification_batch(consumer)
+        if records:
+            broker_module.deliver_notifications(consumer, records, delivered)
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (expected one of {', '.join(OPERATIONS)})")
+        weights[name] = float(weight)
+    return weights
+
+
+class VirtualUser:
+    """One user (its own user id) sending a seeded sequence of requests, one at a time."""
+
+    def __init__(self, user_id, requests, args, user_app, book_app, titles):
+        self.user_id = user_id
+        self.requests = requests
+        self.rng = random.Random(f"{args.seed}-{user_id}")
+        self.mix = args.mix
+        self.books = args.books
+        self.titles = titles
+        self.user_client = user_app.test_client()
+        self.book_client = book_app.test_client()
+        with user_app.app_context():
+            token = create_access_token(identity=str(user_id), additional_claims={'role': 'user'})
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.held = set()
+        self.latencies = {operation: [] for operation in OPERATIONS}
+        self.problems = []
+
+    def run(self, start):
+        start.wait()
+        for _ in range(self.requests):
+            operation = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+            if operation == 'return' and not self.held:
+                operation = 'borrow'
+            {'borrow': self.borrow, 'return': self.return_book, 'search': self.search}[operation]()
+
+    def timed(self, operation, call):
+        started = time.perf_counter()
+        response = call()
+        self.latencies[operation].append((time.perf_counter() - started) * 1000)
+        if response.status_code not in EXPECTED_STATUS[operation]:
+            self.problems.append(f"user {self.user_id} {operation}: HTTP {response.status_code} {response.get_data(True)}")
+        return response
+
+    def borrow(self):
+        book_id = self.rng.randint(1, self.books)
+        response = self.timed('borrow', lambda: self.user_client.post(
+            '/user/borrow', json={'user_id': self.user_id, 'book_id': book_id}, headers=self.headers))
+        message = (response.get_json(silent=True) or {}).get('msg', '')
+        # Every borrow reply mentions the user and/or book it is about
+        if any(int(found) != self.user_id for found in re.findall(r'user (\d+)', message)) or \
+                any(int(found) != book_id for found in re.findall(r'book (\d+)', message)):
+            self.problems.append(f"user {self.user_id} borrowing book {book_id} got someone else's reply: {message}")
+        if response.status_code == 200 and 'successfully' in message:
+            self.held.add(book_id)
+
+    def return_book(self):
+        book_id = self.rng.choice(sorted(self.held))
+        response = self.timed('return', lambda: self.user_client.post(
+            '/user/return', json={'user_id': self.user_id, 'book_id': book_id}, headers=self.headers))
+        if response.status_code == 200:
+            message = response.get_json()['msg']
+            if f'"{self.titles[book_id]}"' not in message:
+                self.problems.append(f"user {self.user_id} returning book {book_id} got someone else's reply: {message}")
+            self.held.discard(book_id)
+
+    def search(self):
+        term = f"Book {self.rng.randrange(self.books)}"
+        self.timed('search', lambda: self.book_client.get('/book/search', query_string={'q': term},
+                                                          headers=self.headers))
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def wait_until(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def check_invariants(args, users, broker, kafka, consumer, pending_replies, book_app, book_db, models):
+    violations = [problem for user in users for problem in user.problems]
+    Book, Borrowing, OutboxMessage = models.Book, models.Borrowing, models.OutboxMessage
+
+    with book_app.app_context():
+        def outbox_drained():
+            drained = OutboxMessage.query.count() == 0
+            book_db.session.remove()
+            return drained
+
+        if not wait_until(outbox_drained, args.timeout):
+            violations.append("the outbox was not drained")
+
+        open_borrowings = set(
+            book_db.session.query(Borrowing.user_id, Borrowing.book_id).filter(Borrowing.returned_on.is_(None)).all()
+        )
+        borrowed = {}
+        for _, book_id in open_borrowings:
+            borrowed[book_id] = borrowed.get(book_id, 0) + 1
+        for book in Book.query.order_by(Book.id).all():
+            if book.available_copies < 0 or book.available_copies + borrowed.get(book.id, 0) != args.copies:
+                violations.append(f"book {book.id} oversold: {book.available_copies} available, "
+                                  f"{borrowed.get(book.id, 0)} borrowed, {args.copies} in stock")
+        book_db.session.remove()
+
+    told = {(user.user_id, book_id) for user in users for book_id in user.held}
+    if told != open_borrowings:
+        violations.append(f"users were told about {len(told)} open borrowings, {len(open_borrowings)} are recorded "
+                          f"({len(told ^ open_borrowings)} differ)")
+
+    sent = sum(len(user.latencies['borrow']) + len(user.latencies['return']) for user in users)
+    replies = sum(len(messages) for queue_name, messages in list(broker.published.items())
+                  if queue_name.startswith(('borrow_response_queue.', 'return_response_queue.')))
+    if replies != sent:
+        violations.append(f"{sent} borrow/return requests but {replies} replies")
+    if len(pending_replies):
+        violations.append(f"{len(pending_replies)} requests are still waiting for a reply")
+
+    if not wait_until(lambda: consumer.committed >= len(kafka.records), args.timeout):
+        violations.append(f"{len(kafka.records) - consumer.committed} availability events were not consumed")
+    return violations
+
+
+def summarize(users, elapsed):
+    summary = {'throughput': sum(len(lat) for user in users for lat in user.latencies.values()) / elapsed, 'ops': {}}
+    for operation in OPERATIONS:
+        latencies = [latency for user in users for latency in user.latencies[operation]]
+        if latencies:
+            summary['ops'][operation] = {
+                'n': len(latencies),
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'mean': statistics.mean(latencies),
+            }
+    return summary
+
+
+def compare(summary, baseline, tolerance):
+    regressions = []
+    if summary['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append(f"throughput {summary['throughput']:.0f} req/s, baseline {baseline['throughput']:.0f}")
+    for operation, stats in summary['ops'].items():
+        before = baseline['ops'].get(operation)
+        if before and stats['p95'] > before['p95'] * (1 + tolerance):
+            regressions.append(f"{operation} p95 {stats['p95']:.2f} ms, baseline {before['p95']:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=16, help='virtual users sending requests in parallel')
+    parser.add_argument('--requests', type=int, default=2000, help='requests in total, split across the users')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('borrow=45,return=35,search=20'),
+                        help='operation weights, e.g. borrow=45,return=35,search=20')
+    parser.add_argument('--books', type=int, default=20)
+    parser.add_argument('--copies', type=int, default=3, help='copies per book; keep it low to contend for stock')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--digest-window-ms', type=float, default=50)
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for a reply or for queues to drain')
+    parser.add_argument('--database-url', help='scratch database for the Book Service instead of SQLite')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from --save to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed throughput drop / p95 increase against --compare')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    kafka = StandInKafka()
+    with service(BOOK_SERVICE) as load:
+        broker = load('benchmarks.stand_in').StandInBroker()
+    book_app, book_db, models = create_book_service(args, broker, kafka)
+    user_app, pending_replies, consumer = create_user_service(args, broker, kafka)
+
+    with book_app.app_context():
+        titles = dict(book_db.session.query(models.Book.id, models.Book.title).all())
+        book_db.session.remove()
+
+    users = [
+        VirtualUser(user_id, args.requests // args.concurrency + (user_id <= args.requests % args.concurrency),
+                    args, user_app, book_app, titles)
+        for user_id in range(1, args.concurrency + 1)
+    ]
+    start = threading.Event()
+    threads = [threading.Thread(target=user.run, args=(start,), daemon=True) for user in users]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    start.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(users, elapsed)
+    violations = check_invariants(args, users, broker, kafka, consumer, pending_replies, book_app, book_db, models)
+
+    print(f"concurrency={args.concurrency} requests={args.requests} stock={args.books}x{args.copies} "
+          f"mix={','.join(f'{name}={weight:g}' for name, weight in args.mix.items())}")
+    print(f"{summary['throughput']:.0f} requests/sec over {elapsed:.2f}s, "
+          f"{len(kafka.records)} availability events")
+    for operation, stats in summary['ops'].items():
+        print(f"{operation:>7}: n={stats['n']:6d}  p50 {stats['p50']:8.2f} ms  p95 {stats['p95']:8.2f} ms  "
+              f"p99 {stats['p99']:8.2f} ms  mean {stats['mean']:8.2f} ms")
+
+    if args.save:
+        with open(args.save, 'w') as results:
+            json.dump(summary, results, indent=2)
+
+    failed = False
+    if violations:
+        print("INVARIANTS VIOLATED:\n  " + "\n  ".join(violations[:20]))
+        failed = True
+    else:
+        print("OK: no book oversold, every reply reached its caller, every event consumed")
+    if args.compare:
+        with open(args.compare) as results:
+            regressions = compare(summary, json.load(results), args.tolerance)
+        if regressions:
+            print("REGRESSIONS:\n  " + "\n  ".join(regressions))
+            failed = True
+        else:
+            print(f"OK: within {args.tolerance:.0%} of {args.compare}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
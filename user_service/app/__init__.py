@@ -1,9 +1,11 @@
-import threading
-
 from flask import Flask
 from flask_cors import CORS
 
-from app.extensions import db, jwt
+from app.cache import pending_replies, profile_cache
+from app.extensions import db, jwt, rabbitmq, notification_dispatcher, notification_consumer_stats
+from app.metrics import metrics
+from app.supervisor import supervisor
+from app.utils import token_cache
 from app.routes import user_bp
 from config import Config
 
@@ -11,6 +13,7 @@ import logging
 
 from flask_migrate import Migrate
 from app.broker import start_borrow_response_consumer, start_return_response_consumer  # Import the RabbitMQ logic
+from app.broker import start_async_borrow_response_consumer
 from app.broker import start_kafka_notification_consumer
 
 from flask_mail import Mail
@@ -20,56 +23,72 @@ logging.basicConfig(level=logging.DEBUG)
 
 mail = Mail()
 
-def create_app():
+
+def register_metrics():
+    """Expose the User Service's own values on /metrics next to the request, SQL and RabbitMQ metrics."""
+    metrics.collect('pending_replies', 'Borrow/return requests waiting for their Book Service reply.',
+                    lambda: len(pending_replies))
+    metrics.collect('kafka_consumer_lag', 'Availability events not read yet, by topic partition.',
+                    lambda: notification_consumer_stats.stats()['lag'], ('partition',))
+    metrics.collect('notification_batches_total', 'Availability event batches processed.',
+                    lambda: notification_consumer_stats.stats()['batches'], kind='counter')
+    metrics.collect('notification_emails_sent_total', 'Availability emails delivered.',
+                    lambda: notification_dispatcher.sent, kind='counter')
+    metrics.collect('notification_emails_failed_total', 'Availability emails refused by the mail server.',
+                    lambda: notification_dispatcher.failed, kind='counter')
+    metrics.collect('jwt_cache_hits_total', 'Requests whose access token was already verified.',
+                    lambda: token_cache.hits, kind='counter')
+    metrics.collect('profile_cache_hits_total', 'Profile requests served from memory.',
+                    lambda: profile_cache.hits, kind='counter')
+    metrics.collect('notification_email_backlog', 'Availability emails waiting for a dispatcher worker.',
+                    lambda: notification_dispatcher.backlog)
+
+
+def start_notification_consumers(app):
+    """Start the email dispatcher and notification consumers (worker.py, or the web process if CONSUMERS_ENABLED)."""
+    # Emails go out from the dispatcher's worker pool, not from the Kafka consumer thread
+    notification_dispatcher.start(app)
+    supervisor.start(app, 'notification consumer', start_kafka_notification_consumer,
+                     app.config['NOTIFICATION_CONSUMERS'])
+
+
+def create_app(consumers=None, web=True):
+    """
+    :param consumers: whether this process consumes availability events and sends the emails (default
+        CONSUMERS_ENABLED).
+    :param web: whether this process serves the API. Book Service replies come back to a queue of the process
+        that sent the request (or, for asynchronous borrows, one shared by the API processes), so their consumers
+        run wherever requests are served.
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
 
     CORS(app)
 
     mail.init_app(app)
+    notification_dispatcher.init_app(app)
 
     db.init_app(app)
     jwt.init_app(app)
+    token_cache.init_app(app)
+    profile_cache.init_app(app)
+    rabbitmq.init_app(app)
+    metrics.init_app(app)
+    register_metrics()
+    supervisor.init_app(app)
     # setup database migrations
     migrate.init_app(app, db)
 
     app.register_blueprint(user_bp, url_prefix='/user')
 
-    # Background thread for RabbitMQ consumer
-    def start_borrow_consumer_thread():
-        def consume_in_thread():
-            # Ensure the app context is available in the thread
-            with app.app_context():
-                start_borrow_response_consumer()
-
-        consumer_thread = threading.Thread(target=consume_in_thread, daemon=True)
-        consumer_thread.start()
-        app.logger.info("RabbitMQ user service borrow consumer thread started.")
-
-    def start_return_consumer_thread():
-        def consume_in_thread():
-            # Ensure the app context is available in the thread
-            with app.app_context():
-                start_return_response_consumer()
-
-        consumer_thread = threading.Thread(target=consume_in_thread, daemon=True)
-        consumer_thread.start()
-        app.logger.info("RabbitMQ user service return consumer thread started.")
-
-    def start_kafka_consumer_thread():
-        def consume_in_thread():
-            # Ensure the app context is available in the thread
-            with app.app_context():
-                start_kafka_notification_consumer(mail)
-
-        consumer_thread = threading.Thread(target=consume_in_thread, daemon=True)
-        consumer_thread.start()
-        app.logger.info("Kafka borrow consumer thread started.")
-
-
-    # Start the consumer threads when the app starts
-    start_borrow_consumer_thread()
-    start_return_consumer_thread()
-    start_kafka_consumer_thread()
-
-    return app
\ No newline at end of file
+    # Start the consumer threads when the app starts; the supervisor restarts any that stops
+    if web:
+        supervisor.start(app, 'borrow response consumer', start_borrow_response_consumer)
+        supervisor.start(app, 'return response consumer', start_return_response_consumer)
+        supervisor.start(app, 'async borrow response consumer', start_async_borrow_response_consumer)
+    if consumers is None:
+        consumers = app.config['CONSUMERS_ENABLED']
+    if consumers:
+        start_notification_consumers(app)
+
+    return app
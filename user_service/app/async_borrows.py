@@ -0,0 +1,63 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from app.models import AsyncBorrow, db
+
+
+class AsyncBorrows:
+    """
+    Results of asynchronous borrow requests (/user/borrow?async=true), kept in the database so every API
+    process can hand them out: the reply is stored by whichever process consumes it, and polls or event
+    streams may land on any other one. Rows expire `retain_for` seconds after the request was made.
+    """
+
+    def register(self, owner, retain_for):
+        """Record a new pending request for `owner`; returns its id, also the borrow request's correlation id."""
+        now = datetime.utcnow()
+        borrow = AsyncBorrow(request_id=uuid.uuid4().hex, owner=owner, expires_on=now + timedelta(seconds=retain_for))
+        try:
+            AsyncBorrow.query.filter(AsyncBorrow.expires_on <= now).delete(synchronize_session=False)
+            db.session.add(borrow)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return borrow.request_id
+
+    def get(self, request_id, owner):
+        """The request, or None if it expired or belongs to another user."""
+        borrow = AsyncBorrow.query.get(request_id)
+        if borrow is None or borrow.owner != owner or borrow.expires_on <= datetime.utcnow():
+            return None
+        return borrow
+
+    def result(self, request_id):
+        """The stored reply of a request, or None while pending. Hands the connection back to the pool."""
+        try:
+            response = db.session.query(AsyncBorrow.response).filter(AsyncBorrow.request_id == request_id).scalar()
+        finally:
+            db.session.remove()
+        return json.loads(response) if response is not None else None
+
+    def resolve(self, request_id, response):
+        """Store the reply. Returns False if no request is waiting for it (anymore), e.g. it expired."""
+        try:
+            stored = AsyncBorrow.query.filter(
+                AsyncBorrow.request_id == request_id,
+                AsyncBorrow.response.is_(None),
+                AsyncBorrow.expires_on > datetime.utcnow(),
+            ).update({AsyncBorrow.response: json.dumps(response)}, synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return stored == 1
+
+    def discard(self, request_id):
+        AsyncBorrow.query.filter(AsyncBorrow.request_id == request_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+# Asynchronous borrow requests, shared by all API processes through the database
+async_borrows = AsyncBorrows()
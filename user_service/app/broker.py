@@ -1,41 +1,157 @@
 import pika
 import json
+import threading
+import time
+import uuid
+from concurrent.futures import wait
 from flask import current_app
-from app.cache import borrow_response_cache, return_response_cache
-from kafka import KafkaConsumer
-from flask_mail import Mail, Message
+from app.async_borrows import async_borrows
+from app.cache import pending_replies
+from app.consumer import Consumer, decode
+from app.extensions import rabbitmq, notification_dispatcher, notification_consumer_stats
+from app.metrics import metrics
+from app.notifications import build_notification, coalesce
+from app.rabbitmq import IDEMPOTENCY_KEY_HEADER, deadline_after, with_deadline
+from app.supervisor import supervisor
+from kafka import KafkaConsumer, TopicPartition
+from kafka.errors import CommitFailedError
 
 import logging
 
 logging.getLogger("pika").setLevel(logging.INFO)
 logging.getLogger("kafka").setLevel(logging.ERROR)
 
-#####################################
-# KAFKA CONSUMER FOR BOOK BORROWING
-#####################################
+# Every process gets its own reply queues, so replies never land in another worker's registry
+REPLY_QUEUE_ID = uuid.uuid4().hex
+BORROW_REPLY_QUEUE = f'borrow_response_queue.{REPLY_QUEUE_ID}'
+RETURN_REPLY_QUEUE = f'return_response_queue.{REPLY_QUEUE_ID}'
+# Replies to asynchronous borrows go to one durable queue that every process consumes: their results are stored in
+# the database, so it does not matter which process receives them
+ASYNC_BORROW_REPLY_QUEUE = 'borrow_async_response_queue'
 
-def send_email_notification(user_id, book_id, mail):
-    """Send an email notification to the user about book availability."""
-    try:
-        # Example user email and book details lookup (replace with actual database query)
-        user_email = 'parkams13@gmail.com'  # Function to fetch user email
+# Set once the matching reply queue has been declared by its consumer
+borrow_reply_queue_ready = threading.Event()
+return_reply_queue_ready = threading.Event()
+async_borrow_reply_queue_ready = threading.Event()
 
-        # Create email message
-        subject = f"Book Availability Notification: {book_id}"
-        body = f"Dear User,\n\nThe book you were waiting for is now available. Please log in to borrow it.\n\nThank you!"
+# How long a sender waits for its reply queue to exist before publishing anyway
+REPLY_QUEUE_READY_TIMEOUT = 5
 
-        msg = Message(subject, recipients=[user_email], body=body, sender="noreply@library.com")
+kafka_consumed = metrics.counter('kafka_consumed_total', 'Kafka events read by topic.', ('topic',))
 
-        # Send email
-        mail.send(msg)
-        current_app.logger.info(f"***** Email sent to {user_email} about book {book_id} availability.")
-
-    except Exception as e:
-        current_app.logger.error(f"Failed to send email notification: {str(e)}")
+#####################################
+# KAFKA CONSUMER FOR BOOK BORROWING
+#####################################
 
-def start_kafka_notification_consumer(mail):
-    """Starts a Kafka consumer to listen for notifications about book availability."""
+def collect_notification_batch(consumer):
+    """
+    Poll availability events until NOTIFICATION_DIGEST_WINDOW_MS has passed since the first one arrived
+    or NOTIFICATION_MAX_BATCH events were read. Returns the Kafka records, in poll order; an empty list
+    if nothing arrived within one poll, so an idle consumer still gets back to its heartbeat.
+    """
+    window = current_app.config['NOTIFICATION_DIGEST_WINDOW_MS'] / 1000
+    max_batch = current_app.config['NOTIFICATION_MAX_BATCH']
+    records = []
+    deadline = None
+    while len(records) < max_batch:
+        if deadline is None:
+            # Nothing read yet: wait up to a second for the first event
+            timeout = 1.0
+        else:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+        polled = consumer.poll(timeout_ms=int(timeout * 1000), max_records=max_batch - len(records))
+        for partition_records in polled.values():
+            records.extend(partition_records)
+        if not records:
+            break
+        if deadline is None:
+            deadline = time.monotonic() + window
+    return records
+
+
+def deliver_notifications(consumer, records, delivered):
+    """
+    Send one digest email per user for a batch of availability events and commit the batch's offsets
+    once every email was delivered. If some could not be delivered, the consumer is rewound to the
+    start of the batch so it is read again; `delivered` holds the (topic, partition, offset, user id)
+    of every event already emailed, so only the users whose email failed get it on the next attempt.
+    It is cleared once the batch is committed. Returns whether the batch was committed.
+    """
+    events = []
+    sources = {}
+    for record in records:
+        source = (record.topic, record.partition, record.offset)
+        user_ids = [
+            user_id for user_id in record.value.get('user_ids') or [record.value.get('user_id')]
+            if source + (user_id,) not in delivered
+        ]
+        if user_ids:
+            events.append(dict(record.value, user_ids=user_ids))
+        for user_id in user_ids:
+            sources.setdefault(user_id, []).append(source)
+    digests = coalesce(events)
+    current_app.logger.info(
+        f"Received {len(records)} Kafka notification events for {len(digests)} users."
+    )
+
+    futures = {
+        user_id: notification_dispatcher.submit(build_notification(user_id, book_ids))
+        for user_id, book_ids in digests.items()
+    }
+    wait(futures.values())
+    errors = []
+    for user_id, future in futures.items():
+        if future.exception() is not None:
+            errors.append(future.exception())
+        else:
+            delivered.update(source + (user_id,) for source in sources[user_id])
+
+    if errors:
+        current_app.logger.error(
+            f"{len(errors)} notification emails could not be delivered ({errors[0]}), retrying them."
+        )
+        first_offsets = {}
+        for record in records:
+            partition = TopicPartition(record.topic, record.partition)
+            first_offsets.setdefault(partition, record.offset)
+        for partition, offset in first_offsets.items():
+            consumer.seek(partition, offset)
+        time.sleep(current_app.config['NOTIFICATION_RETRY_BACKOFF'])
+        return False
+
+    delivered.clear()
+    try:
+        consumer.commit()
+    except CommitFailedError as e:
+        # The partitions were reassigned meanwhile; their new owner reads the batch again
+        current_app.logger.warning(f"Could not commit notification offsets: {str(e)}")
+        return False
+    current_app.logger.info(f"Notifications sent to Users {list(digests)}.")
+    return True
+
+
+def report_consumer_lag(consumer):
+    """Record how many events are still unread on each partition assigned to this consumer."""
+    partitions = list(consumer.assignment())
+    if not partitions:
+        return
+    end_offsets = consumer.end_offsets(partitions)
+    notification_consumer_stats.record_lag({
+        f"{partition.topic}-{partition.partition}": max(end_offsets[partition] - consumer.position(partition), 0)
+        for partition in partitions
+    })
+
+
+def start_kafka_notification_consumer():
+    """
+    Starts a Kafka consumer to listen for notifications about book availability.
+    Every thread running this joins the same consumer group, so Kafka spreads the topic's partitions
+    across them: with one thread per partition, partitions are processed fully in parallel.
+    """
     with current_app.app_context():
+        consumer = None
         try:
 
             # consumer = KafkaConsumer(
@@ -50,96 +166,150 @@ def start_kafka_notification_consumer(mail):
                 bootstrap_servers='kafka1:9092',
                 group_id='user-service-group',
                 value_deserializer=lambda v: json.loads(v.decode('utf-8')),
-                auto_offset_reset='earliest'
+                auto_offset_reset=current_app.config['KAFKA_AUTO_OFFSET_RESET'],
+                # Offsets are committed by deliver_notifications, once the emails are out
+                enable_auto_commit=False,
+                max_poll_records=current_app.config['NOTIFICATION_MAX_BATCH'],
                         )
 
             current_app.logger.info("Kafka consumer for book availability notifications started.")
 
-            for message in consumer:
-                event = message.value
-                user_id = event.get('user_id')
-                book_id = event.get('book_id')
-                timestamp = event.get('timestamp')
-
-                current_app.logger.info(
-                    f"Received Kafka notification event: User {user_id} is waiting for Book {book_id} (at {timestamp})."
-                )
-
-                send_email_notification(user_id, book_id, mail)
-
-                current_app.logger.info(
-                    f"Notification sent to User {user_id} about Book {book_id} availability."
-                )
+            # Events of the current batch already emailed, skipped when a retry reads the batch again
+            delivered = set()
+            while True:
+                supervisor.heartbeat()
+                records = collect_notification_batch(consumer)
+                for record in records:
+                    kafka_consumed.inc(topic=record.topic)
+                if records:
+                    started = time.monotonic()
+                    committed = deliver_notifications(consumer, records, delivered)
+                    notification_consumer_stats.record_batch(len(records), time.monotonic() - started, committed)
+                    report_consumer_lag(consumer)
 
         except Exception as e:
             current_app.logger.error(f"Error in Kafka notification consumer: {str(e)}")
+            raise
+        finally:
+            if consumer is not None:
+                # Leave the group, so the partitions go to the restarted consumer right away
+                consumer.close(autocommit=False)
 
 ###########################
 # BORROW BOOK
 ###########################
 
+def handle_borrow_response(properties, body):
+    if not pending_replies.is_waiting(properties.correlation_id):
+        # The request timed out: drop the reply before decoding or logging it
+        metrics.dropped(BORROW_REPLY_QUEUE, 'late')
+        return
+    response = decode(body)
+    user_id = response.get('user_id')
+    status = response.get('status')
+    message = response.get('message')
+
+    # Log or process the response
+    current_app.logger.info(f"Borrow response received for user {user_id}: {status} - {message}")
+    # Wake up the request waiting on this correlation id
+    if not pending_replies.resolve(properties.correlation_id, response):
+        current_app.logger.warning(
+            f"Discarding borrow response {properties.correlation_id}: no request is waiting for it."
+        )
+
+
+# Nobody waits long enough for a reply to be retried; unreadable ones go to a dead-letter queue shared by all processes
+borrow_response_consumer = Consumer(BORROW_REPLY_QUEUE, handle_borrow_response, max_retries=0,
+                                    dead_letter_queue='borrow_response_queue.dead')
+
+
 def start_borrow_response_consumer():
     with current_app.app_context():
         try:
-            connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq'))
+            connection = rabbitmq.connect()
             channel = connection.channel()
 
-            # Declare the response queue
-            channel.queue_declare(queue='borrow_response_queue', durable=True)
-
-            # Define the callback function
-            def on_borrow_response(ch, method, properties, body):
-                response = json.loads(body)
-                user_id = response['user_id']
-                book_id = response['book_id']
-                status = response['status']
-                message = response['message']
-
-                # Log or process the response
-                current_app.logger.info(f"Borrow response received for user {user_id}: {status} - {message}")
-                # Put the response in the shared queue
-                borrow_response_cache.put(response)
-                # Acknowledge the message
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-
+            # Declare this process' private reply queue (removed by the broker when the connection closes)
+            channel.queue_declare(queue=BORROW_REPLY_QUEUE, exclusive=True)
+            borrow_reply_queue_ready.set()
 
             # Start consuming
-            channel.basic_consume(queue='borrow_response_queue', on_message_callback=on_borrow_response)
+            channel.basic_consume(queue=BORROW_REPLY_QUEUE, on_message_callback=borrow_response_consumer)
             current_app.logger.info("Listening for borrow responses...")
-            channel.start_consuming()
+            supervisor.consume(connection)
         except Exception as e:
+            borrow_reply_queue_ready.clear()
             current_app.logger.error(f"Error in borrow response consumer: {str(e)}")
-            return {'status': 'failure', 'message': 'Error processing your borrow request.'}
+            raise
+
+
+def handle_async_borrow_response(properties, body):
+    """Store the reply to an asynchronous borrow, for whichever process the client polls."""
+    response = decode(body)
+    current_app.logger.info(
+        f"Async borrow response received for user {response.get('user_id')}: "
+        f"{response.get('status')} - {response.get('message')}"
+    )
+    if not async_borrows.resolve(properties.correlation_id, response):
+        # Expired, or already answered
+        metrics.dropped(ASYNC_BORROW_REPLY_QUEUE, 'late')
 
 
-def send_borrow_request(user_id, book_id):
+# Storing the result can fail with the database, so these replies are retried like requests
+async_borrow_response_consumer = Consumer(ASYNC_BORROW_REPLY_QUEUE, handle_async_borrow_response)
+
+
+def start_async_borrow_response_consumer():
+    with current_app.app_context():
+        try:
+            connection = rabbitmq.connect()
+            channel = connection.channel()
+
+            # Shared by all processes, and kept while none of them is running
+            channel.queue_declare(queue=ASYNC_BORROW_REPLY_QUEUE, durable=True)
+            async_borrow_reply_queue_ready.set()
+
+            channel.basic_consume(queue=ASYNC_BORROW_REPLY_QUEUE, on_message_callback=async_borrow_response_consumer)
+            current_app.logger.info("Listening for asynchronous borrow responses...")
+            supervisor.consume(connection)
+        except Exception as e:
+            async_borrow_reply_queue_ready.clear()
+            current_app.logger.error(f"Error in asynchronous borrow response consumer: {str(e)}")
+            raise
+
+
+def send_borrow_request(user_id, book_id, correlation_id, timeout, idempotency_key=None, asynchronous=False):
+    """
+    Ask the Book Service to borrow a book. The request expires after `timeout` seconds, when nobody
+    waits for its reply anymore. Retries sent with the same `idempotency_key` are only applied once.
+    With `asynchronous`, the reply goes to the queue shared by all processes instead of this one's.
+    """
     message = {
         'user_id': user_id,
         'book_id': book_id,
     }
 
     try:
-        # Connect to RabbitMQ
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq'))
-        channel = connection.channel()
-
-        # Declare the queue (ensure the queue exists before publishing)
-        channel.queue_declare(queue='borrow_request_queue', durable=True)
-
-        # Publish the message
-        channel.basic_publish(
-            exchange='',
-            routing_key='borrow_request_queue',
-            body=json.dumps(message),
-            properties=pika.BasicProperties(
-                delivery_mode=2  # Persist the message
-            )
+        # Publish the message on a pooled channel, telling the Book Service where to send the reply
+        if asynchronous:
+            reply_to, reply_queue_ready = ASYNC_BORROW_REPLY_QUEUE, async_borrow_reply_queue_ready
+        else:
+            reply_to, reply_queue_ready = BORROW_REPLY_QUEUE, borrow_reply_queue_ready
+        reply_queue_ready.wait(REPLY_QUEUE_READY_TIMEOUT)
+        rabbitmq.publish(
+            'borrow_request_queue',
+            json.dumps(message),
+            properties=with_deadline(pika.BasicProperties(
+                delivery_mode=2,  # Persist the message
+                correlation_id=correlation_id,
+                reply_to=reply_to,
+                headers={IDEMPOTENCY_KEY_HEADER: idempotency_key} if idempotency_key else None,
+            ), deadline_after(timeout)),
+            queue_options={'durable': True},
         )
 
         current_app.logger.info(f"Sent borrow request for user {user_id} and book {book_id}")
 
-        connection.close()
-
     except Exception as e:
         current_app.logger.error(f"Error sending borrow request: {str(e)}")
         raise e
@@ -149,63 +319,76 @@ def send_borrow_request(user_id, book_id):
 # RETURN BOOK
 ###########################
 
-def send_return_request(user_id, book_id):
-    """Send a return request message to the Book Service via RabbitMQ."""
+def send_return_request(user_id, book_id, correlation_id, timeout, idempotency_key=None):
+    """
+    Send a return request message to the Book Service via RabbitMQ; it expires after `timeout` seconds.
+    Retries sent with the same `idempotency_key` are only applied once.
+    """
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq'))
-        channel = connection.channel()
-
-        # Declare the return request queue
-        channel.queue_declare(queue='return_request_queue', durable=True)
-
         request_message = json.dumps({
             "user_id": user_id,
             "book_id": book_id
         })
 
-        # Send the request to the return_request_queue
-        channel.basic_publish(
-            exchange='',
-            routing_key='return_request_queue',
-            body=request_message,
-            properties=pika.BasicProperties(
+        # Send the request to the return_request_queue on a pooled channel
+        return_reply_queue_ready.wait(REPLY_QUEUE_READY_TIMEOUT)
+        rabbitmq.publish(
+            'return_request_queue',
+            request_message,
+            properties=with_deadline(pika.BasicProperties(
                 delivery_mode=2,  # Make the message persistent
-            )
+                correlation_id=correlation_id,
+                reply_to=RETURN_REPLY_QUEUE,
+                headers={IDEMPOTENCY_KEY_HEADER: idempotency_key} if idempotency_key else None,
+            ), deadline_after(timeout)),
+            queue_options={'durable': True},
         )
 
         current_app.logger.info(f"Sent return request for user {user_id} and book {book_id}")
-        connection.close()
 
     except Exception as e:
         current_app.logger.error(f"Error sending return request: {e}")
+        raise e
+
+
+def handle_return_response(properties, body):
+    """Handle the return response message."""
+    if not pending_replies.is_waiting(properties.correlation_id):
+        # The request timed out: drop the reply before decoding or logging it
+        metrics.dropped(RETURN_REPLY_QUEUE, 'late')
+        return
+    response = decode(body)
+    user_id = response.get('user_id')
+    status = response.get('status')
+    message = response.get('message')
+
+    # Log the response or use it to update the front-end
+    current_app.logger.info(f"Return response received for user {user_id}: {status} - {message}")
+    if not pending_replies.resolve(properties.correlation_id, response):
+        current_app.logger.warning(
+            f"Discarding return response {properties.correlation_id}: no request is waiting for it."
+        )
+
+
+return_response_consumer = Consumer(RETURN_REPLY_QUEUE, handle_return_response, max_retries=0,
+                                    dead_letter_queue='return_response_queue.dead')
 
 
 def start_return_response_consumer():
     """Listen for the return response from Book Service."""
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq'))
+        connection = rabbitmq.connect()
         channel = connection.channel()
 
-        # Declare the response queue (if not already declared)
-        channel.queue_declare(queue='return_response_queue', durable=True)
-
-        def on_return_response(ch, method, properties, body):
-            """Handle the return response message."""
-            response = json.loads(body)
-            user_id = response['user_id']
-            book_id = response['book_id']
-            status = response['status']
-            message = response['message']
-
-            # Log the response or use it to update the front-end
-            current_app.logger.info(f"Return response received for user {user_id}: {status} - {message}")
-            return_response_cache.put(response)
-            # Acknowledge the message
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+        # Declare this process' private reply queue (removed by the broker when the connection closes)
+        channel.queue_declare(queue=RETURN_REPLY_QUEUE, exclusive=True)
+        return_reply_queue_ready.set()
 
         # Start consuming
-        channel.basic_consume(queue='return_response_queue', on_message_callback=on_return_response)
+        channel.basic_consume(queue=RETURN_REPLY_QUEUE, on_message_callback=return_response_consumer)
         current_app.logger.info("Listening for return responses...")
-        channel.start_consuming()
+        supervisor.consume(connection)
     except Exception as e:
+        return_reply_queue_ready.clear()
         current_app.logger.error(f"Error in return response consumer: {str(e)}")
+        raise
@@ -1,5 +1,89 @@
-import queue
+import threading
+import time
+import uuid
 
-# Shared queue for storing responses from RabbitMQ consumer
-borrow_response_cache = queue.Queue()
-return_response_cache = queue.Queue()
\ No newline at end of file
+from app.utils import LRUCache
+
+
+class PendingReply:
+    """Slot a request thread blocks on until the reply with its correlation id arrives."""
+
+    def __init__(self, correlation_id):
+        self.correlation_id = correlation_id
+        self.response = None
+        self._event = threading.Event()
+
+    def set(self, response):
+        self.response = response
+        self._event.set()
+
+    def wait(self, timeout):
+        """Return the reply, or None if it did not arrive within `timeout` seconds."""
+        if self._event.wait(timeout):
+            return self.response
+        return None
+
+
+class PendingReplies:
+    """
+    Registry of in-flight RabbitMQ RPC calls keyed by correlation id.
+    Each caller registers its own slot, so a reply can only ever wake the request that sent it.
+    Asynchronous borrows are not kept here but in the database (app/async_borrows.py), where every process
+    can read them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def register(self):
+        reply = PendingReply(uuid.uuid4().hex)
+        with self._lock:
+            self._pending[reply.correlation_id] = reply
+        return reply
+
+    def resolve(self, correlation_id, response):
+        """Hand a reply to its waiter. Returns False if nobody is waiting for it (anymore)."""
+        with self._lock:
+            reply = self._pending.pop(correlation_id, None)
+        if reply is None:
+            return False
+        reply.set(response)
+        return True
+
+    def is_waiting(self, correlation_id):
+        """Whether a request is still waiting for this reply; lets late replies be dropped without decoding them."""
+        with self._lock:
+            return correlation_id in self._pending
+
+    def discard(self, correlation_id):
+        with self._lock:
+            self._pending.pop(correlation_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+
+# Shared registry of borrow/return requests waiting for a reply from the Book Service
+pending_replies = PendingReplies()
+
+
+class ProfileCache(LRUCache):
+    """Profiles served by /user/profile, kept for USER_PROFILE_CACHE_TTL seconds (0 turns the cache off)."""
+
+    def __init__(self):
+        super().__init__()
+        self.ttl = 60
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_PROFILE_CACHE_TTL', 60)
+        self.resize(app.config.get('USER_PROFILE_CACHE_SIZE', 10000) if self.ttl > 0 else 0)
+        app.extensions['profile_cache'] = self
+
+    def put(self, user_id, profile):
+        self.set(user_id, profile, time.time() + self.ttl)
+
+
+# Profiles by JWT identity; a user's profile only changes when it is first created
+profile_cache = ProfileCache()
@@ -1,5 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 
+from app.notifications import ConsumerStats, NotificationDispatcher
+from app.rabbitmq import RabbitMQ
+
 db = SQLAlchemy()
-jwt = JWTManager()
\ No newline at end of file
+jwt = JWTManager()
+rabbitmq = RabbitMQ()
+notification_dispatcher = NotificationDispatcher()
+notification_consumer_stats = ConsumerStats()
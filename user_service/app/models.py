@@ -1,5 +1,6 @@
+import json
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
 from . import db
 
 class User(db.Model):
@@ -33,3 +34,20 @@ class WatchedBook(db.Model):
 
     def __repr__(self):
         return f'<WatchedBook {self.book_id} by {self.user.username}>'
+
+
+class AsyncBorrow(db.Model):
+    """An asynchronous borrow request and, once the Book Service replied, its result."""
+    __tablename__ = 'async_borrows'
+
+    request_id = Column(String(32), primary_key=True)  # Also the correlation id of the borrow request
+    owner = Column(String(255), nullable=False)  # JWT identity of the user the result is handed back to
+    response = Column(Text)  # The Book Service reply (JSON); NULL while pending
+    expires_on = Column(DateTime, nullable=False, index=True)
+
+    @property
+    def result(self):
+        return json.loads(self.response) if self.response is not None else None
+
+    def __repr__(self):
+        return f'<AsyncBorrow {self.request_id} for {self.owner}>'
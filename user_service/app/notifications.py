@@ -0,0 +1,208 @@
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+from flask_mail import Message
+
+_STOP = object()
+
+
+def lookup_user_email(user_id):
+    # Example user email lookup (replace with actual database query)
+    return 'parkams13@gmail.com'
+
+
+def build_notification(user_id, book_ids):
+    """One email telling a user that the books they were waiting for are available (a digest if several)."""
+    if len(book_ids) == 1:
+        subject = f"Book Availability Notification: {book_ids[0]}"
+        body = "Dear User,\n\nThe book you were waiting for is now available. Please log in to borrow it.\n\nThank you!"
+    else:
+        subject = f"Book Availability Notification: {len(book_ids)} books"
+        listed = "\n".join(f"- Book {book_id}" for book_id in book_ids)
+        body = (
+            f"Dear User,\n\nThe following books you were waiting for are now available:\n\n{listed}\n\n"
+            "Please log in to borrow them.\n\nThank you!"
+        )
+    return Message(subject, recipients=[lookup_user_email(user_id)], body=body, sender="noreply@library.com")
+
+
+def coalesce(events):
+    """Group availability events into {user_id: [book_id, ...]}, so each user gets a single digest."""
+    digests = {}
+    for event in events:
+        # Batch events name every notified user; single-user events are still accepted
+        for user_id in event.get('user_ids') or [event.get('user_id')]:
+            book_ids = digests.setdefault(user_id, [])
+            if event.get('book_id') not in book_ids:
+                book_ids.append(event.get('book_id'))
+    return digests
+
+
+def is_permanent_failure(error):
+    """5xx replies (and refused recipients) will not change on retry; 4xx replies and dropped sessions may."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class ConsumerStats:
+    """Batch timings and per-partition lag of the notification consumers, for /user/notifications/stats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.events = 0
+        self.retried_batches = 0
+        self.last_batch_seconds = 0.0
+        self.max_batch_seconds = 0.0
+        self.total_batch_seconds = 0.0
+        self.lag = {}
+
+    def record_batch(self, events, seconds, committed):
+        with self._lock:
+            self.batches += 1
+            self.events += events
+            if not committed:
+                self.retried_batches += 1
+            self.last_batch_seconds = seconds
+            self.max_batch_seconds = max(self.max_batch_seconds, seconds)
+            self.total_batch_seconds += seconds
+
+    def record_lag(self, lag):
+        """`lag` maps 'topic-partition' to the number of events not read yet."""
+        with self._lock:
+            self.lag.update(lag)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "events": self.events,
+                "retried_batches": self.retried_batches,
+                "last_batch_seconds": self.last_batch_seconds,
+                "max_batch_seconds": self.max_batch_seconds,
+                "avg_batch_seconds": self.total_batch_seconds / self.batches if self.batches else 0.0,
+                "lag": dict(self.lag),
+                "total_lag": sum(self.lag.values()),
+            }
+
+
+class NotificationDispatcher:
+    """
+    Sends notification emails from a bounded pool of NOTIFICATION_WORKERS threads.
+    Each worker keeps its own SMTP session open and sends message after message on it, reconnecting
+    only when the server drops it (or after MAIL_MAX_EMAILS, if set). Submissions block once
+    NOTIFICATION_QUEUE_SIZE emails are waiting, which pushes back on the Kafka consumer.
+    """
+
+    def __init__(self, app=None):
+        self.workers = 4
+        self.queue_size = 1000
+        self.max_attempts = 3
+        self.sent = 0
+        self.failed = 0
+        self.connections_opened = 0
+        self._queue = None
+        self._threads = []
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.workers = app.config.get('NOTIFICATION_WORKERS', 4)
+        self.queue_size = app.config.get('NOTIFICATION_QUEUE_SIZE', 1000)
+        self.max_attempts = app.config.get('NOTIFICATION_MAX_ATTEMPTS', 3)
+        app.extensions['notification_dispatcher'] = self
+
+    def start(self, app):
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._threads = [
+            threading.Thread(target=self._work, args=(app,), name=f"notification-worker-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        app.logger.info(f"Notification dispatcher started with {self.workers} worker(s).")
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    @property
+    def backlog(self):
+        """Emails waiting for a worker."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, message):
+        """
+        Queue an email for delivery. The returned future resolves to True once it was sent, or to False
+        if the server permanently refused it; it raises if the email could not be delivered for now.
+        """
+        future = Future()
+        self._queue.put((message, future))
+        return future
+
+    def _work(self, app):
+        with app.app_context():
+            mail = app.extensions['mail']
+            connection = None
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                message, future = item
+                connection = self._deliver(mail, connection, message, future)
+            self._close(connection)
+
+    def _deliver(self, mail, connection, message, future):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if connection is None:
+                    connection = mail.connect()
+                    connection.__enter__()
+                    with self._lock:
+                        self.connections_opened += 1
+                connection.send(message)
+                with self._lock:
+                    self.sent += 1
+                future.set_result(True)
+                return connection
+            except (smtplib.SMTPException, OSError) as e:
+                if is_permanent_failure(e):
+                    # The server answered and refused this email: retrying will not help
+                    current_app.logger.error(f"Email to {message.recipients} refused: {str(e)}")
+                    with self._lock:
+                        self.failed += 1
+                    future.set_result(False)
+                    return connection
+
+                # The session broke or the server asked to come back later; open a new session and retry
+                current_app.logger.warning(f"SMTP delivery failed (attempt {attempt}): {str(e)}")
+                self._close(connection)
+                connection = None
+                if attempt == self.max_attempts:
+                    future.set_exception(e)
+                else:
+                    time.sleep(0.1 * 2 ** attempt)
+            except Exception as e:
+                # A malformed message; the session is still fine
+                future.set_exception(e)
+                return connection
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        if connection is None:
+            return
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
@@ -0,0 +1,193 @@
+import logging
+import queue
+import threading
+import time
+
+import pika
+from pika.exceptions import AMQPError
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Header carrying the time (epoch milliseconds) after which nobody waits for a request's reply anymore
+DEADLINE_HEADER = 'x-deadline'
+# Header carrying the client's Idempotency-Key of a borrow/return request
+IDEMPOTENCY_KEY_HEADER = 'x-idempotency-key'
+
+
+def deadline_after(timeout):
+    """The deadline `timeout` seconds from now, in epoch milliseconds."""
+    return int((time.time() + timeout) * 1000)
+
+
+def with_deadline(properties, deadline):
+    """
+    Stamp a deadline (epoch milliseconds) on a message (`properties` is a pika.BasicProperties).
+    The header tells the consumer when to give up on it; the AMQP `expiration` lets the broker drop it
+    unconsumed once the deadline has passed.
+    """
+    headers = dict(properties.headers or {})
+    headers[DEADLINE_HEADER] = deadline
+    properties.headers = headers
+    properties.expiration = str(max(deadline - int(time.time() * 1000), 1))
+    return properties
+
+
+def deadline_of(properties):
+    """The deadline a message was published with, or None."""
+    return (getattr(properties, 'headers', None) or {}).get(DEADLINE_HEADER)
+
+
+def is_expired(properties, grace_ms=0):
+    """Whether a message's deadline passed more than `grace_ms` milliseconds ago."""
+    deadline = deadline_of(properties)
+    return deadline is not None and time.time() * 1000 > deadline + grace_ms
+
+
+class _PublisherChannel:
+    """A long-lived connection/channel pair owned by the publisher pool."""
+
+    def __init__(self, connection, confirm_delivery):
+        self.connection = connection
+        self.channel = connection.channel()
+        if confirm_delivery:
+            self.channel.confirm_delivery()
+
+    def is_usable(self):
+        if not (self.connection.is_open and self.channel.is_open):
+            return False
+        try:
+            # Services heartbeats while idle and surfaces a dropped connection before we publish on it
+            self.connection.process_data_events(time_limit=0)
+        except AMQPError:
+            return False
+        return self.connection.is_open and self.channel.is_open
+
+    def close(self):
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except AMQPError:
+            pass
+
+
+class RabbitMQ:
+    """
+    Flask extension holding the RabbitMQ connection settings and a pool of long-lived publisher channels.
+    Publishing borrows a channel from the pool, so concurrent request and consumer threads never share one,
+    and nobody pays a TCP + AMQP handshake per message.
+    """
+
+    def __init__(self, app=None, host='rabbitmq', pool_size=8, confirm_delivery=False, connection_factory=None):
+        self.host = host
+        self.pool_size = pool_size
+        self.confirm_delivery = confirm_delivery
+        self.acquire_timeout = 10
+        # Optional callable returning a pika-compatible connection (used for local stand-in brokers)
+        self.connection_factory = connection_factory
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._declared_queues = set()
+        self._declared_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.host = app.config.get('RABBITMQ_HOST', self.host)
+        self.pool_size = app.config.get('RABBITMQ_PUBLISHER_POOL_SIZE', self.pool_size)
+        self.confirm_delivery = app.config.get('RABBITMQ_PUBLISHER_CONFIRMS', self.confirm_delivery)
+        self.close()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        app.extensions['rabbitmq'] = self
+
+    def connect(self):
+        """Open a new blocking connection (consumers keep one each, publishers go through the pool)."""
+        if self.connection_factory is not None:
+            return self.connection_factory()
+        return pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+
+    def publish(self, routing_key, body, properties=None, exchange='', queue_options=None, exchange_options=None):
+        """
+        Publish a message on a pooled channel.
+        :param queue_options: queue_declare keyword arguments; the queue is declared once per pool, not per message.
+        :param exchange_options: exchange_declare keyword arguments, declared once per pool as well.
+        A broken channel is replaced and the publish retried once before the error is raised.
+        """
+        if metrics.enabled:
+            # Stamped with the publish time, so consumers can tell how long it waited in the queue
+            properties = metrics.stamp(properties if properties is not None else pika.BasicProperties())
+        for attempt in range(2):
+            pooled = self._acquire()
+            try:
+                if exchange_options is not None:
+                    self._declare_exchange(pooled.channel, exchange, exchange_options)
+                if queue_options is not None:
+                    self._declare_queue(pooled.channel, routing_key, queue_options)
+                pooled.channel.basic_publish(
+                    exchange=exchange,
+                    routing_key=routing_key,
+                    body=body,
+                    properties=properties,
+                )
+            except AMQPError as e:
+                pooled.close()
+                self._release(None)
+                with self._declared_lock:
+                    self._declared_queues.clear()
+                if attempt:
+                    raise
+                logger.warning(f"Publisher channel failed ({e!r}), reconnecting.")
+            except BaseException:
+                pooled.close()
+                self._release(None)
+                raise
+            else:
+                self._release(pooled)
+                metrics.published(routing_key, exchange)
+                return
+
+    def close(self):
+        """Close every idle pooled connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _declare_queue(self, channel, name, options):
+        if name in self._declared_queues:
+            return
+        channel.queue_declare(queue=name, **options)
+        with self._declared_lock:
+            self._declared_queues.add(name)
+
+    def _declare_exchange(self, channel, name, options):
+        if ('exchange', name) in self._declared_queues:
+            return
+        channel.exchange_declare(exchange=name, **options)
+        with self._declared_lock:
+            self._declared_queues.add(('exchange', name))
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("Timed out waiting for a free RabbitMQ publisher channel.")
+        try:
+            while True:
+                try:
+                    pooled = self._idle.get_nowait()
+                except queue.Empty:
+                    return _PublisherChannel(self.connect(), self.confirm_delivery)
+                if pooled.is_usable():
+                    return pooled
+                pooled.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, pooled):
+        if pooled is not None:
+            self._idle.put(pooled)
+        self._slots.release()
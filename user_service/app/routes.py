@@ -1,19 +1,27 @@
-import queue
+import json
+import time
+from datetime import datetime
 
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from flask import jsonify, Blueprint, request
+from flask_jwt_extended import get_jwt_identity, get_jwt
+from flask import jsonify, Blueprint, request, current_app, Response, stream_with_context
 from app.models import db, User
-from app.utils import role_required
+from app.utils import role_required, jwt_verified
+from app.async_borrows import async_borrows
 from app.broker import send_borrow_request, send_return_request
-from app.cache import borrow_response_cache, return_response_cache
+from app.cache import pending_replies, profile_cache
+from app.extensions import notification_consumer_stats, notification_dispatcher
 
 
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/profile', methods=['GET'])
-@jwt_required()
+@jwt_verified
 def get_user_profile():
     user_id = get_jwt_identity()
+    profile = profile_cache.get(user_id)
+    if profile is not None:
+        return jsonify(profile)
+
     claims = get_jwt()
     user = User.query.get(user_id)
 
@@ -26,12 +34,52 @@ def get_user_profile():
         db.session.add(user)
         db.session.commit()
 
-    return jsonify({
+    profile = {
         "id": user.id,
         "role": user.role,
         "name": user.name,
         "username": user.username
-    })
+    }
+    profile_cache.put(user_id, profile)
+    return jsonify(profile)
+
+def borrow_result(response):
+    """Map a Book Service borrow reply to the HTTP status code and body returned to the client."""
+    if not response:
+        return {"msg": "Request timed out, please try again later."}, 408  # Timeout if no response
+
+    # Handle response based on status
+    if response['status'] == 'success':
+        return {"msg": response['message']}, 200  # Borrow successful
+    elif response['status'] == 'failure':
+        if "not found" in response['message']:
+            return {"msg": response['message']}, 404  # Book not found
+        elif "No copies available" in response['message']:
+            return {"msg": response['message']}, 200  # No copies available
+        elif "already borrowed" in response['message']:
+            return {"msg": response['message']}, 409  # Book already borrowed
+        else:
+            return {"msg": response['message']}, 500  # Unexpected error
+    else:
+        # Catch-all for unexpected status
+        return {"msg": "An unexpected error occurred"}, 500
+
+
+# Longest Idempotency-Key header accepted
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+
+def idempotency_key():
+    """The client's optional Idempotency-Key header; retries carrying the same key are applied only once."""
+    return request.headers.get('Idempotency-Key', '').strip() or None
+
+
+def wants_async():
+    """Clients opt into the non-blocking borrow API with ?async=true or `Prefer: respond-async`."""
+    if request.args.get('async', '').lower() in ('1', 'true'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
 
 @user_bp.route('/borrow', methods=['POST'])
 @role_required('user')  # Ensure the user is logged in
@@ -42,38 +90,108 @@ def borrow_book():
 
     if not user_id or not book_id:
         return jsonify({"msg": "User ID and Book ID are required"}), 400
+    key = idempotency_key()
+    if key and len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return jsonify({"msg": f"Idempotency-Key cannot be longer than {MAX_IDEMPOTENCY_KEY_LENGTH} characters"}), 400
 
-    # After validation, the user sends a message to RabbitMQ to process the borrowing.
-    send_borrow_request(user_id, book_id)
-
-    response = None
-    attempts = 0
-    while attempts < 10:
+    if wants_async():
+        # Record the request and return right away; whichever process gets the reply stores its result
+        ttl = current_app.config['ASYNC_RESULT_TTL']
+        request_id = async_borrows.register(get_jwt_identity(), ttl)
         try:
-            response = borrow_response_cache.get(timeout=2)  # Wait for up to 2 seconds
-            break
-        except queue.Empty:
-            attempts += 1
-            continue
+            send_borrow_request(user_id, book_id, request_id, ttl, key, asynchronous=True)
+        except Exception:
+            async_borrows.discard(request_id)
+            raise
+        return jsonify({
+            "msg": "Borrow request accepted",
+            "request_id": request_id,
+            "status_url": f"/user/borrow/{request_id}",
+            "events_url": f"/user/borrow/{request_id}/events",
+        }), 202, {"Location": f"/user/borrow/{request_id}"}
 
-    if not response:
-        return jsonify({"msg": "Request timed out, please try again later."}), 408  # Timeout if no response
+    # After validation, the user sends a message to RabbitMQ to process the borrowing
+    # and waits for the reply carrying the same correlation id.
+    reply = pending_replies.register()
+    try:
+        send_borrow_request(user_id, book_id, reply.correlation_id, current_app.config['RPC_REPLY_TIMEOUT'], key)
+        response = reply.wait(timeout=current_app.config['RPC_REPLY_TIMEOUT'])
+    finally:
+        pending_replies.discard(reply.correlation_id)
 
-    # Handle response based on status
-    if response['status'] == 'success':
-        return jsonify({"msg": response['message']}), 200  # Borrow successful
-    elif response['status'] == 'failure':
-        if "not found" in response['message']:
-            return jsonify({"msg": response['message']}), 404  # Book not found
-        elif "No copies available" in response['message']:
-            return jsonify({"msg": response['message']}), 200  # No copies available
-        elif "already borrowed" in response['message']:
-            return jsonify({"msg": response['message']}), 409  # Book already borrowed
-        else:
-            return jsonify({"msg": response['message']}), 500  # Unexpected error
-    else:
-        # Catch-all for unexpected status
-        return jsonify({"msg": "An unexpected error occurred"}), 500
+    body, status_code = borrow_result(response)
+    return jsonify(body), status_code
+
+
+def get_async_borrow(request_id):
+    """Look up an asynchronous borrow request, hiding requests that belong to other users."""
+    return async_borrows.get(request_id, get_jwt_identity())
+
+
+@user_bp.route('/borrow/<request_id>', methods=['GET'])
+@role_required('user')
+def get_borrow_status(request_id):
+    borrow = get_async_borrow(request_id)
+    if borrow is None:
+        return jsonify({"msg": "Borrow request not found or expired"}), 404
+
+    response = borrow.result
+    if response is None:
+        return jsonify({"request_id": request_id, "status": "pending"}), 202
+
+    body, status_code = borrow_result(response)
+    body.update({"request_id": request_id, "status": response['status']})
+    return jsonify(body), status_code
+
+
+@user_bp.route('/borrow/<request_id>/events', methods=['GET'])
+@role_required('user')
+def stream_borrow_status(request_id):
+    """
+    Server-sent events stream that pushes the borrow result as soon as the Book Service replies.
+    A stream holds a request thread, so it stays open for at most RPC_REPLY_TIMEOUT seconds, like a
+    blocking borrow; if the result is still pending by then, a `pending` event tells the client to poll.
+    The result is read from the database every ASYNC_RESULT_POLL_INTERVAL seconds, since the reply may be
+    stored by another process.
+    """
+    borrow = get_async_borrow(request_id)
+    if borrow is None:
+        return jsonify({"msg": "Borrow request not found or expired"}), 404
+
+    keepalive = current_app.config['SSE_KEEPALIVE_INTERVAL']
+    poll_interval = current_app.config['ASYNC_RESULT_POLL_INTERVAL']
+    remaining = max(0, (borrow.expires_on - datetime.utcnow()).total_seconds())
+    timeout = min(remaining, current_app.config['RPC_REPLY_TIMEOUT'])
+    result = borrow.result
+
+    def events():
+        response = result
+        deadline = time.monotonic() + timeout
+        next_keepalive = time.monotonic()
+        while response is None and time.monotonic() < deadline:
+            if time.monotonic() >= next_keepalive:
+                # Comment lines keep proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                next_keepalive += keepalive
+            time.sleep(max(0, min(poll_interval, deadline - time.monotonic())))
+            # Between reads the stream holds no database connection
+            response = async_borrows.result(request_id)
+
+        if response is None and timeout < remaining:
+            # The result can still arrive: hand the thread back and let the client poll for it
+            body = {"request_id": request_id, "status": "pending", "status_url": f"/user/borrow/{request_id}"}
+            yield f"event: pending\ndata: {json.dumps(body)}\n\n"
+            return
+
+        body, status_code = borrow_result(response)
+        body.update({"request_id": request_id, "status_code": status_code})
+        yield f"event: result\ndata: {json.dumps(body)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @user_bp.route('/return', methods=['POST'])
@@ -85,19 +203,17 @@ def return_book():
 
     if not user_id or not book_id:
         return jsonify({"msg": "User ID and Book ID are required"}), 400
+    key = idempotency_key()
+    if key and len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return jsonify({"msg": f"Idempotency-Key cannot be longer than {MAX_IDEMPOTENCY_KEY_LENGTH} characters"}), 400
 
-    # Send return request to Book Service
-    send_return_request(user_id, book_id)
-
-    response = None
-    attempts = 0
-    while attempts < 10:
-        try:
-            response = return_response_cache.get(timeout=2)  # Wait for up to 2 seconds
-            break
-        except queue.Empty:
-            attempts += 1
-            continue
+    # Send return request to Book Service and wait for the reply carrying the same correlation id
+    reply = pending_replies.register()
+    try:
+        send_return_request(user_id, book_id, reply.correlation_id, current_app.config['RPC_REPLY_TIMEOUT'], key)
+        response = reply.wait(timeout=current_app.config['RPC_REPLY_TIMEOUT'])
+    finally:
+        pending_replies.discard(reply.correlation_id)
 
     if not response:
         return jsonify({"msg": "Request timed out, please try again later."}), 408  # Timeout if no response
@@ -128,3 +244,17 @@ def get_all_users():
     ]
 
     return jsonify({"users": user_list}), 200
+
+
+@user_bp.route('/notifications/stats', methods=['GET'])
+@role_required('librarian')
+def get_notification_stats():
+    """Kafka batch timings and consumer lag, and email delivery counters of this process' notification path."""
+    return jsonify({
+        "consumer": notification_consumer_stats.stats(),
+        "emails": {
+            "sent": notification_dispatcher.sent,
+            "failed": notification_dispatcher.failed,
+            "smtp_sessions_opened": notification_dispatcher.connections_opened,
+        },
+    }), 200
@@ -0,0 +1,123 @@
+import random
+import threading
+import time
+
+from flask import current_app, jsonify
+
+
+class Worker:
+    """One supervised thread and what /health reports about it."""
+
+    def __init__(self, name, target):
+        self.name = name
+        self.target = target
+        self.state = 'starting'
+        self.restarts = 0
+        self.last_error = None
+        self.last_heartbeat = time.monotonic()
+
+    def report(self, now):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "restarts": self.restarts,
+            "seconds_since_heartbeat": round(now - self.last_heartbeat, 3),
+            "last_error": self.last_error,
+        }
+
+
+class Supervisor:
+    """
+    Runs the service's background loops (RabbitMQ and Kafka consumers, the outbox relay) in daemon threads
+    and restarts a loop that raises or returns, e.g. because its broker connection dropped. Restarts wait
+    SUPERVISOR_RESTART_DELAY seconds, doubling after every failure up to SUPERVISOR_MAX_RESTART_DELAY, with
+    random jitter so consumers do not reconnect in lockstep; a loop that ran longer than the maximum delay
+    starts over from the initial delay.
+    Loops call heartbeat() at least every SUPERVISOR_HEARTBEAT_INTERVAL seconds. /health answers 503 when a
+    worker is not running or has not sent a heartbeat for SUPERVISOR_HEARTBEAT_TIMEOUT seconds.
+    """
+
+    def __init__(self, app=None):
+        self.restart_delay = 1.0
+        self.max_restart_delay = 60.0
+        self.heartbeat_interval = 5.0
+        self.heartbeat_timeout = 120.0
+        self.workers = []
+        self._current = threading.local()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.restart_delay = app.config.get('SUPERVISOR_RESTART_DELAY', 1.0)
+        self.max_restart_delay = app.config.get('SUPERVISOR_MAX_RESTART_DELAY', 60.0)
+        self.heartbeat_interval = app.config.get('SUPERVISOR_HEARTBEAT_INTERVAL', 5.0)
+        self.heartbeat_timeout = app.config.get('SUPERVISOR_HEARTBEAT_TIMEOUT', 120.0)
+        app.add_url_rule('/health', 'health', self.health_response)
+        app.extensions['supervisor'] = self
+
+    def start(self, app, name, target, workers=1):
+        """Start `workers` supervised threads running `target()` inside an app context."""
+        for index in range(workers):
+            worker = Worker(f"{name}-{index}" if workers > 1 else name, target)
+            with self._lock:
+                self.workers.append(worker)
+            threading.Thread(target=self._supervise, args=(app, worker), name=worker.name, daemon=True).start()
+        app.logger.info(f"Started {workers} supervised {name} thread(s).")
+
+    def heartbeat(self):
+        """Tell the supervisor the calling loop is alive (no-op outside supervised threads)."""
+        worker = getattr(self._current, 'worker', None)
+        if worker is not None:
+            worker.last_heartbeat = time.monotonic()
+
+    def consume(self, connection):
+        """
+        Dispatch a pika connection's deliveries until it closes, sending heartbeats in between.
+        Use instead of channel.start_consuming(); a dropped connection raises, and the supervisor reconnects.
+        """
+        while connection.is_open:
+            connection.process_data_events(time_limit=self.heartbeat_interval)
+            self.heartbeat()
+
+    def health(self):
+        now = time.monotonic()
+        with self._lock:
+            workers = [worker.report(now) for worker in self.workers]
+        healthy = all(
+            worker['state'] == 'running' and worker['seconds_since_heartbeat'] <= self.heartbeat_timeout
+            for worker in workers
+        )
+        return healthy, {"status": "ok" if healthy else "unhealthy", "workers": workers}
+
+    def health_response(self):
+        healthy, body = self.health()
+        return jsonify(body), 200 if healthy else 503
+
+    def _supervise(self, app, worker):
+        self._current.worker = worker
+        failures = 0
+        while True:
+            started = time.monotonic()
+            worker.state = 'running'
+            worker.last_heartbeat = started
+            with app.app_context():
+                try:
+                    worker.target()
+                    worker.last_error = "Stopped"
+                except Exception as e:
+                    worker.last_error = repr(e)
+                current_app.logger.error(f"{worker.name} stopped ({worker.last_error}), restarting.")
+
+            if time.monotonic() - started > self.max_restart_delay:
+                failures = 0
+            delay = min(self.restart_delay * 2 ** failures, self.max_restart_delay)
+            failures += 1
+            worker.state = 'restarting'
+            worker.restarts += 1
+            # Half the delay plus up to half again at random
+            time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+
+supervisor = Supervisor()
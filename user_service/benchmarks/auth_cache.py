@@ -0,0 +1,90 @@
+"""
+Per-request cost of authentication on hot read endpoints, with and without the token and profile caches.
+
+Sends the same requests through the Flask test client for
+ - a role-checked endpoint without database work (/user/notifications/stats), and
+ - /user/profile (one SQLite query per uncached call),
+first with JWT_CACHE_SIZE=0 and USER_PROFILE_CACHE_TTL=0 (every request verifies its token and
+loads the profile), then with the caches on, and reports CPU time and wall time per request.
+
+    cd user_service && python -m benchmarks.auth_cache --requests 5000 --tokens 50
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from flask import Flask
+from flask_jwt_extended import create_access_token
+
+from app.cache import profile_cache
+from app.extensions import db, jwt
+from app.routes import user_bp
+from app.utils import token_cache
+from config import Config
+
+ENDPOINTS = (('role check', '/user/notifications/stats'), ('profile', '/user/profile'))
+
+
+def create_benchmark_app():
+    path = os.path.join(tempfile.mkdtemp(prefix='user_bench_'), 'users.db')
+    app = Flask('user_service_benchmark')
+    app.config.from_object(Config)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f'sqlite:///{path}', JWT_SECRET_KEY='benchmark-secret-key-long-enough')
+    db.init_app(app)
+    jwt.init_app(app)
+    app.register_blueprint(user_bp, url_prefix='/user')
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def configure(app, cached):
+    app.config.update(JWT_CACHE_SIZE=10000 if cached else 0, USER_PROFILE_CACHE_TTL=60 if cached else 0)
+    token_cache.init_app(app)
+    profile_cache.init_app(app)
+
+
+def run(client, path, headers, requests):
+    """Returns (CPU, wall) microseconds per request."""
+    cpu, wall = time.process_time(), time.perf_counter()
+    for index in range(requests):
+        response = client.get(path, headers=headers[index % len(headers)])
+        assert response.status_code == 200, response.get_data(True)
+    return ((time.process_time() - cpu) / requests * 1e6, (time.perf_counter() - wall) / requests * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--tokens', type=int, default=50, help='distinct users (and tokens) taking turns')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    app = create_benchmark_app()
+    client = app.test_client()
+    with app.app_context():
+        headers = [
+            {'Authorization': 'Bearer ' + create_access_token(
+                identity=str(user_id),
+                additional_claims={'role': 'librarian', 'name': f'User {user_id}', 'username': f'user{user_id}'},
+            )}
+            for user_id in range(1, args.tokens + 1)
+        ]
+
+    print(f"requests={args.requests} tokens={args.tokens}")
+    for name, path in ENDPOINTS:
+        results = {}
+        for cached in (False, True):
+            configure(app, cached)
+            # Warm up: the first call of each user creates its profile
+            run(client, path, headers, len(headers))
+            results[cached] = run(client, path, headers, args.requests)
+        (cpu, wall), (cached_cpu, cached_wall) = results[False], results[True]
+        print(f"{name:>10}: uncached {cpu:7.0f} us CPU {wall:7.0f} us wall | "
+              f"cached {cached_cpu:7.0f} us CPU {cached_wall:7.0f} us wall ({cpu / cached_cpu:.2f}x less CPU)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Compare RabbitMQ publish throughput with and without the pooled publisher channels.
+
+By default the publishes go to an in-process stand-in broker that charges a configurable network
+round trip for every synchronous AMQP frame exchange, so the numbers show the handshake cost
+without needing RabbitMQ. Pass --host to run against a real broker instead.
+
+    cd user_service && python -m benchmarks.publisher_pool --threads 8 --messages 2000
+"""
+import argparse
+import threading
+import time
+
+import pika
+
+from app.rabbitmq import RabbitMQ
+
+
+class StandInChannel:
+    def __init__(self, broker):
+        self._broker = broker
+        self._confirms = False
+        self.is_open = True
+
+    def confirm_delivery(self):
+        self._broker.round_trip()
+        self._confirms = True
+
+    def queue_declare(self, queue, **kwargs):
+        self._broker.round_trip()
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if self._confirms:
+            self._broker.round_trip()
+        self._broker.delivered(routing_key)
+
+
+class StandInConnection:
+    # TCP connect + AMQP start/tune/open
+    HANDSHAKE_ROUND_TRIPS = 4
+
+    def __init__(self, broker):
+        self._broker = broker
+        for _ in range(self.HANDSHAKE_ROUND_TRIPS):
+            broker.round_trip()
+        self.is_open = True
+
+    def channel(self):
+        self._broker.round_trip()
+        return StandInChannel(self._broker)
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self._broker.round_trip()
+        self.is_open = False
+
+
+class StandInBroker:
+    """Counts deliveries and sleeps `rtt` seconds for every synchronous frame exchange."""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.connections = 0
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def round_trip(self):
+        time.sleep(self.rtt)
+
+    def delivered(self, routing_key):
+        with self._lock:
+            self.messages += 1
+
+    def connect(self):
+        with self._lock:
+            self.connections += 1
+        return StandInConnection(self)
+
+
+def publish_unpooled(connect, body, properties):
+    """What the services did before: connection, declare, publish and close for every message."""
+    connection = connect()
+    channel = connection.channel()
+    channel.queue_declare(queue='benchmark_queue', durable=True)
+    channel.basic_publish(exchange='', routing_key='benchmark_queue', body=body, properties=properties)
+    connection.close()
+
+
+def run(publish, threads, messages):
+    per_thread = messages // threads
+
+    def worker():
+        for _ in range(per_thread):
+            publish()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--rtt-ms', type=float, default=0.5, help='stand-in broker round trip time')
+    parser.add_argument('--confirms', action='store_true', help='enable publisher confirms')
+    parser.add_argument('--host', help='benchmark against a real RabbitMQ host instead of the stand-in')
+    args = parser.parse_args()
+
+    if args.host:
+        connect = lambda: pika.BlockingConnection(pika.ConnectionParameters(host=args.host))
+    else:
+        broker = StandInBroker(args.rtt_ms / 1000)
+        connect = broker.connect
+
+    body = b'{"user_id": 1, "book_id": 1}'
+    properties = pika.BasicProperties(delivery_mode=2)
+
+    unpooled = run(lambda: publish_unpooled(connect, body, properties), args.threads, args.messages)
+
+    pool = RabbitMQ(pool_size=args.pool_size, confirm_delivery=args.confirms, connection_factory=connect)
+    pooled = run(
+        lambda: pool.publish('benchmark_queue', body, properties=properties, queue_options={'durable': True}),
+        args.threads,
+        args.messages,
+    )
+    pool.close()
+
+    print(f"threads={args.threads} messages={args.messages} confirms={args.confirms}")
+    print(f"connection per message: {unpooled:10.0f} msgs/sec")
+    print(f"pooled channels:        {pooled:10.0f} msgs/sec ({pooled / unpooled:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Availability email throughput: one SMTP session per email against the pooled notification dispatcher.
+
+Runs a local stand-in SMTP server that charges a configurable delay for every command (a slow
+mail server), and feeds the same stream of book-availability events through
+ - the old path: one Flask-Mail send, and so one new SMTP session, per event, and
+ - the Kafka consumer path (collect_notification_batch / deliver_notifications) reading from an
+   in-memory stand-in for the Kafka consumer, with the dispatcher's persistent sessions and digests.
+
+    cd user_service && python -m benchmarks.smtp_dispatch --events 2000 --users 300 --workers 8
+"""
+import argparse
+import logging
+import random
+import socketserver
+import threading
+import time
+from collections import namedtuple
+
+from flask import Flask
+from flask_mail import Mail
+
+from app.broker import collect_notification_batch, deliver_notifications
+from app.extensions import notification_dispatcher
+from app.notifications import build_notification
+from config import Config
+
+Record = namedtuple('Record', 'topic partition offset value')
+
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: every command is accepted after `server.delay` seconds."""
+
+    def reply(self, line):
+        time.sleep(self.server.delay)
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        with self.server.lock:
+            self.server.sessions += 1
+        self.reply("220 stand-in ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-stand-in\r\n250 8BITMIME")
+            elif command.startswith("DATA"):
+                self.reply("354 end with <CRLF>.<CRLF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply("250 queued")
+            elif command.startswith("QUIT"):
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay):
+        super().__init__(('127.0.0.1', 0), StandInSMTPHandler)
+        self.delay = delay
+        self.sessions = 0
+        self.messages = 0
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.sessions = 0
+            self.messages = 0
+
+
+class StandInConsumer:
+    """Serves a fixed list of records from one partition with poll/seek/commit like KafkaConsumer."""
+
+    def __init__(self, events):
+        self.records = [Record('book-availability', 0, offset, event) for offset, event in enumerate(events)]
+        self.position = 0
+        self.committed = 0
+
+    def poll(self, timeout_ms=0, max_records=500):
+        batch = self.records[self.position:self.position + max_records]
+        if not batch:
+            time.sleep(timeout_ms / 1000)
+            return {}
+        self.position += len(batch)
+        return {('book-availability', 0): batch}
+
+    def seek(self, partition, offset):
+        self.position = offset
+
+    def commit(self):
+        self.committed = self.position
+
+
+def make_events(count, users, books, seed=0):
+    rng = random.Random(seed)
+    return [{'user_id': rng.randrange(users), 'book_id': rng.randrange(books)} for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--delay-ms', type=float, default=2, help='stand-in server delay per SMTP command')
+    parser.add_argument('--window-ms', type=float, default=200, help='digest window')
+    parser.add_argument('--baseline-events', type=int, default=300,
+                        help='events sent the old way (it is slow; the rate is extrapolated)')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    server = StandInSMTPServer(args.delay_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    app = Flask('user_service_benchmark')
+    app.config.from_object(Config)
+    app.config.update(
+        MAIL_SERVER='127.0.0.1', MAIL_PORT=server.server_address[1], MAIL_USE_TLS=False,
+        MAIL_USERNAME=None, MAIL_PASSWORD=None,
+        NOTIFICATION_WORKERS=args.workers, NOTIFICATION_DIGEST_WINDOW_MS=args.window_ms,
+    )
+    mail = Mail(app)
+    notification_dispatcher.init_app(app)
+    events = make_events(args.events, args.users, args.books)
+
+    with app.app_context():
+        started = time.perf_counter()
+        for event in events[:args.baseline_events]:
+            mail.send(build_notification(event['user_id'], [event['book_id']]))
+        baseline = args.baseline_events / (time.perf_counter() - started)
+        baseline_sessions = server.sessions
+
+        server.reset()
+        notification_dispatcher.start(app)
+        consumer = StandInConsumer(events)
+        started = time.perf_counter()
+        delivered = set()
+        while consumer.committed < len(events):
+            records = collect_notification_batch(consumer)
+            if records:
+                deliver_notifications(consumer, records, delivered)
+        pooled = args.events / (time.perf_counter() - started)
+        notification_dispatcher.stop()
+
+    print(f"events={args.events} users={args.users} workers={args.workers} smtp delay={args.delay_ms}ms")
+    print(f"session per email: {baseline:8.0f} events/sec ({baseline_sessions} sessions "
+          f"for {args.baseline_events} events)")
+    print(f"dispatcher:        {pooled:8.0f} events/sec ({pooled / baseline:.1f}x, {server.sessions} sessions, "
+          f"{server.messages} digest emails for {args.events} events)")
+
+
+if __name__ == '__main__':
+    main()
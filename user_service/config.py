@@ -12,6 +12,56 @@ class Config:
 
     # JWT configuration
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
+    # Verified access tokens remembered (until they expire) so repeat requests skip verification; 0 turns it off
+    JWT_CACHE_SIZE = int(os.getenv('JWT_CACHE_SIZE', 10000))
+    # Seconds a /user/profile response is served from memory (0 turns the cache off), and how many are kept
+    USER_PROFILE_CACHE_TTL = float(os.getenv('USER_PROFILE_CACHE_TTL', 60))
+    USER_PROFILE_CACHE_SIZE = int(os.getenv('USER_PROFILE_CACHE_SIZE', 10000))
+
+    # RabbitMQ configuration
+    RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'rabbitmq')
+    # Long-lived publisher channels shared by request and consumer threads
+    RABBITMQ_PUBLISHER_POOL_SIZE = int(os.getenv('RABBITMQ_PUBLISHER_POOL_SIZE', 8))
+    # Wait for a broker ack on every publish (slower, but a returned publish is guaranteed to be stored)
+    RABBITMQ_PUBLISHER_CONFIRMS = os.getenv('RABBITMQ_PUBLISHER_CONFIRMS', 'false').lower() == 'true'
+
+    # Seconds a borrow/return request waits for the Book Service reply before timing out
+    RPC_REPLY_TIMEOUT = float(os.getenv('RPC_REPLY_TIMEOUT', 20))
+    # Seconds an asynchronous borrow result stays available for polling
+    ASYNC_RESULT_TTL = float(os.getenv('ASYNC_RESULT_TTL', 300))
+    # Seconds between reads of an asynchronous borrow result while its event stream waits for it
+    ASYNC_RESULT_POLL_INTERVAL = float(os.getenv('ASYNC_RESULT_POLL_INTERVAL', 0.5))
+    # Seconds between keepalive comments on the borrow server-sent events stream
+    SSE_KEEPALIVE_INTERVAL = float(os.getenv('SSE_KEEPALIVE_INTERVAL', 15))
+
+    # Whether the web process also consumes availability events and sends the emails; the production WSGI entry
+    # point (wsgi.py) turns this off and leaves them to worker.py
+    CONSUMERS_ENABLED = os.getenv('CONSUMERS_ENABLED', 'true').lower() == 'true'
+    # Availability emails: worker threads, each with its own persistent SMTP session
+    NOTIFICATION_WORKERS = int(os.getenv('NOTIFICATION_WORKERS', 4))
+    # Emails that may wait for a worker before the Kafka consumer is held back
+    NOTIFICATION_QUEUE_SIZE = int(os.getenv('NOTIFICATION_QUEUE_SIZE', 1000))
+    # Delivery attempts per email before its batch is retried from Kafka
+    NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 3))
+    # Events for the same user that arrive within this window are sent as one digest email
+    NOTIFICATION_DIGEST_WINDOW_MS = float(os.getenv('NOTIFICATION_DIGEST_WINDOW_MS', 2000))
+    # Most events read from Kafka per batch (also the consumer's max_poll_records)
+    NOTIFICATION_MAX_BATCH = int(os.getenv('NOTIFICATION_MAX_BATCH', 500))
+    # Kafka consumer threads in the notification group; up to one per partition of book-availability is useful
+    NOTIFICATION_CONSUMERS = int(os.getenv('NOTIFICATION_CONSUMERS', 1))
+    # Where a consumer group without committed offsets starts reading: earliest or latest
+    KAFKA_AUTO_OFFSET_RESET = os.getenv('KAFKA_AUTO_OFFSET_RESET', 'earliest')
+    # Seconds to wait before re-reading a batch whose emails could not all be delivered
+    NOTIFICATION_RETRY_BACKOFF = float(os.getenv('NOTIFICATION_RETRY_BACKOFF', 5))
+    # Background consumer threads are restarted after this many seconds, doubling after every failure
+    SUPERVISOR_RESTART_DELAY = float(os.getenv('SUPERVISOR_RESTART_DELAY', 1))
+    SUPERVISOR_MAX_RESTART_DELAY = float(os.getenv('SUPERVISOR_MAX_RESTART_DELAY', 60))
+    # Seconds between consumer heartbeats, and without one before /health reports the service unhealthy
+    SUPERVISOR_HEARTBEAT_INTERVAL = float(os.getenv('SUPERVISOR_HEARTBEAT_INTERVAL', 5))
+    SUPERVISOR_HEARTBEAT_TIMEOUT = float(os.getenv('SUPERVISOR_HEARTBEAT_TIMEOUT', 120))
+    # worker.py: consumer processes to run, and the first port they serve /health and /metrics on (0: none)
+    WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 1))
+    WORKER_HEALTH_PORT = int(os.getenv('WORKER_HEALTH_PORT', 0))
 
     MAIL_SERVER = 'smtp.gmail.com'
     MAIL_PORT = 587
@@ -19,3 +69,6 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME', 'aminad41@gmail.com')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', 'wbse iged pezl bgqz')
     MAIL_DEFAULT_SENDER = 'noreply@yourdomain.com'
+
+    # Serve request, SQL and broker metrics on /metrics (Prometheus text format)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
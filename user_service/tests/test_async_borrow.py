@@ -0,0 +1,109 @@
+"""
+Asynchronous borrow results can be read from any API process, whichever one stored the reply. Run from user_service/:
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from flask import Flask
+from flask_jwt_extended import create_access_token
+
+from app import broker, routes
+from app.extensions import db, jwt
+from app.routes import user_bp
+from config import Config
+
+USER_ID = 1
+REPLY = {"user_id": USER_ID, "status": "success", "message": "Book borrowed successfully"}
+
+
+class AsyncBorrowAcrossProcessesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory(prefix='user_tests_')
+        database = f"sqlite:///{os.path.join(self.directory.name, 'users.db')}"
+        # Two apps on one database stand in for two gunicorn workers
+        self.apps = [self.create_app(database) for _ in range(2)]
+        with self.apps[0].app_context():
+            db.create_all()
+            self.token = create_access_token(identity=str(USER_ID), additional_claims={'role': 'user'})
+            self.other_token = create_access_token(identity=str(USER_ID + 1), additional_claims={'role': 'user'})
+
+    def tearDown(self):
+        for app in self.apps:
+            with app.app_context():
+                db.session.remove()
+                db.engine.dispose()
+        self.directory.cleanup()
+
+    @staticmethod
+    def create_app(database):
+        app = Flask(__name__)
+        app.config.from_object(Config)
+        app.config.update(
+            SQLALCHEMY_DATABASE_URI=database,
+            JWT_SECRET_KEY='test-secret-key-that-is-long-enough',
+            ASYNC_RESULT_POLL_INTERVAL=0.05,
+        )
+        db.init_app(app)
+        jwt.init_app(app)
+        app.register_blueprint(user_bp, url_prefix='/user')
+        return app
+
+    def get(self, app, path, token=None):
+        return app.test_client().get(path, headers={'Authorization': f'Bearer {token or self.token}'})
+
+    def borrow(self):
+        """Send an asynchronous borrow through the first process; returns its request id."""
+        with mock.patch.object(routes, 'send_borrow_request') as send:
+            response = self.apps[0].test_client().post(
+                '/user/borrow?async=true',
+                json={'user_id': USER_ID, 'book_id': 1},
+                headers={'Authorization': f'Bearer {self.token}'},
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(send.call_args.kwargs['asynchronous'])
+        return response.get_json()['request_id']
+
+    def reply(self, app, request_id):
+        """The Book Service reply, consumed by `app`'s process."""
+        with app.app_context():
+            broker.handle_async_borrow_response(SimpleNamespace(correlation_id=request_id), json.dumps(REPLY))
+
+    def test_result_stored_by_one_process_is_served_by_another(self):
+        request_id = self.borrow()
+        self.assertEqual(self.get(self.apps[1], f'/user/borrow/{request_id}').status_code, 202)
+
+        self.reply(self.apps[1], request_id)
+
+        for app in self.apps:
+            response = self.get(app, f'/user/borrow/{request_id}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['status'], 'success')
+        self.assertEqual(self.get(self.apps[0], f'/user/borrow/{request_id}', self.other_token).status_code, 404)
+
+    def test_event_stream_gets_a_reply_stored_by_another_process(self):
+        request_id = self.borrow()
+        stream = self.get(self.apps[0], f'/user/borrow/{request_id}/events')
+        events = stream.response
+        self.assertEqual(next(events), b": keepalive\n\n")
+
+        self.reply(self.apps[1], request_id)
+
+        self.assertTrue(b"".join(events).startswith(b"event: result\n"))
+
+    def test_late_reply_is_not_stored_twice(self):
+        request_id = self.borrow()
+        with self.apps[1].app_context():
+            self.assertTrue(broker.async_borrows.resolve(request_id, REPLY))
+            self.assertFalse(broker.async_borrows.resolve(request_id, dict(REPLY, status='failure')))
+        self.assertEqual(self.get(self.apps[0], f'/user/borrow/{request_id}').get_json()['status'], 'success')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+The availability notification consumer on a quiet topic, and when some emails fail. Run from user_service/:
+
+    python -m unittest discover tests
+"""
+import smtplib
+import time
+import unittest
+from collections import namedtuple
+from concurrent.futures import Future
+from unittest import mock
+
+from flask import Flask
+
+from app import broker
+from app.supervisor import supervisor
+from config import Config
+
+Record = namedtuple('Record', 'topic partition offset value')
+
+
+class IdleConsumer:
+    """KafkaConsumer stand-in for a topic nobody publishes to."""
+
+    def __init__(self, *topics, max_polls=None, **config):
+        self.polls = 0
+        self.max_polls = max_polls
+
+    def poll(self, timeout_ms=0, max_records=None):
+        self.polls += 1
+        if self.max_polls is not None and self.polls > self.max_polls:
+            raise AssertionError(f"Polled {self.polls} times without returning")
+        time.sleep(timeout_ms / 1000)
+        return {}
+
+    def close(self, autocommit=True):
+        pass
+
+
+class IdleNotificationConsumerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.from_object(Config)
+
+    def test_empty_batch_after_one_idle_poll(self):
+        consumer = IdleConsumer(max_polls=1)
+        started = time.monotonic()
+        with self.app.app_context():
+            self.assertEqual(broker.collect_notification_batch(consumer), [])
+        self.assertEqual(consumer.polls, 1)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_idle_consumer_keeps_sending_heartbeats(self):
+        supervisor.init_app(self.app)
+        with mock.patch.object(broker, 'KafkaConsumer', IdleConsumer):
+            supervisor.start(self.app, 'idle notification consumer', broker.start_kafka_notification_consumer)
+            worker = supervisor.workers[-1]
+            for _ in range(4):
+                time.sleep(1)
+                self.assertEqual(worker.state, 'running')
+                # One poll lasts a second, and a heartbeat follows every poll
+                self.assertLess(time.monotonic() - worker.last_heartbeat, 1.5)
+            self.assertEqual(worker.restarts, 0)
+
+
+class RewindableConsumer:
+    """KafkaConsumer stand-in recording where it was rewound to and whether the batch was committed."""
+
+    def __init__(self):
+        self.seeks = []
+        self.commits = 0
+
+    def seek(self, partition, offset):
+        self.seeks.append((partition.partition, offset))
+
+    def commit(self):
+        self.commits += 1
+
+
+class PartialDeliveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.from_object(Config)
+        self.app.config['NOTIFICATION_RETRY_BACKOFF'] = 0
+        self.records = [
+            Record('book-availability', 0, 10, {'book_id': 1, 'user_ids': [1, 2]}),
+            Record('book-availability', 0, 11, {'book_id': 2, 'user_ids': [3]}),
+        ]
+        self.emailed = []
+        self.failing = True
+
+    def submit(self, digest):
+        """Dispatcher stand-in: the first email to user 2 fails."""
+        future = Future()
+        self.emailed.append(digest)
+        if digest[0] == 2 and self.failing:
+            self.failing = False
+            future.set_exception(smtplib.SMTPServerDisconnected("Connection unexpectedly closed"))
+        else:
+            future.set_result(True)
+        return future
+
+    def test_only_failed_emails_are_sent_again(self):
+        consumer = RewindableConsumer()
+        delivered = set()
+        with self.app.app_context(), \
+                mock.patch.object(broker, 'build_notification', lambda user_id, book_ids: (user_id, book_ids)), \
+                mock.patch.object(broker.notification_dispatcher, 'submit', self.submit):
+            self.assertFalse(broker.deliver_notifications(consumer, self.records, delivered))
+            self.assertEqual(consumer.seeks, [(0, 10)])
+            self.assertEqual(consumer.commits, 0)
+            self.emailed.clear()
+
+            # The batch is read again: only the failed digest goes out
+            self.assertTrue(broker.deliver_notifications(consumer, self.records, delivered))
+        self.assertEqual(self.emailed, [(2, [1])])
+        self.assertEqual(consumer.commits, 1)
+        self.assertEqual(delivered, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,9 @@ until curl -s -u guest:guest http://rabbitmq:15672/api/overview > /dev/null; do
     sleep 5
 done
 
-# Once RabbitMQ is healthy, start the Flask application
+# Once RabbitMQ is healthy, start the given command (e.g. gunicorn or worker.py), or the Flask dev server
 echo "RabbitMQ is healthy, starting User Service..."
+if [ "$#" -gt 0 ]; then
+    exec "$@"
+fi
 exec flask run  # Or the command to start your Flask app
@@ -0,0 +1,107 @@
+"""
+Runs the User Service's availability notification consumers and email dispatcher without serving the API, so
+consumer capacity scales apart from the web processes (which run wsgi.py with the consumers off).
+
+    python worker.py [--processes N] [--threads N]
+
+--processes (WORKER_PROCESSES) starts that many consumer processes, each with its own Kafka consumers, SMTP
+sessions and database pool. --threads sets the Kafka consumer threads in each process (NOTIFICATION_CONSUMERS);
+all of them share the notification consumer group, and more than one per partition of book-availability sits
+idle. A process that exits is started again; SIGTERM or SIGINT stops them all.
+With WORKER_HEALTH_PORT set, process i serves /health and /metrics on that port + i.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from werkzeug.exceptions import NotFound
+from werkzeug.serving import make_server
+
+THREAD_SETTINGS = ('NOTIFICATION_CONSUMERS',)
+# Paths a worker process answers on WORKER_HEALTH_PORT
+HEALTH_PATHS = ('/health', '/metrics')
+# Seconds to wait before starting a process that exited again
+RESTART_DELAY = 5
+
+logger = logging.getLogger('worker')
+
+
+def monitoring_only(app):
+    """The app's /health and /metrics; the API itself is served by the web processes."""
+    def wsgi_app(environ, start_response):
+        if environ.get('PATH_INFO') not in HEALTH_PATHS:
+            return NotFound()(environ, start_response)
+        return app(environ, start_response)
+    return wsgi_app
+
+
+def run(index):
+    """Body of one worker process: start the consumers and wait for a signal to stop."""
+    from app import create_app
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+    signal.signal(signal.SIGINT, lambda *args: stopped.set())
+
+    app = create_app(consumers=True, web=False)
+    port = app.config['WORKER_HEALTH_PORT']
+    if port:
+        server = make_server('0.0.0.0', port + index, monitoring_only(app), threaded=True)
+        threading.Thread(target=server.serve_forever, name='health server', daemon=True).start()
+    app.logger.info(f"Worker {index} is consuming.")
+    stopped.wait()
+    # Consumer threads are daemons; events whose offsets were not committed are read again by the group
+    app.logger.info(f"Worker {index} stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        # Read by config.py, here and in the spawned processes, which inherit the environment
+        for setting in THREAD_SETTINGS:
+            os.environ[setting] = str(args.threads)
+    from config import Config
+
+    count = args.processes or Config.WORKER_PROCESSES
+    if count <= 1:
+        run(0)
+        return
+
+    # Fresh interpreters: each process opens its own connections after it starts
+    context = multiprocessing.get_context('spawn')
+    stopping = threading.Event()
+
+    def start(index):
+        process = context.Process(target=run, args=(index,), name=f'worker-{index}')
+        process.start()
+        return process
+
+    def stop(*_):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    processes = [start(index) for index in range(count)]
+    while not stopping.wait(1):
+        for index, process in enumerate(processes):
+            if not process.is_alive() and not stopping.is_set():
+                logger.error(f"Worker {index} exited with code {process.exitcode}, restarting it.")
+                time.sleep(RESTART_DELAY)
+                processes[index] = start(index)
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
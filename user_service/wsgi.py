@@ -0,0 +1,9 @@
+"""
+Production entry point: gunicorn --bind 0.0.0.0:5000 --workers 2 --threads 8 wsgi:app
+
+Serves the API with the notification consumers off; run them with worker.py. Do not use --preload: each
+gunicorn worker must start its own background threads after the fork.
+"""
+from app import create_app
+
+app = create_app(consumers=False)